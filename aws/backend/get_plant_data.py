@@ -1,6 +1,12 @@
+import gzip
+import hashlib
 import json
 import os
+import time
 import boto3
+from botocore.exceptions import ClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Initialize AWS clients
@@ -8,6 +14,34 @@ s3_client = boto3.client('s3')
 
 # Environment variables
 PLANT_DATA_BUCKET = os.environ.get('PLANT_DATA_BUCKET')
+# Plant có pointer latest/ (writer ghi theo PLANT_ID); chỉ plant này được backfill pointer
+PLANT_ID = os.environ.get('PLANT_ID', 'plant_001')
+# Fallback khi chưa có pointer chỉ list 1 trang (tối đa FALLBACK_MAX_KEYS key), không phân trang cả lịch sử
+FALLBACK_MAX_KEYS = int(os.environ.get('FALLBACK_MAX_KEYS', '1000'))
+# Cache trong container warm: các lần poll trong khoảng này không gọi S3
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '5'))
+# plant_id do client gửi lên: giới hạn số entry để cache không phình vô hạn (LRU)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '256'))
+# Cache-Control max-age gửi cho browser / CDN; hết hạn thì revalidate bằng If-None-Match
+CACHE_MAX_AGE = int(os.environ.get('CACHE_MAX_AGE', '5'))
+# Presigned URL sống PRESIGN_EXPIRES giây; ETag đổi mỗi PRESIGN_EXPIRES/2 để client đang giữ
+# bản 304 luôn có URL còn hạn ít nhất nửa thời gian
+PRESIGN_EXPIRES = int(os.environ.get('PRESIGN_EXPIRES', '3600'))
+
+# Tạo một lần cho mỗi container, dùng lại giữa các invocation
+executor = ThreadPoolExecutor(max_workers=3)
+# plant_id -> (expires_at, etag, body), thứ tự LRU (cuối = dùng gần nhất)
+response_cache = OrderedDict()
+
+
+def cache_response(plant_id, now, etag, body):
+    """Ghi vào cache: bỏ entry đã hết hạn rồi evict entry cũ nhất nếu vượt RESPONSE_CACHE_SIZE."""
+    for key in [k for k, v in response_cache.items() if v[0] <= now]:
+        del response_cache[key]
+    response_cache[plant_id] = (now + CACHE_TTL_SECONDS, etag, body)
+    response_cache.move_to_end(plant_id)
+    while len(response_cache) > RESPONSE_CACHE_SIZE:
+        response_cache.popitem(last=False)
 
 
 def lambda_handler(event, context):
@@ -18,7 +52,7 @@ def lambda_handler(event, context):
         print("Event received:", json.dumps(event))  # Debug log
 
         # Extract plant_id from path parameters
-        plant_id = event.get('pathParameters', {}).get('plant_id')
+        plant_id = (event.get('pathParameters') or {}).get('plant_id')
         
         if not plant_id:
             return {
@@ -26,35 +60,24 @@ def lambda_handler(event, context):
                 'headers': get_cors_headers(),
                 'body': json.dumps({'error': 'plant_id is required'})
             }
-        
-        # 1. Get AI evaluation from S3
-        ai_evaluation = get_latest_result_from_s3()
-        
-        # 2. Get latest image from S3
-        image_url = get_latest_image_url(plant_id)
-        
-        # 3. Get latest sensor data
-        sensor_data = get_latest_sensor_data()
-
-        # Combine data
-        response_data = {
-            'plant_id': plant_id,
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'metrics': {
-                'ai_evaluation': ai_evaluation,
-                'soil_moisture': sensor_data.get('soil_moisture') if sensor_data else None,
-                'rain': sensor_data.get('rain') if sensor_data else None,
-                'temperature': sensor_data.get('temperature') if sensor_data else None,
-                'humidity': sensor_data.get('humidity') if sensor_data else None,
-                # 'light': sensor_data.get('light_level') if sensor_data else None
-            },
-            'image_url': image_url
-        }
-        
+
+        now = time.time()
+        cached = response_cache.get(plant_id)
+        if cached and cached[0] > now:
+            response_cache.move_to_end(plant_id)
+            etag, body = cached[1], cached[2]
+        else:
+            etag, body = build_response(plant_id, now)
+            cache_response(plant_id, now, etag, body)
+
+        headers = get_cors_headers(cacheable=True)
+        headers['ETag'] = etag
+        if etag in parse_if_none_match(event):
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
         return {
             'statusCode': 200,
-            'headers': get_cors_headers(),
-            'body': json.dumps(response_data)
+            'headers': headers,
+            'body': body
         }
         
     except Exception as e:
@@ -66,82 +89,210 @@ def lambda_handler(event, context):
         }
 
 
-def get_cors_headers():
-    return {
+def build_response(plant_id, now):
+    """Đọc 3 nguồn song song; trả về (etag, body JSON)."""
+    ai_future = executor.submit(get_latest_result_from_s3, plant_id)
+    image_future = executor.submit(get_latest_image_key, plant_id)
+    sensor_future = executor.submit(get_latest_sensor_data, plant_id)
+    ai_evaluation = ai_future.result()
+    image_key = image_future.result()
+    sensor_data = sensor_future.result()
+
+    metrics = {
+        'ai_evaluation': ai_evaluation,
+        'soil_moisture': sensor_data.get('soil_moisture') if sensor_data else None,
+        'rain': sensor_data.get('rain') if sensor_data else None,
+        'temperature': sensor_data.get('temperature') if sensor_data else None,
+        'humidity': sensor_data.get('humidity') if sensor_data else None,
+        # 'light': sensor_data.get('light_level') if sensor_data else None
+    }
+
+    # ETag theo nội dung (không theo timestamp / chữ ký URL), cộng thêm cửa sổ presign
+    presign_window = int(now // max(PRESIGN_EXPIRES // 2, 1))
+    state = json.dumps([plant_id, metrics, image_key, presign_window], sort_keys=True, default=str)
+    etag = '"' + hashlib.blake2b(state.encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+    response_data = {
+        'plant_id': plant_id,
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'metrics': metrics,
+        'image_url': presign_image_url(image_key)
+    }
+    return etag, json.dumps(response_data)
+
+
+def parse_if_none_match(event):
+    headers = event.get('headers') or {}
+    value = next((v for k, v in headers.items() if k.lower() == 'if-none-match'), None)
+    if not value:
+        return set()
+    return {tag.strip().removeprefix('W/') for tag in value.split(',')}
+
+
+def get_cors_headers(cacheable=False):
+    headers = {
         'Content-Type': 'application/json',
         'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Cache-Control,Pragma,Expires',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Cache-Control,Pragma,Expires,If-None-Match',
         'Access-Control-Allow-Methods': 'GET,OPTIONS',
-        'Cache-Control': 'no-store, no-cache, must-revalidate, max-age=0',
-        'Pragma': 'no-cache'
+        'Access-Control-Expose-Headers': 'ETag',
     }
+    if cacheable:
+        # private: body chứa presigned URL, không để CDN dùng chung
+        headers['Cache-Control'] = f'private, max-age={CACHE_MAX_AGE}, must-revalidate'
+    else:
+        headers['Cache-Control'] = 'no-store'
+    return headers
+
+
+# =======================
+# LATEST POINTERS
+# =======================
+# Writer (cloud_server/inference.py, mqtt_bridge.py, hivemq_processor.py) ghi đè một object nhỏ
+# mỗi khi có dữ liệu mới, nên đọc "latest" chỉ tốn 1 GET / metric, không phụ thuộc số object lịch sử.
+# Key = <DATA_PATH_PREFIX>latest/<plant_id>/<metric>.json; mỗi writer có latest_pointer_key() cùng quy tắc
+# và đọc cùng env DATA_PATH_PREFIX / PLANT_ID:
+#   latest/<plant_id>/ai_evaluation.json   {"result", "confidence", "result_key", "updated_at"}
+#   latest/<plant_id>/image.json           {"key", "updated_at"}
+#   latest/<plant_id>/sensors/<topic>.json record giống hệt raw_data/<topic>/...json
+# Chưa có pointer (dữ liệu cũ) thì fallback list 1 trang của prefix; với PLANT_ID, kết quả được ghi
+# làm pointer (If-None-Match, không đè writer) nên chỉ lần poll đầu tiên phải list.
+
 
+def latest_pointer_key(plant_id, metric):
+    data_prefix = os.environ.get('DATA_PATH_PREFIX', '')
+    return f"{data_prefix}latest/{plant_id}/{metric}.json"
 
-def get_latest_result_from_s3():
+
+def read_pointer(plant_id, metric):
+    """GET pointer object; None nếu chưa tồn tại."""
     try:
+        obj = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=latest_pointer_key(plant_id, metric))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(obj['Body'].read().decode('utf-8'))
+
+
+def find_latest_object(prefix, suffixes=None):
+    """
+    Fallback: 1 lần list (1 trang) rồi lấy object mới nhất theo LastModified (trùng giây thì key lớn hơn,
+    key có timestamp); None nếu không có. Prefix quá FALLBACK_MAX_KEYS key chỉ xét trang đầu, pointer
+    backfill từ kết quả này sẽ được writer ghi đè ngay khi có dữ liệu mới.
+    """
+    response = s3_client.list_objects_v2(Bucket=PLANT_DATA_BUCKET, Prefix=prefix, MaxKeys=FALLBACK_MAX_KEYS)
+    latest = None
+    for obj in response.get('Contents', []):
+        if suffixes and not obj['Key'].lower().endswith(suffixes):
+            continue
+        if latest is None or (obj['LastModified'], obj['Key']) > (latest['LastModified'], latest['Key']):
+            latest = obj
+    return latest
+
+
+def iso_ms(dt):
+    """datetime (UTC) -> '2025-11-25T13:36:42.123Z', cùng format updated_at của writer."""
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def backfill_pointer(plant_id, metric, data):
+    """Ghi pointer từ kết quả fallback; writer đã ghi trước (412) hoặc thiếu quyền thì bỏ qua."""
+    if plant_id != PLANT_ID:
+        return
+    try:
+        s3_client.put_object(
+            Bucket=PLANT_DATA_BUCKET,
+            Key=latest_pointer_key(plant_id, metric),
+            Body=json.dumps(data),
+            ContentType='application/json',
+            CacheControl='no-cache',
+            IfNoneMatch='*'
+        )
+    except ClientError as e:
+        print(f"Pointer backfill {metric} skipped: {e.response['Error']['Code']}")
+
+
+def format_evaluation(result_text):
+    result_text = result_text.strip().lower()
+    if 'bacterial' in result_text:
+        return 'Plant is bacterial'
+    elif 'fungal' in result_text:
+        return 'Plant is fungal'
+    elif 'healthy' in result_text:
+        return 'Plant is healthy'
+    else:
+        return result_text.capitalize()
+
+
+def get_latest_result_from_s3(plant_id):
+    try:
+        pointer = read_pointer(plant_id, 'ai_evaluation')
+        if pointer is not None:
+            return format_evaluation(pointer.get('result', ''))
+
         data_prefix = os.environ.get('DATA_PATH_PREFIX', '')
         prefix = f"{data_prefix}results/" if data_prefix else "results/"
-        
-        response = s3_client.list_objects_v2(Bucket=PLANT_DATA_BUCKET, Prefix=prefix, MaxKeys=1000)
-        
-        if 'Contents' not in response or len(response['Contents']) == 0:
+        latest = find_latest_object(prefix)
+        if latest is None:
             return 'Unknown'
-        
-        latest_file = sorted(response['Contents'], key=lambda x: x['LastModified'], reverse=True)[0]
-        
-        obj = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=latest_file['Key'])
-        result_text = obj['Body'].read().decode('utf-8').strip().lower()
-        
-        if 'bacterial' in result_text:
-            return 'Plant is bacterial'
-        elif 'fungal' in result_text:
-            return 'Plant is fungal'
-        elif 'healthy' in result_text:
-            return 'Plant is healthy'
-        else:
-            return result_text.capitalize()
+
+        obj = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=latest['Key'])
+        text = obj['Body'].read().decode('utf-8')
+        lines = text.strip().splitlines() or ['']
+        try:
+            confidence = float(lines[1]) if len(lines) > 1 else None
+        except ValueError:
+            confidence = None
+        backfill_pointer(plant_id, 'ai_evaluation', {'result': lines[0].strip(), 'confidence': confidence,
+                                                     'result_key': latest['Key'],
+                                                     'updated_at': iso_ms(latest['LastModified'])})
+        return format_evaluation(text)
     except:
         return 'Unknown'
 
 
-def get_latest_image_url(plant_id):
+def get_latest_image_key(plant_id):
     try:
+        pointer = read_pointer(plant_id, 'image')
+        if pointer is not None:
+            return pointer['key']
         data_prefix = os.environ.get('DATA_PATH_PREFIX', '')
         prefix = f"{data_prefix}images/" if data_prefix else "images/"
-        
-        response = s3_client.list_objects_v2(Bucket=PLANT_DATA_BUCKET, Prefix=prefix, MaxKeys=1000)
-        
-        if 'Contents' not in response:
-            return None
-        
-        valid_images = [obj for obj in response['Contents'] if obj['Key'].lower().endswith(('.jpg', '.jpeg', '.png'))]
-        if not valid_images:
+        latest = find_latest_object(prefix, ('.jpg', '.jpeg', '.png'))
+        if latest is None:
             return None
+        backfill_pointer(plant_id, 'image', {'key': latest['Key'], 'updated_at': iso_ms(latest['LastModified'])})
+        return latest['Key']
+    except:
+        return None
 
-        latest_file = sorted(valid_images, key=lambda x: x['LastModified'], reverse=True)[0]
-        
-        return s3_client.generate_presigned_url('get_object', Params={'Bucket': PLANT_DATA_BUCKET, 'Key': latest_file['Key']}, ExpiresIn=3600)
+
+def presign_image_url(image_key):
+    if image_key is None:
+        return None
+    try:
+        return s3_client.generate_presigned_url('get_object', Params={'Bucket': PLANT_DATA_BUCKET, 'Key': image_key}, ExpiresIn=PRESIGN_EXPIRES)
     except:
         return None
 
 
-def get_latest_sensor_data():
+def get_latest_sensor_data(plant_id):
     """
     ĐÃ IMPORT từ file thứ nhất – giữ nguyên format raw_data/esp32s3/soil/yyyy...
     """
     try:
         mqtt_topic = os.environ.get('MQTT_TOPIC', 'esp32s3/sensors')
-        prefix = f"raw_data/{mqtt_topic}/"
-
-        response = s3_client.list_objects_v2(Bucket=PLANT_DATA_BUCKET, Prefix=prefix, MaxKeys=1000)
-
-        if 'Contents' not in response:
-            return None
-        
-        latest_file = sorted(response['Contents'], key=lambda x: x['LastModified'], reverse=True)[0]
-        
-        obj = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=latest_file['Key'])
-        data = json.loads(obj['Body'].read().decode('utf-8'))
+        data = read_pointer(plant_id, f"sensors/{mqtt_topic}")
+        if data is None:
+            latest = find_latest_object(f"raw_data/{mqtt_topic}/")
+            if latest is None:
+                return None
+            latest_key = latest['Key']
+            body = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=latest_key)['Body'].read()
+            if latest_key.endswith('.gz'):
+                body = gzip.decompress(body)
+            # Batch NDJSON của mqtt_bridge: record cuối là mới nhất
+            data = json.loads(body.splitlines()[-1] if latest_key.endswith(('.ndjson', '.ndjson.gz')) else body)
+            backfill_pointer(plant_id, f"sensors/{mqtt_topic}", data)
         payload = data.get('payload', {})
 
         return {
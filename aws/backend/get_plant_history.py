@@ -0,0 +1,385 @@
+import gzip
+import io
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+# numpy đến từ Lambda layer (terraform: numpy_layer_arns, bắt buộc)
+import numpy as np
+
+# Initialize AWS clients
+s3_client = boto3.client('s3')
+
+# Environment variables
+PLANT_DATA_BUCKET = os.environ.get('PLANT_DATA_BUCKET')
+SENSOR_METRICS = ('soil_moisture', 'temperature', 'humidity', 'rain')
+AI_LABELS = ('bacterial', 'fungal', 'healthy')
+# Giới hạn khoảng thời gian / số bucket mỗi request
+MAX_RANGE_DAYS = int(os.environ.get('HISTORY_MAX_RANGE_DAYS', '90'))
+MAX_BUCKETS = int(os.environ.get('HISTORY_MAX_BUCKETS', '1000'))
+DEFAULT_BUCKETS = int(os.environ.get('HISTORY_DEFAULT_BUCKETS', '200'))
+# Số GET song song khi đọc object lẻ
+FETCH_WORKERS = int(os.environ.get('HISTORY_FETCH_WORKERS', '32'))
+# Object raw_data / results không bao giờ bị sửa: cache record đã parse trong container warm,
+# lần poll sau chỉ GET object mới
+OBJECT_CACHE_SIZE = int(os.environ.get('HISTORY_OBJECT_CACHE_SIZE', '50000'))
+CACHE_MAX_AGE = int(os.environ.get('HISTORY_CACHE_MAX_AGE', '30'))
+# Index compaction được đọc lại sau INDEX_TTL giây
+INDEX_TTL = float(os.environ.get('HISTORY_INDEX_TTL', '60'))
+
+executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+# Riêng cho 2 loader (sensor / AI) để không chiếm chỗ của các GET mà chúng chờ
+loader_executor = ThreadPoolExecutor(max_workers=2)
+object_cache = OrderedDict()
+# topic -> (expires_at, index)
+index_cache = {}
+
+RAW_KEY_TIME = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})')
+RESULT_KEY_TIME = re.compile(r'results/(\d+)')
+
+
+def lambda_handler(event, context):
+    """
+    GET /plant/{plant_id}/history?start=...&end=...&buckets=200
+
+    start/end: ISO 8601 hoặc epoch giây (mặc định 24h gần nhất). Trả về sensor metrics
+    (min/max/avg/count mỗi bucket) và kết quả AI (số lần mỗi nhãn + confidence trung bình).
+    """
+    try:
+        plant_id = (event.get('pathParameters') or {}).get('plant_id')
+        if not plant_id:
+            return error_response(400, 'plant_id is required')
+
+        params = event.get('queryStringParameters') or {}
+        try:
+            end = parse_time(params.get('end'), default=time.time())
+            start = parse_time(params.get('start'), default=end - 86400)
+            buckets = int(params.get('buckets', DEFAULT_BUCKETS))
+        except ValueError as e:
+            return error_response(400, str(e))
+        if start >= end:
+            return error_response(400, 'start must be before end')
+        if end - start > MAX_RANGE_DAYS * 86400:
+            return error_response(400, f'range is limited to {MAX_RANGE_DAYS} days')
+        buckets = max(1, min(buckets, MAX_BUCKETS))
+        interval = (end - start) / buckets
+
+        sensor_future = loader_executor.submit(load_sensor_records, start, end)
+        ai_future = loader_executor.submit(load_ai_records, start, end)
+        sensor_times, sensor_values = sensor_future.result()
+        ai_times, ai_labels, ai_confidence = ai_future.result()
+
+        response_data = {
+            'plant_id': plant_id,
+            'start': iso(start),
+            'end': iso(end),
+            'interval_seconds': interval,
+            'bucket_start': [iso(start + i * interval) for i in range(buckets)],
+            'sensors': {
+                metric: downsample(sensor_times, values, start, interval, buckets)
+                for metric, values in sensor_values.items()
+            },
+            'ai_evaluation': downsample_labels(ai_times, ai_labels, ai_confidence, start, interval, buckets),
+        }
+        return {
+            'statusCode': 200,
+            'headers': get_cors_headers(cacheable=True),
+            'body': json.dumps(response_data)
+        }
+
+    except Exception as e:
+        print(f"CRITICAL ERROR: {str(e)}")
+        return error_response(500, 'Internal server error', str(e))
+
+
+def error_response(status, error, message=None):
+    body = {'error': error}
+    if message:
+        body['message'] = message
+    return {'statusCode': status, 'headers': get_cors_headers(), 'body': json.dumps(body)}
+
+
+def get_cors_headers(cacheable=False):
+    return {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Cache-Control,Pragma,Expires,If-None-Match',
+        'Access-Control-Allow-Methods': 'GET,OPTIONS',
+        'Cache-Control': f'private, max-age={CACHE_MAX_AGE}' if cacheable else 'no-store',
+    }
+
+
+def parse_time(value, default):
+    if value in (None, ''):
+        return float(default)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'invalid time: {value}')
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# =======================
+# READ PATH
+# =======================
+def list_keys(prefix, start_after, stop_after):
+    """
+    Key trong prefix sắp xếp theo thời gian: bắt đầu từ StartAfter, dừng phân trang khi vượt stop_after,
+    nên chi phí list tỉ lệ với khoảng thời gian được hỏi chứ không với toàn bộ lịch sử.
+    """
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=PLANT_DATA_BUCKET, Prefix=prefix, StartAfter=start_after):
+        for obj in page.get('Contents', []):
+            if obj['Key'] > stop_after:
+                return keys
+            keys.append(obj['Key'])
+    return keys
+
+
+def fetch_all(keys, parse):
+    """GET song song các object chưa có trong cache; trả về list record đã parse (bỏ None)."""
+    missing = [k for k in keys if k not in object_cache]
+
+    def fetch(key):
+        try:
+            body = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=key)['Body'].read()
+            return key, parse(key, body)
+        except Exception as e:
+            print(f"skip {key}: {e}")
+            return key, None
+
+    for key, record in executor.map(fetch, missing):
+        if record is not None:
+            object_cache[key] = record
+    while len(object_cache) > OBJECT_CACHE_SIZE:
+        object_cache.popitem(last=False)
+
+    records = []
+    for key in keys:
+        record = object_cache.get(key)
+        if record is not None:
+            object_cache.move_to_end(key)
+            records.append(record)
+    return records
+
+
+def key_time(key):
+    m = RAW_KEY_TIME.search(key)
+    if not m:
+        return None
+    return datetime.strptime(m.group(1), '%Y-%m-%d_%H-%M-%S').replace(tzinfo=timezone.utc).timestamp()
+
+
+def decode_raw_object(key, body):
+    """Object raw_data -> list record: .json (1 record) hoặc batch .ndjson / .ndjson.gz của mqtt_bridge."""
+    if key.endswith('.gz'):
+        body = gzip.decompress(body)
+    if key.endswith(('.ndjson', '.ndjson.gz')):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    return [json.loads(body)]
+
+
+def parse_sensor_object(key, body):
+    """Object raw_data -> (rows [t, metrics...], message_id từng dòng)."""
+    rows, ids = [], []
+    for data in decode_raw_object(key, body):
+        ts = data.get('mqtt_timestamp') or data.get('received_at')
+        try:
+            t = parse_time(ts, default=None) if ts else key_time(key)
+        except (TypeError, ValueError):
+            t = key_time(key)
+        if t is None:
+            continue
+        payload = data.get('payload') or {}
+        rows.append([t] + [to_float(payload.get(m)) for m in SENSOR_METRICS])
+        ids.append(data.get('message_id'))
+    return np.array(rows, dtype=np.float64).reshape(-1, 1 + len(SENSOR_METRICS)), ids
+
+
+def parse_result_object(key, body):
+    m = RESULT_KEY_TIME.search(key)
+    if not m:
+        return None
+    digits = m.group(1)
+    # Key cũ: epoch giây (10 chữ số); key mới: epoch millisecond
+    t = int(digits) / 1000 if len(digits) > 10 else int(digits)
+    lines = body.decode('utf-8').strip().lower().splitlines()
+    if not lines:
+        return None
+    label = next((i for i, name in enumerate(AI_LABELS) if name in lines[0]), -1)
+    confidence = to_float(lines[1]) if len(lines) > 1 else float('nan')
+    return [t, label, confidence]
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def load_compaction_index(mqtt_topic):
+    """compacted/<topic>/_index.json (aws/scripts/compact_raw_data.py); cache INDEX_TTL giây trong container."""
+    cached = index_cache.get(mqtt_topic)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    try:
+        body = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=f"compacted/{mqtt_topic}/_index.json")['Body'].read()
+        index = json.loads(body)
+    except s3_client.exceptions.NoSuchKey:
+        index = {'partitions': {}}
+    index_cache[mqtt_topic] = (time.time() + INDEX_TTL, index)
+    return index
+
+
+def parse_part(key, body):
+    """Part đã compaction -> (rows [t, metrics...], tập key raw đã gộp, message_id từng dòng)."""
+    if key.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(io.BytesIO(body))
+        rows = np.column_stack([table.column(c).to_numpy(zero_copy_only=False).astype(np.float64)
+                                for c in ['_ts'] + list(SENSOR_METRICS)])
+        # Part cũ (trước khi có cột message_id): không dedupe được với raw
+        ids = table.column('message_id').to_pylist() if 'message_id' in table.column_names else [None] * len(rows)
+        return rows, frozenset(table.column('_key').to_pylist()), ids
+    rows, keys, ids = [], set(), []
+    for line in gzip.decompress(body).splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        payload = record.get('payload') or {}
+        rows.append([record['_ts']] + [to_float(payload.get(m)) for m in SENSOR_METRICS])
+        keys.add(record['_key'])
+        ids.append(record.get('message_id'))
+    return np.array(rows, dtype=np.float64).reshape(-1, 1 + len(SENSOR_METRICS)), frozenset(keys), ids
+
+
+def first_occurrence(ids):
+    """Mask giữ dòng đầu tiên của mỗi message_id (webhook replay / hai đường ghi tạo bản trùng)."""
+    seen = set()
+    keep = np.ones(len(ids), dtype=bool)
+    for i, message_id in enumerate(ids):
+        if message_id is None:
+            continue
+        if message_id in seen:
+            keep[i] = False
+        else:
+            seen.add(message_id)
+    return keep
+
+
+def load_sensor_records(start, end):
+    """
+    Partition đã compaction: 1 GET / ngày (hoặc giờ). Raw lẻ chỉ đọc cho phần đuôi chưa được
+    gộp (sau raw_last_key của partition mới nhất trong khoảng), bỏ key đã có trong part.
+    """
+    mqtt_topic = os.environ.get('MQTT_TOPIC', 'esp32s3/sensors')
+    prefix = f"raw_data/{mqtt_topic}/"
+    # Chừa 1 giờ hai đầu: timestamp trong record có thể lệch với tên key
+    start_after = prefix + datetime.fromtimestamp(start - 3600, tz=timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')
+    stop_after = prefix + datetime.fromtimestamp(end + 3600, tz=timezone.utc).strftime('%Y-%m-%d_%H-%M-%S~')
+
+    for attempt in range(2):
+        partitions = [p for p in load_compaction_index(mqtt_topic)['partitions'].values()
+                      if p['min_ts'] <= end and p['max_ts'] >= start]
+        parts = fetch_all([p['key'] for p in partitions], parse_part)
+        if len(parts) == len(partitions):
+            break
+        # Part cũ đã bị thay (index trong cache đã cũ): đọc lại index
+        index_cache.pop(mqtt_topic, None)
+    if partitions:
+        start_after = max(start_after, max(p['raw_last_key'] for p in partitions))
+    compacted_keys = frozenset().union(*(keys for _, keys, _ in parts))
+
+    raw_keys = [k for k in list_keys(prefix, start_after, stop_after) if k not in compacted_keys]
+    sources = [(rows, ids) for rows, _, ids in parts] + fetch_all(raw_keys, parse_sensor_object)
+    array = np.concatenate([rows for rows, _ in sources] + [np.empty((0, 1 + len(SENSOR_METRICS)))])
+    array = array[first_occurrence([message_id for _, ids in sources for message_id in ids])]
+    return array[:, 0], {m: array[:, i + 1] for i, m in enumerate(SENSOR_METRICS)}
+
+
+def load_ai_records(start, end):
+    data_prefix = os.environ.get('DATA_PATH_PREFIX', '')
+    prefix = f"{data_prefix}results/"
+    # 10 chữ số đầu của cả key giây lẫn key millisecond đều là epoch giây
+    start_after = f"{prefix}{int(start) - 1:010d}"
+    stop_after = f"{prefix}{int(end) + 1:010d}~"
+    records = fetch_all(list_keys(prefix, start_after, stop_after), parse_result_object)
+    array = np.array(records, dtype=np.float64).reshape(-1, 3)
+    return array[:, 0], array[:, 1].astype(np.int64), array[:, 2]
+
+
+# =======================
+# DOWNSAMPLING
+# =======================
+def bucket_index(times, start, interval, n_buckets):
+    idx = np.floor((times - start) / interval).astype(np.int64)
+    inside = (times >= start) & (idx >= 0) & (idx < n_buckets)
+    return idx, inside
+
+
+def nan_to_none(array, decimals=3):
+    return [None if np.isnan(v) else v for v in np.round(array, decimals).tolist()]
+
+
+def downsample(times, values, start, interval, n_buckets):
+    """min/max/avg/count mỗi bucket, không vòng lặp Python theo từng điểm. Bucket rỗng = null."""
+    idx, inside = bucket_index(times, start, interval, n_buckets)
+    mask = inside & ~np.isnan(values)
+    idx, values = idx[mask], values[mask]
+
+    count = np.bincount(idx, minlength=n_buckets)
+    total = np.bincount(idx, weights=values, minlength=n_buckets)
+    vmin = np.full(n_buckets, np.inf)
+    vmax = np.full(n_buckets, -np.inf)
+    np.minimum.at(vmin, idx, values)
+    np.maximum.at(vmax, idx, values)
+
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = total / count
+    avg[empty] = vmin[empty] = vmax[empty] = np.nan
+    return {
+        'min': nan_to_none(vmin),
+        'max': nan_to_none(vmax),
+        'avg': nan_to_none(avg),
+        'count': count.tolist(),
+    }
+
+
+def downsample_labels(times, labels, confidence, start, interval, n_buckets):
+    """Số lần mỗi nhãn + confidence trung bình mỗi bucket."""
+    idx, inside = bucket_index(times, start, interval, n_buckets)
+    idx, labels, confidence = idx[inside], labels[inside], confidence[inside]
+
+    counts = {
+        name: np.bincount(idx[labels == i], minlength=n_buckets).tolist()
+        for i, name in enumerate(AI_LABELS)
+    }
+    has_conf = ~np.isnan(confidence)
+    conf_count = np.bincount(idx[has_conf], minlength=n_buckets)
+    conf_total = np.bincount(idx[has_conf], weights=confidence[has_conf], minlength=n_buckets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_confidence = conf_total / conf_count
+    return {
+        'counts': counts,
+        'total': np.bincount(idx, minlength=n_buckets).tolist(),
+        'avg_confidence': nan_to_none(avg_confidence, 4),
+    }
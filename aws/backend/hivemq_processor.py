@@ -1,7 +1,11 @@
+import gzip
+import hashlib
 import json
 import os
 import boto3
-from datetime import datetime
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import re
 
 # Initialize AWS clients
@@ -9,27 +13,60 @@ s3_client = boto3.client('s3')
 
 # Environment variables
 PLANT_DATA_BUCKET = os.environ.get('PLANT_DATA_BUCKET')
+PLANT_ID = os.environ.get('PLANT_ID', 'plant_001')
+# Prefix của pointer latest/, phải khớp DATA_PATH_PREFIX của Lambda get_plant_data
+DATA_PATH_PREFIX = os.environ.get('DATA_PATH_PREFIX', '')
+# Số PUT song song khi nhận batch (mảng message hoặc SQS event)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '8'))
+# Batch: message được gom theo (topic, cửa sổ BATCH_WINDOW_SECONDS giây), mỗi nhóm 1 object NDJSON.gz
+BATCH_WINDOW_SECONDS = int(os.environ.get('BATCH_WINDOW_SECONDS', '60'))
+
+# Field số được kiểm tra khi nhận batch (cùng khoảng với mqtt_bridge.clean_payload):
+# sai kiểu / ngoài khoảng thì bỏ field; message không còn field nào thì bị từ chối
+METRIC_RANGES = {
+    'soil_moisture': (0, 100),
+    'temperature': (-40, 125),
+    'humidity': (0, 100),
+    'light_level': (0, float('inf')),
+    'rain': (float('-inf'), float('inf')),  # số nguyên: 0 = rain, 1 = dry
+}
+
+# Số lần thử lại ghi pointer latest khi writer khác ghi chen vào (PUT có điều kiện bị 412)
+POINTER_WRITE_ATTEMPTS = 5
+
+executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
 
 
 def lambda_handler(event, context):
     """
     Lambda handler to process HiveMQ webhook and persist to S3.
     DEBUG VERSION - Log mọi thứ để track dữ liệu
+
+    Event:
+      - API Gateway, body là 1 message {topic, payload, ...} (ghi 1 object .json như cũ)
+      - API Gateway, body là mảng message (handle_batch)
+      - SQS (Records[].body là 1 message hoặc mảng message; handle_sqs)
     """
     try:
         print("=" * 80)
         print(f"[Lambda Start] Timestamp: {datetime.utcnow().isoformat()}")
         print("=" * 80)
-        
-        # Log raw event
-        print("\n RAW EVENT RECEIVED:")
-        print(json.dumps(event, indent=2, default=str))
+
+        if isinstance(event.get('Records'), list):
+            return handle_sqs(event['Records'])
         
         # Parse request body
         if isinstance(event.get('body'), str):
             body = json.loads(event['body'])
         else:
             body = event.get('body', {})
+
+        if isinstance(body, list):
+            return handle_batch(body)
+        
+        # Log raw event
+        print("\n RAW EVENT RECEIVED:")
+        print(json.dumps(event, indent=2, default=str))
         
         print("\n PARSED BODY:")
         print(json.dumps(body, indent=2))
@@ -40,6 +77,7 @@ def lambda_handler(event, context):
         mqtt_timestamp = body.get('timestamp')
         qos = body.get('qos', 0)
         retain = body.get('retain', False)
+        message_id = body.get('message_id')
         
         print(f"\n EXTRACTED FIELDS:")
         print(f"  - topic: {topic}")
@@ -64,24 +102,18 @@ def lambda_handler(event, context):
         print(f"  - Payload size: {len(str(payload))} bytes")
         
         # Generate S3 key based on topic and timestamp
-        s3_key = generate_s3_key(topic, mqtt_timestamp)
+        s3_key = generate_s3_key(topic, mqtt_timestamp, message_id)
         print(f"  - Generated S3 key: {s3_key}")
         
         # Prepare data to store
-        data_to_store = {
-            'topic': topic,
-            'payload': payload,
-            'mqtt_timestamp': mqtt_timestamp,
-            'received_at': datetime.utcnow().isoformat() + 'Z',
-            'qos': qos,
-            'retain': retain
-        }
+        data_to_store = build_record(body)
         
         print(f"\nDATA TO BE STORED IN S3:")
         print(json.dumps(data_to_store, indent=2))
         
         # Save to S3
         save_to_s3(s3_key, data_to_store)
+        update_latest_pointer(topic, data_to_store)
         
         print(f"\n✓ Successfully saved to S3: {s3_key}")
         print(f"  - S3 Bucket: {PLANT_DATA_BUCKET}")
@@ -125,7 +157,220 @@ def lambda_handler(event, context):
         }
 
 
-def generate_s3_key(topic, timestamp):
+def handle_batch(messages):
+    """
+    Body là mảng message: 200 nếu tất cả đã lưu, ngược lại 207 kèm kết quả từng message
+    ("retryable" cho mqtt_bridge biết message nào cần gửi lại).
+    """
+    print(f"\n BATCH RECEIVED: {len(messages)} messages")
+    results = ingest(messages)
+    stored = sum(r['status'] == 'stored' for r in results)
+    return {
+        'statusCode': 200 if stored == len(results) else 207,
+        'body': json.dumps({
+            'message': 'Batch processed',
+            'stored': stored,
+            'failed': len(results) - stored,
+            'results': results
+        })
+    }
+
+
+def handle_sqs(records):
+    """
+    SQS event (event source mapping với ReportBatchItemFailures): chỉ record có message lỗi tạm thời
+    được báo trong batchItemFailures để SQS giao lại; message không hợp lệ chỉ được log.
+    messageId của SQS làm message_id khi message không có sẵn, nên lần giao lại ghi đúng key cũ.
+    """
+    print(f"\n SQS BATCH RECEIVED: {len(records)} records")
+    messages, owners = [], []
+    for record in records:
+        try:
+            body = json.loads(record['body'])
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"  - rejected SQS record {record.get('messageId')}: {e}")
+            continue
+        items = body if isinstance(body, list) else [body]
+        for j, item in enumerate(items):
+            if isinstance(item, dict) and not item.get('message_id'):
+                item['message_id'] = record['messageId'] if len(items) == 1 else f"{record['messageId']}-{j}"
+            messages.append(item)
+            owners.append(record['messageId'])
+
+    results = ingest(messages)
+    for result in results:
+        if result['status'] == 'rejected':
+            print(f"  - rejected {result.get('message_id')}: {result.get('error')}")
+    failed = sorted({owner for owner, result in zip(owners, results) if result.get('retryable')})
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+
+def validate_messages(messages):
+    """
+    Validate theo cột: mỗi metric là 1 mảng float cho cả batch (NaN = không có / sai kiểu), khoảng
+    hợp lệ so một lần bằng numpy. Trả về (mask hợp lệ, {metric: (giá trị, mask giá trị hợp lệ)}, lý do lỗi).
+    """
+    # numpy (layer) chỉ cần cho đường batch; message đơn lẻ vẫn xử lý được khi thiếu layer
+    import numpy as np
+
+    n = len(messages)
+    payloads = [m.get('payload') if isinstance(m, dict) else None for m in messages]
+    has_topic = np.fromiter((isinstance(m, dict) and isinstance(m.get('topic'), str) and bool(m['topic'])
+                             for m in messages), dtype=bool, count=n)
+    has_payload = np.fromiter((isinstance(p, dict) and bool(p) for p in payloads), dtype=bool, count=n)
+    key_count = np.fromiter((len(p) if isinstance(p, dict) else 0 for p in payloads), dtype=np.int64, count=n)
+
+    columns = {}
+    bad_count = np.zeros(n, dtype=np.int64)
+    for metric, (low, high) in METRIC_RANGES.items():
+        raw = [p.get(metric) if isinstance(p, dict) else None for p in payloads]
+        present = np.fromiter((v is not None for v in raw), dtype=bool, count=n)
+        values = np.fromiter((to_float(v) for v in raw), dtype=np.float64, count=n)
+        with np.errstate(invalid='ignore'):
+            ok = np.isfinite(values) & (values >= low) & (values <= high)
+        if metric == 'rain':
+            ok &= np.floor(values) == values
+        bad_count += present & ~ok
+        columns[metric] = (values, ok)
+
+    valid = has_topic & has_payload & (key_count > bad_count)
+    reasons = np.where(~has_topic | ~has_payload, 'Missing required fields: topic and payload',
+                       'No valid fields in payload')
+    return valid, columns, reasons
+
+
+def ingest(messages):
+    """
+    Validate cả batch rồi ghi mỗi (topic, cửa sổ thời gian) thành 1 object NDJSON.gz (PUT song song),
+    pointer latest 1 lần / topic. Trả về kết quả từng message theo đúng thứ tự đầu vào.
+    """
+    import numpy as np
+
+    n = len(messages)
+    results = [None] * n
+    valid, columns, reasons = validate_messages(messages)
+    for i in np.flatnonzero(~valid):
+        message_id = messages[i].get('message_id') if isinstance(messages[i], dict) else None
+        results[i] = {'message_id': message_id, 'status': 'rejected', 'retryable': False, 'error': str(reasons[i])}
+
+    index = np.flatnonzero(valid)
+    if len(index):
+        now = datetime.utcnow()
+        records = []
+        for i in index:
+            data_to_store = build_record(messages[i])
+            payload = dict(data_to_store['payload'])
+            for metric, (values, ok) in columns.items():
+                if metric in payload:
+                    if ok[i]:
+                        payload[metric] = int(values[i]) if metric == 'rain' else float(values[i])
+                    else:
+                        del payload[metric]
+            data_to_store['payload'] = payload
+            records.append(data_to_store)
+        times = np.array([message_time(r['mqtt_timestamp'], now) for r in records])
+
+        # Nhóm theo (topic, cửa sổ): mã hóa thành 1 số int64 rồi np.unique
+        topics, topic_code = np.unique([r['topic'] for r in records], return_inverse=True)
+        window = np.floor(times / BATCH_WINDOW_SECONDS).astype(np.int64)
+        _, group = np.unique(topic_code.astype(np.int64) << 40 | window, return_inverse=True)
+        order = np.lexsort((times, group))
+        groups = np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+        def put(members):
+            batch = [records[k] for k in members]
+            s3_key = batch_s3_key(batch[0]['topic'], window[members[0]] * BATCH_WINDOW_SECONDS, batch)
+            try:
+                save_batch_to_s3(s3_key, batch)
+                return s3_key, None
+            except Exception as e:
+                print(f"[S3 Save] Error saving batch {s3_key}: {str(e)}")
+                return s3_key, str(e)
+
+        latest = {}
+        for members, (s3_key, error) in zip(groups, executor.map(put, groups)):
+            for k in members:
+                message_id = records[k].get('message_id')
+                if error is None:
+                    results[index[k]] = {'message_id': message_id, 'status': 'stored', 's3_key': s3_key}
+                else:
+                    results[index[k]] = {'message_id': message_id, 'status': 'error', 'retryable': True, 'error': error}
+            if error is None:
+                topic = records[members[-1]]['topic']
+                if topic not in latest or times[members[-1]] >= times[latest[topic]]:
+                    latest[topic] = members[-1]
+        for topic, k in latest.items():
+            update_latest_pointer(topic, records[k])
+        print(f"✓ Batch: {len(index)} valid messages -> {len(groups)} objects ({len(topics)} topics)")
+
+    stored = sum(r['status'] == 'stored' for r in results)
+    print(f"✓ Batch stored {stored}/{n} messages")
+    return results
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def message_time(timestamp, now):
+    """Epoch giây từ timestamp ISO của message; thiếu / sai thì dùng thời điểm nhận."""
+    try:
+        dt = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+    except ValueError:
+        dt = now
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def batch_s3_key(topic, window_start, records):
+    """
+    raw_data/<topic>/<đầu cửa sổ>_<digest>.ndjson.gz: 19 ký tự đầu vẫn là timestamp (reader list theo
+    thời gian như cũ); digest từ message_id (hoặc nội dung) nên retry đúng batch đó ghi đè đúng object.
+    Replay gom message thành batch khác (vd cursor webhook của mqtt_bridge lùi lại) thì ra object mới:
+    record trùng được bỏ theo message_id khi đọc (compact_raw_data.py, get_plant_history).
+    """
+    stamp = datetime.fromtimestamp(int(window_start), tz=timezone.utc).strftime('%Y-%m-%d_%H-%M-%S')
+    digest = hashlib.blake2b(digest_size=8)
+    for r in records:
+        digest.update((r.get('message_id') or json.dumps(r['payload'], sort_keys=True) + str(r['mqtt_timestamp'])).encode('utf-8'))
+        digest.update(b'\n')
+    return f"raw_data/{topic}/{stamp}_{digest.hexdigest()}.ndjson.gz"
+
+
+def save_batch_to_s3(s3_key, records):
+    body = gzip.compress(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records).encode('utf-8'), mtime=0)
+    s3_client.put_object(
+        Bucket=PLANT_DATA_BUCKET,
+        Key=s3_key,
+        Body=body,
+        ContentType='application/x-ndjson',
+        Metadata={
+            'source': 'hivemq-webhook',
+            'records': str(len(records)),
+            'processed_at': datetime.utcnow().isoformat()
+        }
+    )
+
+
+def build_record(message):
+    data_to_store = {
+        'topic': message.get('topic'),
+        'payload': message.get('payload'),
+        'mqtt_timestamp': message.get('timestamp'),
+        'received_at': datetime.utcnow().isoformat() + 'Z',
+        'qos': message.get('qos', 0),
+        'retain': message.get('retain', False)
+    }
+    if message.get('message_id'):
+        data_to_store['message_id'] = message['message_id']
+    return data_to_store
+
+
+def generate_s3_key(topic, timestamp, message_id=None):
     """
     Generate S3 key from MQTT topic and timestamp.
     
@@ -133,6 +378,10 @@ def generate_s3_key(topic, timestamp):
         Topic: esp32s3/sensors
         Timestamp: 2024-11-22T10:30:00.123Z
         S3 Key: raw_data/esp32s3/sensors/2024-11-22_10-30-00.json
+
+    message_id (mqtt_bridge gửi <bridge_id>-<seq>) được thêm vào tên file: key không trùng
+    trong cùng một giây, và bridge gửi lại cùng message thì ghi đè đúng object cũ.
+        S3 Key: raw_data/esp32s3/sensors/2024-11-22_10-30-00_3f9c01ab-42.json
     """
     topic_path = topic.replace('/', '/')
     
@@ -145,6 +394,8 @@ def generate_s3_key(topic, timestamp):
         dt = datetime.utcnow()
     
     timestamp_str = dt.strftime('%Y-%m-%d_%H-%M-%S')
+    if message_id:
+        timestamp_str += '_' + re.sub(r'[^A-Za-z0-9.-]', '-', str(message_id))
     s3_key = f"raw_data/{topic_path}/{timestamp_str}.json"
     
     return s3_key
@@ -175,4 +426,60 @@ def save_to_s3(s3_key, data):
         
     except Exception as e:
         print(f"[S3 Save] Error saving to S3: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+
+def latest_pointer_key(topic):
+    """
+    Pointer "latest" mà get_plant_data đọc bằng 1 GET, thay vì list + sort raw_data/<topic>/.
+    Cùng quy tắc với get_plant_data.latest_pointer_key: <DATA_PATH_PREFIX>latest/<PLANT_ID>/<metric>.json
+    """
+    return f"{DATA_PATH_PREFIX}latest/{PLANT_ID}/sensors/{topic}.json"
+
+
+def pointer_time(record):
+    """Thời điểm của record pointer (mqtt_timestamp, không có thì received_at); None nếu không parse được."""
+    value = record.get('mqtt_timestamp') or record.get('received_at')
+    try:
+        t = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def update_latest_pointer(topic, data):
+    """
+    Ghi pointer bằng record (nội dung giống hệt object raw_data) chỉ khi record không cũ hơn
+    pointer hiện có: message replay / batch đến muộn không kéo "latest" lùi lại.
+    GET + so sánh + PUT có điều kiện (If-Match ETag / If-None-Match), writer khác chen vào thì đọc lại.
+    Lỗi pointer không làm hỏng request: raw data đã lưu, reader còn fallback list prefix.
+    """
+    key = latest_pointer_key(topic)
+    new_time = pointer_time(data)
+    try:
+        for _ in range(POINTER_WRITE_ATTEMPTS):
+            try:
+                obj = s3_client.get_object(Bucket=PLANT_DATA_BUCKET, Key=key)
+                current_time, condition = pointer_time(json.loads(obj['Body'].read())), {'IfMatch': obj['ETag']}
+            except s3_client.exceptions.NoSuchKey:
+                current_time, condition = None, {'IfNoneMatch': '*'}
+            if current_time is not None and (new_time is None or new_time < current_time):
+                print(f"[S3 Save] Latest pointer {key} is newer ({current_time.isoformat()}), not overwriting")
+                return False
+            try:
+                s3_client.put_object(
+                    Bucket=PLANT_DATA_BUCKET,
+                    Key=key,
+                    Body=json.dumps(data),
+                    ContentType='application/json',
+                    CacheControl='no-cache',
+                    **condition
+                )
+                return True
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+        print(f"[S3 Save] Latest pointer {key}: too many concurrent writers, giving up")
+    except Exception as e:
+        print(f"[S3 Save] Error updating latest pointer: {str(e)}")
+    return False
@@ -1,7 +1,7 @@
 "use client"
 
 import "./PlantDetails.css"
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import axios from "axios"
 
 // API Gateway endpoint - will be set automatically during deployment
@@ -13,6 +13,8 @@ const PlantDetails = ({ plantId = "Plant-001" }) => {
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState(null)
   const [lastUpdated, setLastUpdated] = useState(null)
+  // ETag của lần fetch trước: server trả 304 (không body) nếu dữ liệu chưa đổi
+  const etagRef = useRef(null)
 
   useEffect(() => {
     fetchPlantData()
@@ -30,17 +32,20 @@ const PlantDetails = ({ plantId = "Plant-001" }) => {
       setLoading(true)
       setError(null)
 
+      const headers = { "Content-Type": "application/json" }
+      if (etagRef.current) {
+        headers["If-None-Match"] = etagRef.current
+      }
       const response = await axios.get(`${API_ENDPOINT}/${plantId}`, {
         timeout: 30000,
-        headers: {
-          "Content-Type": "application/json",
-          "Cache-Control": "no-cache",
-          "Pragma": "no-cache",
-          "Expires": "0",
-        },
+        headers,
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
       })
 
-      setPlantData(response.data)
+      if (response.status !== 304) {
+        etagRef.current = response.headers["etag"] || null
+        setPlantData(response.data)
+      }
       setLastUpdated(new Date())
       setLoading(false)
     } catch (err) {
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Compaction raw_data/<topic>/<timestamp>*.json|.ndjson[.gz] -> file gộp theo ngày (hoặc giờ)
+
+    compacted/<topic>/dt=2025-11-25/part-<ms>.ndjson.gz           (mặc định)
+    compacted/<topic>/dt=2025-11-25T13/part-<ms>.parquet          (--granularity hour --format parquet)
+    compacted/<topic>/_index.json                                 index các partition
+
+Raw có thể là 1 record / object (.json) hoặc batch NDJSON của mqtt_bridge (.ndjson, .ndjson.gz).
+Mỗi dòng NDJSON là record raw gốc cộng thêm "_key" (key raw) và "_ts" (epoch giây).
+Index ghi cho từng partition: part key, số record, min/max _ts, key raw lớn nhất đã gộp.
+Record trùng message_id (webhook replay gom batch khác đi, hoặc cùng message qua cả S3 lẫn
+webhook của mqtt_bridge) chỉ được giữ một bản khi gộp.
+Reader (aws/backend/get_plant_history.py) đọc part + raw key sau raw_last_key.
+
+Late data: mỗi lần chạy, partition trong cửa sổ --lookback được list lại; nếu có key raw
+chưa có trong part (đến muộn, hoặc mới) thì part được merge và ghi version mới.
+Với --delete-raw, raw đã gộp bị xóa nên mọi raw còn lại đều là dữ liệu chưa gộp và
+được xử lý bất kể tuổi.
+
+Chạy local:
+    python compact_raw_data.py --local-root ./bucket_copy
+    python compact_raw_data.py --endpoint-url http://localhost:9000 --bucket iot-gardernice   # MinIO
+    python compact_raw_data.py --bucket iot-gardernice --lookback 3 --delete-raw              # S3 (cron / systemd timer)
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger('compaction')
+
+RAW_PREFIX = "raw_data"
+COMPACTED_PREFIX = "compacted"
+INDEX_NAME = "_index.json"
+TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+RAW_EXTENSIONS = ('.json', '.ndjson', '.ndjson.gz')
+METRIC_COLUMNS = ('soil_moisture', 'temperature', 'humidity', 'rain', 'light_level')
+
+
+# =======================
+# STORAGE (S3 / MinIO / local FS)
+# =======================
+class S3Store:
+    def __init__(self, bucket, endpoint_url=None):
+        import boto3
+
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def list(self, prefix, start_after=""):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, StartAfter=start_after):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, body, content_type='application/octet-stream'):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body, ContentType=content_type)
+
+    def delete(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': k} for k in keys[i:i + 1000]], 'Quiet': True})
+
+
+class LocalStore:
+    """Thư mục local giả lập bucket: key = đường dẫn tương đối."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def list(self, prefix, start_after=""):
+        base = os.path.join(self.root, *prefix.rstrip('/').split('/')[:-1]) if '/' in prefix else self.root
+        keys = []
+        for dirpath, _, files in os.walk(base):
+            for f in files:
+                key = os.path.relpath(os.path.join(dirpath, f), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and key > start_after and not f.endswith('.tmp'):
+                    keys.append(key)
+        return iter(sorted(keys))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body if isinstance(body, bytes) else body.encode('utf-8'))
+        os.replace(path + '.tmp', path)
+
+    def delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+
+# =======================
+# PARTITIONS
+# =======================
+def partition_of(raw_key, granularity):
+    """raw_data/<topic>/2025-11-25_13-36-42.json -> '2025-11-25' hoặc '2025-11-25T13'."""
+    stamp = raw_key.rsplit('/', 1)[-1][:19]
+    return stamp[:10] if granularity == 'day' else f"{stamp[:10]}T{stamp[11:13]}"
+
+
+def raw_partition_prefix(topic, partition):
+    # '2025-11-25' -> raw_data/<topic>/2025-11-25 ; '2025-11-25T13' -> raw_data/<topic>/2025-11-25_13
+    return f"{RAW_PREFIX}/{topic}/{partition.replace('T', '_')}"
+
+
+def record_time(raw_key, record):
+    ts = record.get('mqtt_timestamp') or record.get('received_at')
+    if ts:
+        try:
+            dt = datetime.fromisoformat(str(ts).replace('Z', '+00:00'))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+        except ValueError:
+            pass
+    stamp = raw_key.rsplit('/', 1)[-1][:19]
+    return datetime.strptime(stamp, TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+# =======================
+# PART FORMATS
+# =======================
+def encode_ndjson(records):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gz:
+        for r in records:
+            gz.write(json.dumps(r, separators=(',', ':')).encode('utf-8'))
+            gz.write(b'\n')
+    return buf.getvalue()
+
+
+def decode_ndjson(body):
+    return [json.loads(line) for line in gzip.decompress(body).splitlines() if line.strip()]
+
+
+def encode_parquet(records):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = {
+        '_ts': pa.array([r['_ts'] for r in records], type=pa.float64()),
+        '_key': pa.array([r['_key'] for r in records], type=pa.string()),
+        'message_id': pa.array([r.get('message_id') for r in records], type=pa.string()),
+    }
+    for m in METRIC_COLUMNS:
+        columns[m] = pa.array([to_float((r.get('payload') or {}).get(m)) for r in records], type=pa.float64())
+    # Record đầy đủ giữ dạng JSON để không mất field ngoài schema
+    columns['record'] = pa.array([json.dumps(r, separators=(',', ':')) for r in records], type=pa.string())
+    buf = io.BytesIO()
+    pq.write_table(pa.table(columns), buf, compression='zstd')
+    return buf.getvalue()
+
+
+def decode_parquet(body):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(body), columns=['record'])
+    return [json.loads(s) for s in table.column('record').to_pylist()]
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+FORMATS = {
+    'ndjson': ('.ndjson.gz', encode_ndjson, decode_ndjson, 'application/x-ndjson'),
+    'parquet': ('.parquet', encode_parquet, decode_parquet, 'application/vnd.apache.parquet'),
+}
+
+
+def decode_part(key, body):
+    for ext, _, decode, _ in FORMATS.values():
+        if key.endswith(ext):
+            return decode(body)
+    raise ValueError(f"Unknown part format: {key}")
+
+
+# =======================
+# COMPACTION
+# =======================
+def load_index(store, topic, granularity):
+    body = store.get(f"{COMPACTED_PREFIX}/{topic}/{INDEX_NAME}")
+    if body is None:
+        return {"version": 1, "topic": topic, "granularity": granularity, "partitions": {}}
+    index = json.loads(body)
+    if index.get("granularity", granularity) != granularity:
+        raise ValueError(f"{topic}: index uses granularity {index['granularity']}, got {granularity}")
+    return index
+
+
+def decode_raw(key, body):
+    if key.endswith('.gz'):
+        body = gzip.decompress(body)
+    if key.endswith(('.ndjson', '.ndjson.gz')):
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    return [json.loads(body)]
+
+
+def dedupe(records):
+    """Giữ bản đầu tiên của mỗi message_id; record không có message_id giữ nguyên."""
+    seen = set()
+    unique = []
+    for record in records:
+        message_id = record.get('message_id')
+        if message_id is not None:
+            if message_id in seen:
+                continue
+            seen.add(message_id)
+        unique.append(record)
+    return unique
+
+
+def fetch_raw(store, keys, workers):
+    def fetch(key):
+        body = store.get(key)
+        if body is None:
+            return []
+        try:
+            records = decode_raw(key, body)
+            for record in records:
+                record['_key'] = key
+                record['_ts'] = record_time(key, record)
+            return records
+        except (ValueError, TypeError, OSError) as e:
+            logger.warning(f"skip unreadable raw object {key}: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [r for records in pool.map(fetch, keys) for r in records]
+
+
+def compact_partition(store, topic, partition, raw_keys, index, fmt, workers, delete_raw, dry_run):
+    """Merge raw_keys chưa gộp vào partition; trả về số record mới."""
+    entry = index["partitions"].get(partition)
+    existing = []
+    if entry:
+        body = store.get(entry["key"])
+        if body is None:
+            logger.warning(f"{topic} {partition}: part {entry['key']} missing, rebuilding from raw")
+            entry = None
+        else:
+            existing = decode_part(entry["key"], body)
+
+    known = {r['_key'] for r in existing}
+    new_keys = [k for k in raw_keys if k not in known]
+    if delete_raw and not dry_run and len(new_keys) < len(raw_keys):
+        # Raw đã nằm trong part (gộp ở lần chạy trước không --delete-raw)
+        store.delete([k for k in raw_keys if k in known])
+    if not new_keys:
+        return 0
+    if dry_run:
+        logger.info(f"{topic} {partition}: would merge {len(new_keys)} raw objects into {len(existing)} records")
+        return len(new_keys)
+
+    # Part cũ đứng trước: bản đã gộp được giữ, bản replay đến sau bị bỏ
+    records = dedupe(existing + fetch_raw(store, new_keys, workers))
+    records.sort(key=lambda r: (r['_ts'], r['_key']))
+    ext, encode, _, content_type = FORMATS[fmt]
+    part_key = f"{COMPACTED_PREFIX}/{topic}/dt={partition}/part-{time.time_ns() // 1_000_000}{ext}"
+    store.put(part_key, encode(records), content_type)
+
+    old_key = entry["key"] if entry else None
+    index["partitions"][partition] = {
+        "key": part_key,
+        "count": len(records),
+        "min_ts": records[0]['_ts'],
+        "max_ts": records[-1]['_ts'],
+        "raw_last_key": max(r['_key'] for r in records),
+        "raw_count": len(raw_keys) if not delete_raw else len({r['_key'] for r in records}),
+        "compacted_at": datetime.now(timezone.utc).isoformat(),
+    }
+    # Index ghi sau part: reader luôn thấy part đầy đủ. Part cũ xóa sau khi index đã trỏ sang part mới
+    store.put(f"{COMPACTED_PREFIX}/{topic}/{INDEX_NAME}", json.dumps(index, indent=1), 'application/json')
+    if old_key and old_key != part_key:
+        store.delete([old_key])
+    if delete_raw:
+        store.delete(new_keys)
+    logger.info(f"{topic} {partition}: +{len(new_keys)} raw -> {len(records)} records ({part_key})")
+    return len(new_keys)
+
+
+def compact_topic(store, topic, granularity='day', fmt='ndjson', lookback_days=2, full=False,
+                  delete_raw=False, workers=16, dry_run=False, now=None):
+    index = load_index(store, topic, granularity)
+    now = now or datetime.now(timezone.utc)
+    prefix = f"{RAW_PREFIX}/{topic}/"
+
+    # Không --full/--delete-raw: chỉ list từ đầu partition chứa mốc lookback (StartAfter),
+    # partition cũ hơn coi như đã đóng. Với --delete-raw mọi raw còn lại đều chưa gộp.
+    if full or delete_raw:
+        start_after = ""
+    else:
+        cutoff_key = prefix + (now - timedelta(days=lookback_days)).strftime(TIME_FORMAT) + ".json"
+        start_after = raw_partition_prefix(topic, partition_of(cutoff_key, granularity))
+    by_partition = {}
+    for key in store.list(prefix, start_after):
+        name = key[len(prefix):]
+        if '/' in name or not name.endswith(RAW_EXTENSIONS):
+            continue
+        by_partition.setdefault(partition_of(key, granularity), []).append(key)
+
+    merged = 0
+    for partition in sorted(by_partition):
+        raw_keys = by_partition[partition]
+        entry = index["partitions"].get(partition)
+        if not delete_raw and entry and entry.get("raw_count") == len(raw_keys) \
+                and entry.get("raw_last_key", "") >= raw_keys[-1]:
+            # Không có key raw mới: bỏ qua, không cần GET part
+            continue
+        merged += compact_partition(store, topic, partition, raw_keys, index, fmt, workers, delete_raw, dry_run)
+    logger.info(f"{topic}: {merged} raw objects merged across {len(by_partition)} partitions")
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', default=os.environ.get('PLANT_DATA_BUCKET', 'iot-gardernice'))
+    parser.add_argument('--endpoint-url', default=os.environ.get('S3_ENDPOINT_URL'), help='MinIO / S3-compatible')
+    parser.add_argument('--local-root', help='dùng thư mục local thay cho S3')
+    parser.add_argument('--topics', nargs='+', default=['esp32s3/sensors', 'esp32s3/soil'])
+    parser.add_argument('--granularity', choices=('day', 'hour'), default='day')
+    parser.add_argument('--format', choices=list(FORMATS), default='ndjson')
+    parser.add_argument('--lookback', type=int, default=2, help='số ngày list lại để bắt dữ liệu đến muộn')
+    parser.add_argument('--full', action='store_true', help='list toàn bộ raw_data (lần chạy đầu / backfill)')
+    parser.add_argument('--delete-raw', action='store_true', help='xóa object raw sau khi gộp')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = LocalStore(args.local_root) if args.local_root else S3Store(args.bucket, args.endpoint_url)
+    for topic in args.topics:
+        compact_topic(store, topic, args.granularity, args.format, args.lookback, args.full,
+                      args.delete_raw, args.workers, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
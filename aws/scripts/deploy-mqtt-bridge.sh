@@ -17,7 +17,7 @@ echo "Step 1: Installing dependencies on EC2..."
 ssh -i $EC2_KEY $EC2_USER@$EC2_IP << 'EOF'
     sudo apt update
     sudo apt install -y python3 python3-pip
-    pip3 install paho-mqtt requests
+    pip3 install paho-mqtt requests boto3
 EOF
 
 echo ""
@@ -2,14 +2,67 @@
 """
 MQTT Bridge for Gardenice IoT - DIRECT S3 STORAGE
 Subscribes to HiveMQ Cloud and saves data directly to AWS S3
+
+Pipeline (on_message chỉ append WAL local, không làm I/O mạng trong network thread của paho):
+
+    on_message -> WAL (đĩa) -> [consumer s3]      validate -> BatchWriter -> [s3]  put batch raw_data + pointer latest
+                            -> [consumer webhook] validate -> [webhook]  POST batch lên Lambda mqtt-ingest
+
+WAL (WAL_DIR) là log append-only chia segment; mỗi message nhận được ghi vào WAL trước khi
+callback trả về (tức trước khi paho ack với broker). Mỗi consumer đọc WAL theo cursor riêng
+(lưu trong WAL_DIR/cursors.json), cursor chỉ tiến khi S3 / webhook đã nhận xong, nên khi S3 hoặc
+API Gateway lỗi thì worker retry với backoff, consumer tụt lại (lag) và dữ liệu nằm chờ trên đĩa
+thay vì mất; restart thì consumer đọc tiếp từ cursor (replay). Dung lượng WAL bị chặn bởi
+WAL_MAX_BYTES: vượt quá thì segment cũ nhất bị bỏ (metrics wal.evicted).
+
+Replay idempotent: S3 key chứa seq WAL của record đầu batch và ranh giới mỗi batch được ghi vào
+WAL_DIR/batches.ndjson trước khi upload, nên replay dựng lại đúng batch cũ (ghi đè cùng key) hoặc bỏ
+qua batch đã upload. Webhook gửi message_id <bridge_id>-<seq>: message đơn lẻ được Lambda dùng làm
+key (gửi lại ghi đè); với mảng, Lambda đặt key theo cả nhóm nên replay gom khác đi có thể tạo
+object mới chứa bản trùng, và reader (compact_raw_data.py, get_plant_history) bỏ trùng theo message_id.
+
+Webhook: WebhookClient giữ 1 requests.Session (keep-alive, pool WEBHOOK_WORKERS kết nối) nên
+không bắt tay TLS lại mỗi request; record được gộp thành mảng tối đa WEBHOOK_BATCH_SIZE message
+mỗi POST (Lambda hivemq_processor nhận mảng); circuit breaker mở sau WEBHOOK_BREAKER_THRESHOLD
+lỗi liên tiếp và chỉ thử lại sau WEBHOOK_BREAKER_COOLDOWN giây.
+
+Mỗi stage có queue giới hạn + worker pool riêng; queue đầy thì consumer tương ứng chờ
+(backpressure), webhook chậm không kéo chậm S3 vì hai consumer độc lập. Metrics (lag từng
+consumer, WAL, stage) được log mỗi METRICS_INTERVAL giây và (tùy chọn) phục vụ ở
+http://0.0.0.0:METRICS_PORT/metrics.
+
+S3: record được gom theo (topic, device_id) thành 1 object NDJSON (gzip mặc định):
+
+    raw_data/esp32s3/soil/2024-11-25_13-36-42_esp32s3-cam_3f9c01ab-000000000042.ndjson.gz
+
+19 ký tự đầu tên file vẫn là timestamp của record đầu batch (list theo thời gian như cũ),
+bridge id + seq WAL làm key không trùng kể cả khi nhiều record trong cùng một giây.
+Batch được ghi khi đủ S3_BATCH_MAX_RECORDS / S3_BATCH_MAX_BYTES hoặc đã mở quá
+S3_FLUSH_INTERVAL giây (nhỏ = dữ liệu + pointer latest tươi hơn, lớn = ít PUT hơn), và khi shutdown.
+
+Test với broker local (Mosquitto), S3 giả lập (MinIO):
+    MQTT_BROKER=localhost MQTT_PORT=1883 MQTT_TLS=0 MQTT_USER= \\
+    S3_ENDPOINT_URL=http://localhost:9000 WEBHOOK_ENABLED=0 python3 mqtt_bridge.py
+    mosquitto_pub -t esp32s3/soil -m '{"soil_moisture": 40, "temperature": 25}'
 """
 
 import paho.mqtt.client as mqtt
 import boto3
+from botocore.exceptions import ClientError
 import requests
+from requests.adapters import HTTPAdapter
+import gzip
 import json
 import logging
-from datetime import datetime
+import queue
+import random
+import re
+import signal
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from logging.handlers import RotatingFileHandler
 import os
 
@@ -34,216 +87,1207 @@ formatter = logging.Formatter(
 handler.setFormatter(formatter)
 
 logger = logging.getLogger('mqtt-bridge')
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 logger.addHandler(handler)
 
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+# Logger không in gì: dùng khi validate lại cùng message lần thứ hai (consumer webhook)
+quiet_logger = logging.getLogger('mqtt-bridge.quiet')
+quiet_logger.propagate = False
+quiet_logger.addHandler(logging.NullHandler())
+
 # =======================
 # AWS S3 & LAMBDA CONFIGURATION
 # =======================
-S3_BUCKET = "iot-gardernice"  # ← THAY ĐỔI tên bucket của bạn
-S3_REGION = "us-east-1"
+S3_BUCKET = os.environ.get("S3_BUCKET", "iot-gardernice")  # ← THAY ĐỔI tên bucket của bạn
+S3_REGION = os.environ.get("S3_REGION", "us-east-1")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None  # MinIO / S3 local khi test
+PLANT_ID = os.environ.get("PLANT_ID", "plant_001")  # phải khớp PLANT_ID của Lambda get_plant_data
+DATA_PATH_PREFIX = os.environ.get("DATA_PATH_PREFIX", "")  # phải khớp DATA_PATH_PREFIX của Lambda get_plant_data
+POINTER_WRITE_ATTEMPTS = 5  # số lần đọc lại khi PUT pointer có điều kiện bị writer khác chen vào
 
 # AWS Lambda Webhook Configuration (cũ)
-AWS_WEBHOOK_URL = "https://5gbq1zfci7.execute-api.us-east-1.amazonaws.com/prod/mqtt-ingest"
-AWS_API_KEY = "81kxQXgMvtaXVFFqyT56f8jIcuTu7uPa3UnwEzks"
+AWS_WEBHOOK_URL = os.environ.get("AWS_WEBHOOK_URL", "https://5gbq1zfci7.execute-api.us-east-1.amazonaws.com/prod/mqtt-ingest")
+AWS_API_KEY = os.environ.get("AWS_API_KEY", "81kxQXgMvtaXVFFqyT56f8jIcuTu7uPa3UnwEzks")
+WEBHOOK_ENABLED = os.environ.get("WEBHOOK_ENABLED", "1") == "1"
+WEBHOOK_TIMEOUT = float(os.environ.get("WEBHOOK_TIMEOUT", "10"))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "100"))
+# Chờ thêm tối đa WEBHOOK_BATCH_LINGER giây để gom batch khi tải thấp (0 = gửi ngay)
+WEBHOOK_BATCH_LINGER = float(os.environ.get("WEBHOOK_BATCH_LINGER", "0.2"))
+WEBHOOK_BREAKER_THRESHOLD = int(os.environ.get("WEBHOOK_BREAKER_THRESHOLD", "5"))
+WEBHOOK_BREAKER_COOLDOWN = float(os.environ.get("WEBHOOK_BREAKER_COOLDOWN", "30"))
 
-s3_client = boto3.client('s3', region_name=S3_REGION)
+s3_client = boto3.client('s3', region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL)
 
 # =======================
 # HiveMQ Cloud Configuration
 # =======================
-MQTT_BROKER = "3a28ae8aa3b449dba0a906bd966f1576.s1.eu.hivemq.cloud"
-MQTT_PORT = 8883
-MQTT_USER = "lethien"
-MQTT_PASSWORD = "Thien@123"
-MQTT_TOPIC = "esp32s3/soil"
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "3a28ae8aa3b449dba0a906bd966f1576.s1.eu.hivemq.cloud")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", "8883"))
+MQTT_USER = os.environ.get("MQTT_USER", "lethien")
+MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD", "Thien@123")
+MQTT_TOPIC = os.environ.get("MQTT_TOPIC", "esp32s3/soil")
+MQTT_TLS = os.environ.get("MQTT_TLS", "1") == "1"
 
 # =======================
-# CALLBACKS
+# PIPELINE CONFIGURATION
 # =======================
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logger.info("✓ Connected to HiveMQ Cloud successfully")
-        client.subscribe(MQTT_TOPIC)
-        logger.info(f"✓ Subscribed to topic: {MQTT_TOPIC}")
-    else:
-        logger.error(f"✗ Connection failed with code {rc}")
+S3_WORKERS = int(os.environ.get("S3_WORKERS", "8"))
+S3_QUEUE_SIZE = int(os.environ.get("S3_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+# Retry khi S3 / webhook lỗi: backoff lũy thừa từ RETRY_BASE_DELAY tới RETRY_MAX_DELAY giây
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "60"))
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "60"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # 0 = tắt HTTP /metrics
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "30"))
 
-def on_message(client, userdata, msg):
-    try:
-        logger.info(f"\n{'='*80}")
-        logger.info(f"Message received on topic: {msg.topic}")
-        logger.info(f"{'='*80}")
-        
-        # Parse payload
-        payload = json.loads(msg.payload.decode())
-        logger.info(f"RAW PAYLOAD FROM ESP32:")
-        logger.info(json.dumps(payload, indent=2))
-        logger.info(f"Payload keys: {list(payload.keys())}")
-        
-        # ============================================
-        # CLEAN & VALIDATE DATA
-        # ============================================
-        cleaned_payload = {}
-        
-        # soil_moisture (float, 0-100)
-        soil_moisture = payload.get('soil_moisture')
-        if soil_moisture is not None:
-            try:
-                soil_moisture = float(soil_moisture)
-                if 0 <= soil_moisture <= 100:
-                    cleaned_payload['soil_moisture'] = soil_moisture
+# =======================
+# WRITE-AHEAD LOG
+# =======================
+WAL_DIR = os.environ.get("WAL_DIR", os.path.expanduser("~/mqtt-bridge/wal"))
+WAL_SEGMENT_BYTES = int(os.environ.get("WAL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+WAL_SEGMENT_SECONDS = float(os.environ.get("WAL_SEGMENT_SECONDS", "3600"))
+WAL_MAX_BYTES = int(os.environ.get("WAL_MAX_BYTES", str(1024 * 1024 * 1024)))
+# fsync nền mỗi WAL_FSYNC_INTERVAL giây (0 = fsync từng message, chậm hơn nhiều)
+WAL_FSYNC_INTERVAL = float(os.environ.get("WAL_FSYNC_INTERVAL", "1"))
+# Chu kỳ lưu cursor, xoay segment theo thời gian, xóa segment đã xử lý xong
+WAL_CHECKPOINT_INTERVAL = float(os.environ.get("WAL_CHECKPOINT_INTERVAL", "1"))
+
+# =======================
+# S3 BATCHING
+# =======================
+S3_FLUSH_INTERVAL = float(os.environ.get("S3_FLUSH_INTERVAL", "30"))
+S3_BATCH_MAX_RECORDS = int(os.environ.get("S3_BATCH_MAX_RECORDS", "500"))
+S3_BATCH_MAX_BYTES = int(os.environ.get("S3_BATCH_MAX_BYTES", str(1024 * 1024)))  # trước khi nén
+S3_BATCH_GZIP = os.environ.get("S3_BATCH_GZIP", "1") == "1"
+DEVICE_ID = os.environ.get("DEVICE_ID", "esp32s3-cam")  # khi payload không có device_id
+# Phân biệt các bridge trong tên key; mặc định sinh 1 lần và lưu trong WAL_DIR/bridge_id
+BRIDGE_ID = os.environ.get("BRIDGE_ID")
+
+
+# =======================
+# WRITE-AHEAD LOG
+# =======================
+class WriteAheadLog:
+    """
+    Log append-only trên đĩa, chia segment <first_seq>.wal, mỗi dòng 1 message JSON có seq tăng dần.
+
+    Mỗi consumer (s3, webhook) có cursor riêng lưu trong cursors.json: mọi seq < cursor đã giao xong.
+    Segment mà mọi consumer đã đi qua bị xóa. Tổng dung lượng vượt max_bytes thì segment cũ nhất
+    bị bỏ dù chưa giao (đếm vào evicted) để sink ngừng lâu không làm đầy đĩa.
+    """
+
+    def __init__(self, directory, segment_bytes, segment_seconds, max_bytes, fsync_interval):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.cond = threading.Condition()
+        self.bridge_id = BRIDGE_ID or self._load_bridge_id()
+        self.cursors = self._load_cursors()
+        self.appended = self.evicted = 0
+        self._dirty = False
+        # [first_seq, bytes] theo thứ tự; phần tử cuối là segment đang ghi
+        self._segments = []
+        last_seq = 0
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".wal"):
+                first_seq = int(name[:-4])
+                size, seq = self._recover(self.segment_path(first_seq))
+                self._segments.append([first_seq, size])
+                last_seq = max(last_seq, seq or first_seq - 1)
+        # seq không bao giờ dùng lại (key S3 / message_id webhook dựa trên seq)
+        self.next_seq = max([last_seq + 1] + list(self.cursors.values()))
+        self._open_segment()
+
+    def segment_path(self, first_seq):
+        return os.path.join(self.directory, f"{first_seq:016d}.wal")
+
+    def _load_bridge_id(self):
+        path = os.path.join(self.directory, "bridge_id")
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(uuid.uuid4().hex[:8])
+        with open(path) as f:
+            return f.read().strip()
+
+    def _load_cursors(self):
+        try:
+            with open(os.path.join(self.directory, "cursors.json")) as f:
+                return {k: int(v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+
+    def save_cursors(self, cursors):
+        path = os.path.join(self.directory, "cursors.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(cursors, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.cursors = dict(cursors)
+
+    @staticmethod
+    def _recover(path):
+        """Cắt dòng ghi dở ở cuối segment (crash giữa lúc write); trả về (size, seq cuối)."""
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(end)
+                logger.warning(f"⚠️  WAL: truncated {len(data) - end} bytes of partial record in {path}")
+        lines = data[:end].splitlines()
+        return end, json.loads(lines[-1])["seq"] if lines else None
+
+    def _open_segment(self):
+        if not self._segments or self._segments[-1][1] > 0 or self._segments[-1][0] != self.next_seq:
+            self._segments.append([self.next_seq, 0])
+        self._file = open(self.segment_path(self._segments[-1][0]), "ab")
+        self._opened_at = time.monotonic()
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._dirty = False
+        self._open_segment()
+
+    def append(self, entry):
+        """Ghi 1 message, trả về seq. Chỉ write + flush vào page cache; fsync chạy nền (checkpoint)."""
+        with self.cond:
+            seq = self.next_seq
+            line = (json.dumps(dict(entry, seq=seq), separators=(',', ':')) + "\n").encode("utf-8")
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync_interval <= 0:
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty = True
+            self.next_seq += 1
+            self.appended += 1
+            self._segments[-1][1] += len(line)
+            if self._segments[-1][1] >= self.segment_bytes:
+                self._rotate()
+            self.cond.notify_all()
+        return seq
+
+    def checkpoint(self, cursors):
+        """fsync, xoay segment quá hạn, lưu cursor, xóa segment đã giao xong / vượt max_bytes."""
+        with self.cond:
+            if self._dirty:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+            if self._segments[-1][1] > 0 and time.monotonic() - self._opened_at >= self.segment_seconds:
+                self._rotate()
+            low = min(cursors.values(), default=self.next_seq)
+            removed = []
+            while len(self._segments) > 1:
+                next_first = self._segments[1][0]
+                total = sum(size for _, size in self._segments)
+                if next_first <= low:
+                    removed.append(self._segments.pop(0)[0])
+                elif total > self.max_bytes:
+                    lost = next_first - max(self._segments[0][0], low)
+                    self.evicted += lost
+                    removed.append(self._segments.pop(0)[0])
+                    logger.error(f"✗ WAL over {self.max_bytes} bytes: evicted segment with {lost} undelivered messages")
+                    low = next_first
                 else:
-                    logger.warning(f"⚠️  soil_moisture out of range: {soil_moisture}")
-            except (ValueError, TypeError):
-                logger.warning(f"⚠️  Invalid soil_moisture: {soil_moisture}")
-        
-        # rain (convert string to int: "0" -> 0)
-        rain = payload.get('rain')
-        if rain is not None:
+                    break
+        if cursors != self.cursors:
+            self.save_cursors(cursors)
+        for first_seq in removed:
+            try:
+                os.remove(self.segment_path(first_seq))
+            except FileNotFoundError:
+                pass
+
+    @property
+    def oldest_seq(self):
+        with self.cond:
+            return self._segments[0][0]
+
+    def segment_of(self, seq):
+        """first_seq của segment chứa seq; None nếu đã bị xóa."""
+        with self.cond:
+            for i, (first_seq, _) in enumerate(self._segments):
+                upper = self._segments[i + 1][0] if i + 1 < len(self._segments) else float("inf")
+                if first_seq <= seq < upper:
+                    return first_seq
+        return None
+
+    def close(self):
+        with self.cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "bridge_id": self.bridge_id,
+                "segments": len(self._segments),
+                "bytes": sum(size for _, size in self._segments),
+                "max_bytes": self.max_bytes,
+                "next_seq": self.next_seq,
+                "appended": self.appended,
+                "evicted": self.evicted,
+            }
+
+
+class WalReader:
+    """Đọc tuần tự WAL từ seq, kể cả segment đang được ghi (tail)."""
+
+    def __init__(self, wal, seq):
+        self.wal = wal
+        self.seq = seq
+        self.skipped = 0
+        self._file = None
+        self._segment = None
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+        self._file = self._segment = None
+
+    def read(self, limit, timeout):
+        with self.wal.cond:
+            if self.seq >= self.wal.next_seq:
+                self.wal.cond.wait(timeout)
+            head = self.wal.next_seq
+        oldest = self.wal.oldest_seq
+        if self.seq < oldest:
+            # Segment đã bị evict khi đĩa vượt giới hạn
+            self.skipped += oldest - self.seq
+            self.seq = oldest
+            self._close()
+
+        entries = []
+        while len(entries) < limit and self.seq < head:
+            if self._file is None:
+                self._segment = self.wal.segment_of(self.seq)
+                if self._segment is None:
+                    break
+                self._file = open(self.wal.segment_path(self._segment), "rb")
+            pos = self._file.tell()
+            line = self._file.readline()
+            if not line.endswith(b"\n"):
+                self._file.seek(pos)
+                # Hết segment: nếu đã có segment sau thì segment này đã đóng, chuyển sang segment sau
+                if self.wal.segment_of(self.seq) != self._segment:
+                    self._close()
+                    continue
+                break
+            entry = json.loads(line)
+            if entry["seq"] < self.seq:
+                continue
+            self.seq = entry["seq"] + 1
+            entries.append(entry)
+        return entries
+
+
+class Cursor:
+    """
+    Vị trí đã giao xong của một consumer. Ack có thể đến không theo thứ tự (nhiều worker,
+    batch theo topic); committed chỉ tiến qua các seq liên tiếp đã xong.
+    """
+
+    def __init__(self, start):
+        self.committed = start
+        self._pending = {}  # seq -> [done, ts], theo thứ tự seq
+        self._lock = threading.Lock()
+
+    def track(self, seq, ts):
+        with self._lock:
+            self._pending[seq] = [False, ts]
+
+    def ack(self, seqs):
+        with self._lock:
+            for seq in seqs:
+                if seq in self._pending:
+                    self._pending[seq][0] = True
+            for seq in list(self._pending):
+                if not self._pending[seq][0]:
+                    self.committed = seq
+                    break
+                del self._pending[seq]
+                self.committed = seq + 1
+
+    def advance(self, seq):
+        """Không còn entry đang xử lý: dời cursor tới seq (vd sau khi reader bỏ qua segment bị evict)."""
+        with self._lock:
+            if not self._pending:
+                self.committed = max(self.committed, seq)
+
+    def lag_seconds(self):
+        with self._lock:
+            for done, ts in self._pending.values():
+                return round(max(0.0, time.time() - ts), 3)
+        return 0.0
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._pending)
+
+
+class WalConsumer:
+    """
+    Thread đọc WAL từ cursor đã lưu và giao từng lô entry cho dispatch(entries) (có thể block =
+    backpressure). linger > 0: lô chưa đầy thì chờ thêm tối đa linger giây để gom.
+    """
+
+    def __init__(self, name, wal, dispatch, batch=256, linger=0.0):
+        self.name = name
+        self.wal = wal
+        self.dispatch = dispatch
+        self.batch = batch
+        self.linger = linger
+        start = max(wal.cursors.get(name, wal.oldest_seq), wal.oldest_seq)
+        self.cursor = Cursor(start)
+        self.reader = WalReader(wal, start)
+        self.replay_backlog = wal.next_seq - start
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.replay_backlog:
+            logger.info(f"↻ [{self.name}] replaying {self.replay_backlog} messages from WAL")
+        self._thread = threading.Thread(target=self._run, name=f"wal-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            entries = self.reader.read(self.batch, timeout=0.5)
+            if not entries:
+                self.cursor.advance(self.reader.seq)
+                continue
+            if self.linger and len(entries) < self.batch and not self._stop.wait(self.linger):
+                entries += self.reader.read(self.batch - len(entries), timeout=0)
+            for entry in entries:
+                self.cursor.track(entry["seq"], entry["ts"])
+            if not self.dispatch(entries):
+                return
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            "cursor": self.cursor.committed,
+            "lag_messages": self.wal.next_seq - self.cursor.committed,
+            "lag_seconds": self.cursor.lag_seconds(),
+            "in_flight": self.cursor.in_flight(),
+            "replay_backlog_at_start": self.replay_backlog,
+            "skipped_evicted": self.reader.skipped,
+        }
+
+
+# =======================
+# PIPELINE
+# =======================
+class PermanentError(Exception):
+    """Lỗi không retry được (vd webhook trả 4xx): item bị bỏ và vẫn được ack."""
+
+
+class CircuitOpenError(Exception):
+    """Circuit breaker đang mở: chờ retry_after giây rồi thử lại, không tính là lỗi."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class Stage:
+    """
+    Queue giới hạn + worker pool. handler(item) lỗi thì retry với backoff tới khi thành công
+    (dữ liệu vẫn nằm trong WAL nên chờ không mất gì); on_done(item, ok) được gọi sau cùng.
+    """
+
+    def __init__(self, name, handler, workers, max_queue, on_done):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.on_done = on_done
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.enqueued = self.processed = self.failed = self.retries = 0
+        self.max_depth = 0
+        self._busy_seconds = 0.0
+        self._wait_seconds = 0.0
+        self._max_latency = 0.0
+
+    def put_wait(self, item, stop_event=None, deadline=None):
+        """Chờ tới khi queue có chỗ (backpressure lên consumer WAL); False nếu stop_event / quá deadline."""
+        while not (stop_event and stop_event.is_set()) and not (deadline and time.monotonic() > deadline):
             try:
-                # If string, convert to int
-                rain = int(str(rain))
-                cleaned_payload['rain'] = rain  # 0 = rain, 1 = dry
-            except (ValueError, TypeError):
-                logger.warning(f"⚠️  Invalid rain: {rain}")
-        
-        # temperature (float, typically -40 to 125)
-        temperature = payload.get('temperature')
-        if temperature is not None:
+                self._queue.put((time.monotonic(), item), timeout=0.5)
+            except queue.Full:
+                continue
+            with self._lock:
+                self.enqueued += 1
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+            return True
+        return False
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _call(self, item):
+        """True: xong; False: lỗi vĩnh viễn; None: bỏ dở do shutdown (item còn trong WAL)."""
+        delay = RETRY_BASE_DELAY
+        while True:
             try:
-                temperature = float(temperature)
-                if -40 <= temperature <= 125:
-                    cleaned_payload['temperature'] = temperature
-                else:
-                    logger.warning(f"⚠️  temperature out of range: {temperature}")
-            except (ValueError, TypeError):
-                logger.warning(f"⚠️  Invalid temperature: {temperature}")
-        
-        # humidity (float, 0-100)
-        humidity = payload.get('humidity')
-        if humidity is not None:
+                self.handler(item)
+                return True
+            except PermanentError as e:
+                logger.error(f"✗ [{self.name}] {e}")
+                return False
+            except CircuitOpenError as e:
+                if self._stopping.wait(e.retry_after):
+                    return None
+            except Exception as e:
+                if self._stopping.is_set():
+                    return None
+                logger.warning(f"⚠️  [{self.name}] {e}; retry in {delay:.0f}s")
+                with self._lock:
+                    self.retries += 1
+                # Jitter: các worker không retry đồng loạt
+                if self._stopping.wait(delay * random.uniform(0.5, 1.0)):
+                    return None
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    def _run(self):
+        while True:
+            enqueued_at, item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            started = time.monotonic()
             try:
-                humidity = float(humidity)
-                if 0 <= humidity <= 100:
-                    cleaned_payload['humidity'] = humidity
-                else:
-                    logger.warning(f"⚠️  humidity out of range: {humidity}")
-            except (ValueError, TypeError):
-                logger.warning(f"⚠️  Invalid humidity: {humidity}")
-        
-        # light_level (float, >= 0)
-        light_level = payload.get('light_level')
-        if light_level is not None:
+                ok = self._call(item)
+                if ok is not None:
+                    self.on_done(item, ok)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._busy_seconds += elapsed
+                    self._wait_seconds += started - enqueued_at
+                    self._max_latency = max(self._max_latency, elapsed)
+                    if ok:
+                        self.processed += 1
+                    elif ok is False:
+                        self.failed += 1
+                self._queue.task_done()
+
+    def join(self, deadline):
+        """Chờ queue rỗng tới deadline (monotonic); True nếu đã drain hết."""
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    def stop(self):
+        """Dừng worker (cắt retry đang chờ); trả về số item chưa giao, sẽ được replay từ WAL."""
+        self._stopping.set()
+        pending = 0
+        while True:
             try:
-                light_level = float(light_level)
-                if light_level >= 0:
-                    cleaned_payload['light_level'] = light_level
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._queue.task_done()
+            pending += 1
+        for _ in self._threads:
+            self._queue.put((time.monotonic(), None))
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+        return pending
+
+    def stats(self):
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "max_depth": self.max_depth,
+                "workers": self.workers,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "avg_latency_ms": round(1000 * self._busy_seconds / done, 2) if done else 0.0,
+                "max_latency_ms": round(1000 * self._max_latency, 2),
+                "avg_queue_wait_ms": round(1000 * self._wait_seconds / done, 2) if done else 0.0,
+            }
+
+
+class BatchWriter:
+    """
+    Gom record theo (topic, device_id). Batch được niêm phong khi đủ max_records / max_bytes
+    (trong add) hoặc mở quá interval giây (thread flusher), rồi giao cho sink (stage s3).
+
+    Key dựa trên seq WAL của record đầu batch. Cursor chỉ lưu phần seq liên tiếp đã xong nên sau
+    crash, replay gom lại record theo cách khác (device xen kẽ) và đổi seq đầu batch; vì vậy
+    ranh giới batch (key + seqs) được ghi vào journal (fsync) trước khi upload. Khi khởi động:
+    batch trong journal có seq đầu < cursor đã upload xong (ack cả batch một lần) nên seq còn lại
+    của nó được bỏ qua (on_skip ack); batch chưa chắc đã upload được dựng lại đúng key cũ.
+    """
+
+    def __init__(self, sink, bridge_id, max_records, max_bytes, interval, journal_path, committed, on_skip):
+        self.sink = sink
+        self.bridge_id = bridge_id
+        self.max_records = max(1, max_records)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.journal_path = journal_path
+        self.on_skip = on_skip
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.records_in = self.records_out = 0
+        self.batches = {"size": 0, "interval": 0, "shutdown": 0, "rebuilt": 0}
+        self.skipped = 0
+        # key -> seqs của các batch trong journal mà cursor chưa đi qua hết
+        self._journal = {}
+        self._skip = set()
+        self._rebuild_key = {}  # seq -> key batch cũ cần dựng lại
+        self._rebuild_seqs = {}  # key -> seqs của batch cũ
+        self._load_journal(committed)
+
+    # ---------- journal ranh giới batch ----------
+    def _load_journal(self, committed):
+        try:
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # dòng ghi dở khi crash: batch đó chưa được upload
+                    self._journal[item["key"]] = item["seqs"]
+        except FileNotFoundError:
+            pass
+        for key, seqs in list(self._journal.items()):
+            if max(seqs) < committed:
+                del self._journal[key]
+            elif min(seqs) < committed:
+                self._skip.update(s for s in seqs if s >= committed)
+            else:
+                self._rebuild_seqs[key] = seqs
+                for seq in seqs:
+                    self._rebuild_key[seq] = key
+        if self._skip or self._rebuild_seqs:
+            logger.info(f"↻ batch journal: skipping {len(self._skip)} already uploaded records, "
+                        f"rebuilding {len(self._rebuild_seqs)} batches with their original keys")
+        self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for key, seqs in self._journal.items():
+                f.write(json.dumps({"key": key, "seqs": seqs}, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal_file = open(self.journal_path, "a")
+        self._journal_lines = len(self._journal)
+
+    def _record_batch(self, key, seqs):
+        """Gọi khi đang giữ lock, trước khi giao batch cho sink."""
+        self._journal[key] = seqs
+        self._journal_file.write(json.dumps({"key": key, "seqs": seqs}, separators=(',', ':')) + "\n")
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self._journal_lines += 1
+
+    def compact_journal(self, committed):
+        """Bỏ batch mà cursor đã đi qua hết; chỉ viết lại file khi journal đã dài gấp đôi phần còn dùng."""
+        with self._lock:
+            for key in [k for k, seqs in self._journal.items() if max(seqs) < committed]:
+                del self._journal[key]
+            if self._journal_lines > 2 * len(self._journal) + 64:
+                self._journal_file.close()
+                self._rewrite_journal()
+
+    # ---------- batch ----------
+    def add(self, record, seq):
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            if seq in self._skip:
+                # Thuộc batch đã upload trước khi crash: không ghi lại thành bản trùng
+                self._skip.discard(seq)
+                self.skipped += 1
+                skipped = True
+            else:
+                skipped = False
+                key = self._rebuild_key.pop(seq, None)
+                key = ("rebuild", key) if key else (record['topic'], record['device_id'])
+                buf = self._buffers.get(key)
+                if buf is None:
+                    buf = self._buffers[key] = {"lines": [], "seqs": [], "bytes": 0, "opened": time.monotonic(),
+                                                "first_at": record['mqtt_timestamp'], "topic": record['topic'],
+                                                "device_id": record['device_id']}
+                buf["lines"].append(line)
+                buf["seqs"].append(seq)
+                buf["bytes"] += len(line) + 1
+                buf["last"] = record
+                self.records_in += 1
+                if key[0] == "rebuild":
+                    full = len(buf["seqs"]) >= len(self._rebuild_seqs[key[1]])
                 else:
-                    logger.warning(f"⚠️  light_level negative: {light_level}, skipping")
-            except (ValueError, TypeError):
-                logger.warning(f"⚠️  Invalid light_level: {light_level}")
-        
-        logger.info(f"✓ CLEANED PAYLOAD:")
-        logger.info(json.dumps(cleaned_payload, indent=2))
-        
-        if not cleaned_payload:
-            logger.error("✗ No valid data to store!")
-            return
-        
-        # ============================================
-        # SAVE TO S3
-        # ============================================
-        now = datetime.utcnow()
-        timestamp_str = now.strftime('%Y-%m-%d_%H-%M-%S')
-        
-        # S3 key: raw_data/esp32s3/soil/2024-11-25_13-36-42.json
-        s3_key = f"raw_data/{msg.topic}/{timestamp_str}.json"
-        
-        # Data to store
-        data_to_store = {
-            'topic': msg.topic,
-            'payload': cleaned_payload,
-            'mqtt_timestamp': datetime.utcnow().isoformat() + 'Z',
-            'qos': msg.qos,
-            'retain': msg.retain,
-            'device_id': 'esp32s3-cam'
+                    full = len(buf["lines"]) >= self.max_records or buf["bytes"] >= self.max_bytes
+                batch = self._seal(key, "size") if full else None
+        if skipped:
+            self.on_skip([seq])
+            return True
+        return self.sink(batch) if batch else True
+
+    def _seal(self, key, reason):
+        """Gọi khi đang giữ lock: lấy buffer ra khỏi map, dựng batch kèm S3 key và ghi journal."""
+        buf = self._buffers.pop(key)
+        if key[0] == "rebuild":
+            # Batch cũ dựng lại từ journal: giữ nguyên key (thiếu record, vd WAL bị evict, thì ghi phần có)
+            s3_key = key[1]
+            for seq in self._rebuild_seqs.pop(s3_key):
+                self._rebuild_key.pop(seq, None)
+            reason = "rebuilt"
+        else:
+            first_at = datetime.fromisoformat(buf["first_at"].rstrip('Z'))
+            safe_device = re.sub(r'[^A-Za-z0-9.-]', '-', str(buf["device_id"]))
+            ext = ".ndjson.gz" if S3_BATCH_GZIP else ".ndjson"
+            s3_key = (f"raw_data/{buf['topic']}/{first_at.strftime('%Y-%m-%d_%H-%M-%S')}"
+                      f"_{safe_device}_{self.bridge_id}-{buf['seqs'][0]:012d}{ext}")
+        self._record_batch(s3_key, buf["seqs"])
+        self.batches[reason] += 1
+        self.records_out += len(buf["lines"])
+        return {"key": s3_key, "topic": buf["topic"], "device_id": buf["device_id"],
+                "lines": buf["lines"], "seqs": buf["seqs"], "last": buf["last"]}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="batch-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        tick = max(0.05, min(1.0, self.interval / 4))
+        while not self._stop.wait(tick):
+            now = time.monotonic()
+            with self._lock:
+                expired = [self._seal(k, "interval") for k, buf in list(self._buffers.items())
+                           if now - buf["opened"] >= self.interval]
+            for batch in expired:
+                self.sink(batch)
+
+    def stop(self):
+        """Dừng flusher và ghi nốt mọi buffer đang mở."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        with self._lock:
+            remaining = [self._seal(k, "shutdown") for k in list(self._buffers)]
+        for batch in remaining:
+            self.sink(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_batches": len(self._buffers),
+                "buffered_records": sum(len(b["lines"]) for b in self._buffers.values()),
+                "records_in": self.records_in,
+                "records_out": self.records_out,
+                "batches": dict(self.batches),
+                "replay_skipped": self.skipped,
+            }
+
+
+class Pipeline:
+    def __init__(self):
+        self.wal = WriteAheadLog(WAL_DIR, WAL_SEGMENT_BYTES, WAL_SEGMENT_SECONDS, WAL_MAX_BYTES, WAL_FSYNC_INTERVAL)
+        # _stop_reading: consumer ngừng đẩy entry mới; _deadline: hạn chót flush batch khi shutdown
+        self._stop_reading = threading.Event()
+        self._deadline = None
+        self.s3 = Stage("s3", upload_batch, S3_WORKERS, S3_QUEUE_SIZE,
+                        on_done=lambda batch, ok: self.consumers["s3"].cursor.ack(batch['seqs']))
+        self.consumers = {"s3": WalConsumer("s3", self.wal, self._dispatch_s3)}
+        s3_cursor = self.consumers["s3"].cursor
+        self.writer = BatchWriter(lambda batch: self.s3.put_wait(batch, self._stop_reading if self._deadline is None else None, self._deadline), self.wal.bridge_id,
+                                  S3_BATCH_MAX_RECORDS, S3_BATCH_MAX_BYTES, S3_FLUSH_INTERVAL,
+                                  os.path.join(self.wal.directory, "batches.ndjson"), s3_cursor.committed, s3_cursor.ack)
+        self.stages = [self.s3]
+        if WEBHOOK_ENABLED:
+            self.webhook_client = WebhookClient(AWS_WEBHOOK_URL, AWS_API_KEY, WEBHOOK_WORKERS, WEBHOOK_TIMEOUT,
+                                                CircuitBreaker(WEBHOOK_BREAKER_THRESHOLD, WEBHOOK_BREAKER_COOLDOWN))
+            self.webhook = Stage("webhook", self.webhook_client.send, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+                                 on_done=lambda batch, ok: self.consumers["webhook"].cursor.ack(batch['seqs']))
+            self.consumers["webhook"] = WalConsumer("webhook", self.wal, self._dispatch_webhook,
+                                                    batch=WEBHOOK_BATCH_SIZE, linger=WEBHOOK_BATCH_LINGER)
+            self.stages.append(self.webhook)
+        self._checkpoint_stop = threading.Event()
+        self.started_at = time.time()
+
+    def submit(self, topic, payload, qos, retain):
+        """Gọi từ on_message: ghi WAL (vào page cache, không fsync) rồi trả về; S3 / webhook đọc từ WAL."""
+        try:
+            self.wal.append({
+                "topic": topic,
+                # surrogateescape: giữ nguyên byte payload không phải UTF-8 để validate log đúng lỗi
+                "payload": payload.decode("utf-8", "surrogateescape"),
+                "qos": qos,
+                "retain": retain,
+                "ts": time.time(),
+            })
+        except OSError as e:
+            logger.error(f"✗ WAL append failed, message on {topic} lost: {e}")
+
+    def _dispatch_s3(self, entries):
+        for entry in entries:
+            record = build_entry_record(entry, self.wal.bridge_id)
+            if record is None:
+                self.consumers["s3"].cursor.ack([entry["seq"]])
+            elif not self.writer.add(record, entry["seq"]):
+                return False
+        return True
+
+    def _dispatch_webhook(self, entries):
+        # Lỗi validate đã được consumer s3 log, không log lần hai
+        valid, invalid = [], []
+        for entry in entries:
+            record = build_entry_record(entry, self.wal.bridge_id, log=quiet_logger)
+            if record is None:
+                invalid.append(entry["seq"])
+            else:
+                valid.append((entry["seq"], record))
+        if invalid:
+            self.consumers["webhook"].cursor.ack(invalid)
+        if not valid:
+            return True
+        # "records" co lại khi Lambda chỉ nhận một phần; "seqs" giữ nguyên để ack cả lô khi xong
+        batch = {"records": [r for _, r in valid], "seqs": [seq for seq, _ in valid]}
+        return self.webhook.put_wait(batch, self._stop_reading)
+
+    def _checkpoint_loop(self):
+        while not self._checkpoint_stop.wait(WAL_CHECKPOINT_INTERVAL):
+            try:
+                self.checkpoint()
+            except OSError as e:
+                logger.error(f"✗ WAL checkpoint failed: {e}")
+
+    def checkpoint(self):
+        committed = {name: c.cursor.committed for name, c in self.consumers.items()}
+        self.wal.checkpoint(committed)
+        self.writer.compact_journal(committed["s3"])
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self.writer.start()
+        for consumer in self.consumers.values():
+            consumer.start()
+        self._checkpoint_thread = threading.Thread(target=self._checkpoint_loop, name="wal-checkpoint", daemon=True)
+        self._checkpoint_thread.start()
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Ngừng đọc WAL, flush batch đang mở, drain các stage (tối đa timeout giây); phần chưa giao
+        xong vẫn nằm trong WAL và được replay ở lần chạy sau.
+        """
+        self._deadline = deadline = time.monotonic() + timeout
+        self._stop_reading.set()
+        for consumer in self.consumers.values():
+            consumer.stop()
+        self.writer.stop()
+        for stage in self.stages:
+            stage.join(deadline)
+            pending = stage.stop()
+            if pending:
+                logger.warning(f"⚠️  [{stage.name}] shutdown timeout, {pending} items left in WAL for replay")
+        self._checkpoint_stop.set()
+        self._checkpoint_thread.join()
+        self.checkpoint()
+        self.wal.close()
+
+    def stats(self):
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "wal": self.wal.stats(),
+            "consumers": {name: c.stats() for name, c in self.consumers.items()},
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+            "batches": self.writer.stats(),
+            "webhook": self.webhook_client.stats() if WEBHOOK_ENABLED else None,
         }
-        
-        logger.info(f"💾 DATA TO BE STORED IN S3:")
-        logger.info(json.dumps(data_to_store, indent=2))
-        
+
+
+pipeline = None
+
+
+# =======================
+# STAGE HANDLERS
+# =======================
+def clean_payload(payload, log=logger):
+    """
+    CLEAN & VALIDATE DATA: giữ các field hợp lệ, bỏ (và log) field sai kiểu / ngoài khoảng.
+    """
+    cleaned_payload = {}
+
+    # soil_moisture (float, 0-100)
+    soil_moisture = payload.get('soil_moisture')
+    if soil_moisture is not None:
+        try:
+            soil_moisture = float(soil_moisture)
+            if 0 <= soil_moisture <= 100:
+                cleaned_payload['soil_moisture'] = soil_moisture
+            else:
+                log.warning(f"⚠️  soil_moisture out of range: {soil_moisture}")
+        except (ValueError, TypeError):
+            log.warning(f"⚠️  Invalid soil_moisture: {soil_moisture}")
+
+    # rain (convert string to int: "0" -> 0)
+    rain = payload.get('rain')
+    if rain is not None:
+        try:
+            # If string, convert to int
+            rain = int(str(rain))
+            cleaned_payload['rain'] = rain  # 0 = rain, 1 = dry
+        except (ValueError, TypeError):
+            log.warning(f"⚠️  Invalid rain: {rain}")
+
+    # temperature (float, typically -40 to 125)
+    temperature = payload.get('temperature')
+    if temperature is not None:
+        try:
+            temperature = float(temperature)
+            if -40 <= temperature <= 125:
+                cleaned_payload['temperature'] = temperature
+            else:
+                log.warning(f"⚠️  temperature out of range: {temperature}")
+        except (ValueError, TypeError):
+            log.warning(f"⚠️  Invalid temperature: {temperature}")
+
+    # humidity (float, 0-100)
+    humidity = payload.get('humidity')
+    if humidity is not None:
+        try:
+            humidity = float(humidity)
+            if 0 <= humidity <= 100:
+                cleaned_payload['humidity'] = humidity
+            else:
+                log.warning(f"⚠️  humidity out of range: {humidity}")
+        except (ValueError, TypeError):
+            log.warning(f"⚠️  Invalid humidity: {humidity}")
+
+    # light_level (float, >= 0)
+    light_level = payload.get('light_level')
+    if light_level is not None:
+        try:
+            light_level = float(light_level)
+            if light_level >= 0:
+                cleaned_payload['light_level'] = light_level
+            else:
+                log.warning(f"⚠️  light_level negative: {light_level}, skipping")
+        except (ValueError, TypeError):
+            log.warning(f"⚠️  Invalid light_level: {light_level}")
+
+    return cleaned_payload
+
+
+def build_record(topic, raw_payload, qos, retain, received_at, log=logger):
+    """Stage validate: parse + clean; None nếu không có gì để lưu."""
+    try:
+        payload = json.loads(raw_payload.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        log.error(f"✗ JSON decode error on {topic}: {e}")
+        log.debug(f"Raw payload: {raw_payload!r}")
+        return None
+    if not isinstance(payload, dict):
+        log.error(f"✗ Payload on {topic} is not a JSON object")
+        return None
+    log.debug(f"RAW PAYLOAD FROM ESP32 ({topic}): {json.dumps(payload)}")
+
+    cleaned_payload = clean_payload(payload, log)
+    if not cleaned_payload:
+        log.error(f"✗ No valid data to store! ({topic})")
+        return None
+
+    return {
+        'topic': topic,
+        'payload': cleaned_payload,
+        # Thời điểm bridge nhận message (không phải lúc worker xử lý)
+        'mqtt_timestamp': received_at.isoformat() + 'Z',
+        'qos': qos,
+        'retain': retain,
+        'device_id': str(payload.get('device_id') or DEVICE_ID)
+    }
+
+
+def build_entry_record(entry, bridge_id, log=logger):
+    """Entry WAL -> record; message_id = <bridge_id>-<seq> ổn định qua các lần replay."""
+    record = build_record(entry["topic"], entry["payload"].encode("utf-8", "surrogateescape"),
+                          entry["qos"], entry["retain"], datetime.utcfromtimestamp(entry["ts"]), log)
+    if record is not None:
+        record['message_id'] = f"{bridge_id}-{entry['seq']}"
+    return record
+
+
+def latest_pointer_key(metric):
+    """Cùng quy tắc với get_plant_data.latest_pointer_key: <DATA_PATH_PREFIX>latest/<PLANT_ID>/<metric>.json"""
+    return f"{DATA_PATH_PREFIX}latest/{PLANT_ID}/{metric}.json"
+
+
+def pointer_time(record):
+    """mqtt_timestamp của record dạng datetime UTC; None nếu không parse được."""
+    try:
+        t = datetime.fromisoformat(str(record.get('mqtt_timestamp')).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def update_latest_pointer(metric, record):
+    """
+    Ghi pointer chỉ khi record không cũ hơn pointer hiện có (WAL replay, Lambda ghi cùng topic
+    không kéo "latest" lùi lại): GET + so sánh + PUT có điều kiện (If-Match / If-None-Match),
+    bị writer khác chen vào (412) thì đọc lại.
+    """
+    key = latest_pointer_key(metric)
+    new_time = pointer_time(record)
+    for _ in range(POINTER_WRITE_ATTEMPTS):
+        try:
+            obj = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+            current_time, condition = pointer_time(json.loads(obj['Body'].read())), {'IfMatch': obj['ETag']}
+        except s3_client.exceptions.NoSuchKey:
+            current_time, condition = None, {'IfNoneMatch': '*'}
+        if current_time is not None and (new_time is None or new_time < current_time):
+            logger.debug(f"Latest pointer {key} is newer ({current_time.isoformat()}), not overwriting")
+            return False
         try:
             s3_client.put_object(
                 Bucket=S3_BUCKET,
-                Key=s3_key,
-                Body=json.dumps(data_to_store, indent=2),
+                Key=key,
+                Body=json.dumps(record),
                 ContentType='application/json',
-                Metadata={
-                    'source': 'mqtt-bridge-ec2',
-                    'topic': msg.topic,
-                    'processed_at': datetime.utcnow().isoformat()
-                }
+                CacheControl='no-cache',
+                **condition
             )
-            
-            logger.info(f"✓ Successfully saved to S3")
-            logger.info(f"  S3 Bucket: {S3_BUCKET}")
-            logger.info(f"  S3 Key: {s3_key}")
-            logger.info(f"  Object size: {len(json.dumps(data_to_store))} bytes")
-            
-        except Exception as e:
-            logger.error(f"✗ Error saving to S3: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-        
-        # ============================================
-        # SEND TO LAMBDA WEBHOOK (CŨ)
-        # ============================================
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+    logger.warning(f"Latest pointer {key}: too many concurrent writers, skipped")
+    return False
+
+
+def upload_batch(batch):
+    """Stage s3: 1 object NDJSON cho cả batch + pointer latest (record cuối) cho dashboard."""
+    body = ('\n'.join(batch['lines']) + '\n').encode('utf-8')
+    if S3_BATCH_GZIP:
+        body = gzip.compress(body, mtime=0)
+
+    s3_client.put_object(
+        Bucket=S3_BUCKET,
+        Key=batch['key'],
+        Body=body,
+        ContentType='application/x-ndjson',
+        Metadata={
+            'source': 'mqtt-bridge-ec2',
+            'topic': batch['topic'],
+            'device_id': str(batch['device_id']),
+            'records': str(len(batch['lines'])),
+            'processed_at': datetime.utcnow().isoformat()
+        }
+    )
+
+    # Pointer "latest" cho dashboard: get_plant_data đọc 1 GET thay vì list + sort prefix
+    update_latest_pointer(f"sensors/{batch['topic']}", batch['last'])
+    logger.debug(f"✓ Saved {len(batch['lines'])} records to S3: {batch['key']}")
+
+
+class CircuitBreaker:
+    """
+    closed -> open sau threshold lỗi liên tiếp; open -> half-open sau cooldown giây, cho đúng
+    1 request thử: thành công thì closed, lỗi thì open lại.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Raise CircuitOpenError nếu chưa được gọi."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self.state = "half-open"
+            if self.state == "half-open":
+                if self._trial:
+                    raise CircuitOpenError(min(1.0, self.cooldown))
+                self._trial = True
+
+    def record(self, success):
+        with self._lock:
+            self._trial = False
+            if success:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.opened += 1
+                    logger.warning(f"⚠️  webhook circuit open for {self.cooldown:.0f}s after {self.failures} failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "opened": self.opened}
+
+
+class WebhookClient:
+    """
+    Stage webhook: POST mảng message lên Lambda mqtt-ingest qua 1 Session keep-alive dùng chung
+    (pool tối đa `connections` kết nối = số worker), có circuit breaker.
+    """
+
+    def __init__(self, url, api_key, connections, timeout, breaker):
+        self.url = url
+        self.timeout = timeout
+        self.breaker = breaker
+        self.session = requests.Session()
+        self.session.headers.update({"x-api-key": api_key, "Content-Type": "application/json"})
+        # pool_block: không mở quá `connections` kết nối; retry do Stage đảm nhận
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections, pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.requests = self.messages = self.rejected = 0
+
+    def send(self, batch):
+        """
+        Lambda trả 200 (tất cả đã lưu) hoặc 207 kèm "results" từng message: message lỗi tạm thời
+        được giữ lại trong batch["records"] và retry; message bị từ chối (invalid) thì bỏ.
+        """
+        self.breaker.acquire()
         try:
-            webhook_data = {
-                "topic": msg.topic,
-                "payload": cleaned_payload,
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "qos": msg.qos,
-                "retain": msg.retain
-            }
-            
-            headers = {
-                "x-api-key": AWS_API_KEY,
-                "Content-Type": "application/json"
-            }
-            
-            logger.info(f"🌐 Sending to Lambda: {AWS_WEBHOOK_URL}")
-            response = requests.post(
-                AWS_WEBHOOK_URL,
-                json=webhook_data,
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"✓ Data sent to Lambda successfully")
-                logger.info(f"  Response: {response.json().get('s3_key')}")
+            response = self.session.post(self.url, json=[webhook_message(r) for r in batch["records"]],
+                                         timeout=self.timeout)
+        except Exception:
+            self.breaker.record(False)
+            raise
+        status = response.status_code
+        with self._lock:
+            self.requests += 1
+        if status >= 500 or status in (408, 429):
+            self.breaker.record(False)
+            raise RuntimeError(f"Lambda request failed: {status} {response.text[:200]}")
+        # Lambda vẫn sống (kể cả khi từ chối dữ liệu): không tính vào breaker
+        self.breaker.record(True)
+        if status not in (200, 207):
+            raise PermanentError(f"Lambda rejected batch of {len(batch['records'])}: {status} {response.text[:200]}")
+
+        results = {r.get("message_id"): r for r in response.json().get("results", [])} if status == 207 else {}
+        retry, rejected = [], 0
+        for record in batch["records"]:
+            result = results.get(record['message_id'], {})
+            if result.get("status", "stored") == "stored":
+                continue
+            if result.get("retryable"):
+                retry.append(record)
             else:
-                logger.error(f"✗ Lambda request failed: {response.status_code}")
-                logger.error(f"  Response: {response.text}")
-                
-        except requests.RequestException as e:
-            logger.error(f"✗ Error sending to Lambda: {str(e)}")
-        
-        logger.info(f"{'='*80}\n")
-            
-    except json.JSONDecodeError as e:
-        logger.error(f"✗ JSON decode error: {e}")
-        logger.error(f"Raw payload: {msg.payload}")
-    except Exception as e:
-        logger.error(f"✗ Error: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+                rejected += 1
+                logger.error(f"✗ Lambda rejected {record['message_id']}: {result.get('error')}")
+        with self._lock:
+            self.messages += len(batch["records"]) - len(retry) - rejected
+            self.rejected += rejected
+        if retry:
+            batch["records"] = retry
+            raise RuntimeError(f"Lambda stored batch partially, {len(retry)} messages to retry")
+        logger.debug(f"✓ {len(batch['records'])} messages sent to Lambda")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "messages": self.messages,
+                "rejected": self.rejected,
+                "avg_batch": round(self.messages / self.requests, 2) if self.requests else 0.0,
+                "breaker": self.breaker.stats(),
+            }
+
+
+def webhook_message(data_to_store):
+    """Record -> message cho Lambda (format webhook cũ + message_id)."""
+    return {
+        "topic": data_to_store['topic'],
+        "payload": data_to_store['payload'],
+        "timestamp": data_to_store['mqtt_timestamp'],
+        "qos": data_to_store['qos'],
+        "retain": data_to_store['retain'],
+        # message_id ổn định qua replay: Lambda dùng làm key (message đơn) và reader bỏ trùng theo nó
+        "message_id": data_to_store['message_id']
+    }
+
+
+# =======================
+# METRICS
+# =======================
+def metrics_reporter(stop_event):
+    while not stop_event.wait(METRICS_INTERVAL):
+        logger.info(f"📊 pipeline {json.dumps(pipeline.stats())}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = json.dumps(pipeline.stats()).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# =======================
+# CALLBACKS
+# =======================
+def on_connect(client, userdata, flags, rc):
+    if rc == 0:
+        logger.info("✓ Connected to HiveMQ Cloud successfully")
+        client.subscribe(MQTT_TOPIC)
+        logger.info(f"✓ Subscribed to topic: {MQTT_TOPIC}")
+    else:
+        logger.error(f"✗ Connection failed with code {rc}")
+
+def on_message(client, userdata, msg):
+    # Chạy trong network thread của paho: chỉ append WAL (paho ack QoS 1 sau khi callback trả về),
+    # mọi I/O mạng nằm ở worker
+    pipeline.submit(msg.topic, msg.payload, msg.qos, msg.retain)
 
 def on_disconnect(client, userdata, rc):
     if rc != 0:
@@ -253,33 +1297,56 @@ def on_disconnect(client, userdata, rc):
 # MAIN
 # =======================
 def main():
+    global pipeline
+
     logger.info("=" * 80)
     logger.info("Gardenice IoT - MQTT Bridge (S3 STORAGE)")
     logger.info("=" * 80)
-    logger.info(f"MQTT Broker: {MQTT_BROKER}")
+    logger.info(f"MQTT Broker: {MQTT_BROKER}:{MQTT_PORT} (TLS {'on' if MQTT_TLS else 'off'})")
     logger.info(f"MQTT Topic: {MQTT_TOPIC}")
     logger.info(f"S3 Bucket: {S3_BUCKET}")
     logger.info(f"S3 Region: {S3_REGION}")
+    logger.info(f"Workers: s3={S3_WORKERS} webhook={WEBHOOK_WORKERS if WEBHOOK_ENABLED else 'off'}")
+    logger.info(f"S3 batches: flush {S3_FLUSH_INTERVAL}s / {S3_BATCH_MAX_RECORDS} records / {S3_BATCH_MAX_BYTES} bytes, gzip {'on' if S3_BATCH_GZIP else 'off'}")
+    logger.info(f"WAL: {WAL_DIR} (segment {WAL_SEGMENT_BYTES} bytes / {WAL_SEGMENT_SECONDS}s, max {WAL_MAX_BYTES} bytes)")
     logger.info(f"Log file: {LOG_FILE}")
     logger.info("=" * 80)
     logger.info("")
-    
-    # Create MQTT client
-    client = mqtt.Client(client_id="ec2-mqtt-bridge")
-    client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
-    client.tls_set()
-    
+
+    pipeline = Pipeline()
+    pipeline.start()
+    stop_event = threading.Event()
+    threading.Thread(target=metrics_reporter, args=(stop_event,), daemon=True).start()
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), MetricsHandler)
+        threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics: http://0.0.0.0:{METRICS_PORT}/metrics")
+
+    # Create MQTT client (paho-mqtt 2.x cần chọn callback API; giữ chữ ký callback v1)
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="ec2-mqtt-bridge")
+    else:
+        client = mqtt.Client(client_id="ec2-mqtt-bridge")
+    if MQTT_USER:
+        client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
+    if MQTT_TLS:
+        client.tls_set()
+
     # Set callbacks
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
-    
+
+    # systemd stop gửi SIGTERM: ngắt kết nối để loop_forever trả về, rồi drain pipeline
+    signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
+
     logger.info("Connecting to HiveMQ Cloud...")
     try:
         client.connect(MQTT_BROKER, MQTT_PORT, 60)
         logger.info("Starting MQTT loop...\n")
         client.loop_forever()
-        
+
     except KeyboardInterrupt:
         logger.info("Shutting down...")
         client.disconnect()
@@ -287,6 +1354,12 @@ def main():
         logger.error(f"Error: {e}")
         import traceback
         logger.error(traceback.format_exc())
+    finally:
+        pipeline.stop()
+        stop_event.set()
+        if metrics_server:
+            metrics_server.shutdown()
+        logger.info(f"📊 pipeline {json.dumps(pipeline.stats())}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Replay một luồng message đã ghi vào hivemq_processor.lambda_handler (chạy trong process) và đo messages/giây.
+
+Nguồn message (--input, nhiều file, .gz được):
+  - segment WAL của mqtt_bridge (~/mqtt-bridge/wal/*.wal)
+  - object raw_data (.json / batch .ndjson[.gz]) tải về từ bucket
+  - NDJSON các message webhook {topic, payload, timestamp, ...}
+hoặc --generate N để sinh luồng giả.
+
+Mỗi --modes chạy trên 1 bucket riêng:
+  single  1 invocation / message (đường cũ, 1 object / message)
+  array   body là mảng --batch-size message (mqtt_bridge WebhookClient)
+  sqs     event SQS với --batch-size record
+
+S3 mặc định là moto (không cần AWS); --bucket / --endpoint-url để chạy với MinIO / bucket test.
+
+    python replay_ingest.py --generate 5000 --modes single array sqs
+    python replay_ingest.py --input ~/mqtt-bridge/wal/*.wal --batch-size 200 --out replay_report.json
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+MODES = ('single', 'array', 'sqs')
+
+
+# =======================
+# INPUT
+# =======================
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+        text = f.read()
+    if path.endswith('.json'):
+        return [text]
+    return [line for line in text.splitlines() if line.strip()]
+
+
+def to_message(line, n):
+    """1 dòng (WAL / raw_data / webhook) -> message webhook; None nếu không đọc được."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if 'seq' in data and isinstance(data.get('payload'), str):
+        # WAL: payload là chuỗi MQTT gốc
+        try:
+            payload = json.loads(data['payload'])
+        except ValueError:
+            payload = data['payload']
+        return {
+            'topic': data.get('topic'),
+            'payload': payload,
+            'timestamp': datetime.fromtimestamp(data['ts'], tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'qos': data.get('qos', 0),
+            'retain': data.get('retain', False),
+            'message_id': f"replay-{data['seq']}",
+        }
+    return {
+        'topic': data.get('topic'),
+        'payload': data.get('payload'),
+        'timestamp': data.get('timestamp') or data.get('mqtt_timestamp'),
+        'qos': data.get('qos', 0),
+        'retain': data.get('retain', False),
+        'message_id': data.get('message_id') or f"replay-{n}",
+    }
+
+
+def load_stream(paths):
+    messages, skipped = [], 0
+    for path in paths:
+        for line in read_lines(path):
+            message = to_message(line, len(messages))
+            if message is None:
+                skipped += 1
+            else:
+                messages.append(message)
+    return messages, skipped
+
+
+def generate_stream(n, topics, devices, interval, seed=0):
+    """n message cách nhau interval giây, ~2% có giá trị ngoài khoảng để đi qua nhánh validate."""
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(seconds=n * interval)
+    messages = []
+    for i in range(n):
+        payload = {
+            'soil_moisture': round(rng.uniform(0, 100), 1),
+            'temperature': round(rng.uniform(15, 35), 1),
+            'humidity': round(rng.uniform(30, 90), 1),
+            'rain': rng.choice([0, 1]),
+            'device_id': f"esp32-{i % devices}",
+        }
+        if rng.random() < 0.02:
+            payload['soil_moisture'] = 150
+        messages.append({
+            'topic': topics[i % len(topics)],
+            'payload': payload,
+            'timestamp': (start + timedelta(seconds=i * interval)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'qos': 1,
+            'retain': False,
+            'message_id': f"gen-{i}",
+        })
+    return messages
+
+
+# =======================
+# REPLAY
+# =======================
+def events_for(mode, messages, batch_size):
+    if mode == 'single':
+        for m in messages:
+            yield 1, {'body': json.dumps(m)}
+        return
+    for i in range(0, len(messages), batch_size):
+        chunk = messages[i:i + batch_size]
+        if mode == 'array':
+            yield len(chunk), {'body': json.dumps(chunk)}
+        else:
+            yield len(chunk), {'Records': [{'messageId': f"sqs-{i + j}", 'body': json.dumps(m), 'eventSource': 'aws:sqs'}
+                                           for j, m in enumerate(chunk)]}
+
+
+def outcome(mode, response):
+    """(stored, failed) của 1 invocation."""
+    if mode == 'sqs':
+        return None, len(response.get('batchItemFailures', []))
+    body = json.loads(response['body'])
+    if mode == 'single':
+        return int(response['statusCode'] == 200), int(response['statusCode'] != 200)
+    return body.get('stored', 0), body.get('failed', 0)
+
+
+def replay(lam, mode, messages, batch_size):
+    puts = [0]
+    lam.s3_client.meta.events.register('before-call.s3.PutObject', lambda **kw: puts.__setitem__(0, puts[0] + 1))
+    latencies, stored, failed, invocations = [], 0, 0, 0
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for count, event in events_for(mode, messages, batch_size):
+            t0 = time.perf_counter()
+            response = lam.lambda_handler(event, None)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            s, f = outcome(mode, response)
+            stored += count - f if s is None else s
+            failed += f
+            invocations += 1
+    elapsed = time.perf_counter() - started
+    lat = np.array(latencies)
+    return {
+        'mode': mode,
+        'messages': len(messages),
+        'invocations': invocations,
+        'stored': stored,
+        'failed_or_rejected': failed,
+        's3_puts': puts[0],
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_sec': round(len(messages) / elapsed, 1) if elapsed else None,
+        'invocation_p50_ms': round(float(np.percentile(lat, 50)), 2) if len(lat) else None,
+        'invocation_p95_ms': round(float(np.percentile(lat, 95)), 2) if len(lat) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', nargs='+', help='WAL segment / raw_data / NDJSON message webhook')
+    parser.add_argument('--generate', type=int, default=0, help='sinh N message giả khi không có --input')
+    parser.add_argument('--topics', nargs='+', default=['esp32s3/sensors', 'esp32s3/soil'])
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=1.0, help='khoảng cách timestamp giữa các message (giây)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['single', 'array'])
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--bucket', help='bucket thật / MinIO (mặc định: moto, bucket riêng cho từng mode)')
+    parser.add_argument('--endpoint-url', default=os.environ.get('S3_ENDPOINT_URL'))
+    parser.add_argument('--out', help='ghi report JSON')
+    args = parser.parse_args()
+
+    if args.input:
+        messages, skipped = load_stream(args.input)
+        print(f"Loaded {len(messages)} messages ({skipped} unreadable lines skipped)")
+    elif args.generate:
+        messages = generate_stream(args.generate, args.topics, args.devices, args.interval)
+    else:
+        parser.error('--input or --generate is required')
+
+    mock = None
+    if not args.bucket:
+        from moto import mock_aws
+
+        for key in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+            os.environ.setdefault(key, 'replay')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        mock = mock_aws()
+        mock.start()
+    os.environ['PLANT_DATA_BUCKET'] = args.bucket or 'replay-ingest'
+    sys.path.insert(0, BACKEND_DIR)
+    import boto3
+
+    import hivemq_processor as lam
+
+    lam.s3_client = boto3.client('s3', endpoint_url=args.endpoint_url)
+    results = []
+    try:
+        for mode in args.modes:
+            if not args.bucket:
+                lam.PLANT_DATA_BUCKET = f"replay-{mode}"
+                lam.s3_client.create_bucket(Bucket=lam.PLANT_DATA_BUCKET)
+            r = replay(lam, mode, messages, args.batch_size)
+            results.append(r)
+            print(f"{mode:<8}{r['messages']:>8} msgs {r['invocations']:>7} invocations {r['s3_puts']:>7} PUTs  "
+                  f"{r['messages_per_sec']:>9} msg/s  p50 {r['invocation_p50_ms']} ms  p95 {r['invocation_p95_ms']} ms  "
+                  f"stored {r['stored']}  failed/rejected {r['failed_or_rejected']}")
+    finally:
+        if mock:
+            mock.stop()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'batch_size': args.batch_size, 'results': results}, f, indent=2)
+        print(f"report -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -66,6 +66,8 @@ module "lambda" {
   memory_size             = 128
   source_file             = "${path.module}/../backend/get_plant_data.py"
   plant_data_bucket_arn   = module.s3.plant_data_bucket_arn
+  # Backfill pointer latest/ lần đầu fallback list tìm thấy dữ liệu
+  writable_prefixes       = ["${var.data_path_prefix}latest/"]
   log_retention_days      = 7
 
   environment_variables = {
@@ -79,6 +81,31 @@ module "lambda" {
   tags = local.common_tags
 }
 
+# ============================================
+# Module: Lambda Function (History API)
+# ============================================
+module "lambda_history" {
+  source = "./modules/lambda"
+
+  function_name           = "${var.project_name}-get-plant-history"
+  handler                 = "get_plant_history.lambda_handler"
+  runtime                 = "python3.11"
+  timeout                 = 30
+  memory_size             = 512
+  source_file             = "${path.module}/../backend/get_plant_history.py"
+  plant_data_bucket_arn   = module.s3.plant_data_bucket_arn
+  layers                  = var.numpy_layer_arns
+  log_retention_days      = 7
+
+  environment_variables = {
+    PLANT_DATA_BUCKET = module.s3.plant_data_bucket_id
+    DATA_PATH_PREFIX  = var.data_path_prefix
+    MQTT_TOPIC        = "esp32s3/sensors"  # MQTT topic for sensor data
+  }
+
+  tags = local.common_tags
+}
+
 # ============================================
 # Module: API Gateway (Frontend API)
 # ============================================
@@ -90,6 +117,8 @@ module "api_gateway" {
   stage_name           = var.environment
   lambda_invoke_arn    = module.lambda.invoke_arn
   lambda_function_name = module.lambda.function_name
+  history_lambda_invoke_arn    = module.lambda_history.invoke_arn
+  history_lambda_function_name = module.lambda_history.function_name
 
   tags = local.common_tags
 }
@@ -106,10 +135,13 @@ module "mqtt_bridge" {
   lambda_handler          = "hivemq_processor.lambda_handler"
   lambda_runtime          = "python3.11"
   lambda_timeout          = 30
-  lambda_memory_size      = 128
+  lambda_memory_size      = 256
+  layers                  = var.numpy_layer_arns
   source_file             = "${path.module}/../backend/hivemq_processor.py"
   plant_data_bucket_name  = module.s3.plant_data_bucket_id
   plant_data_bucket_arn   = module.s3.plant_data_bucket_arn
+  plant_id                = var.plant_id
+  data_path_prefix        = var.data_path_prefix
   log_retention_days      = 7
   api_key_name            = "hivemq-webhook-key"
   rate_limit              = 1000
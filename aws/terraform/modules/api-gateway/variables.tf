@@ -25,6 +25,16 @@ variable "lambda_function_name" {
   type        = string
 }
 
+variable "history_lambda_invoke_arn" {
+  description = "History Lambda function invoke ARN"
+  type        = string
+}
+
+variable "history_lambda_function_name" {
+  description = "History Lambda function name"
+  type        = string
+}
+
 variable "tags" {
   description = "Common tags for all resources"
   type        = map(string)
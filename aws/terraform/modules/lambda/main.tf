@@ -29,7 +29,7 @@ resource "aws_iam_role_policy" "lambda_s3_access" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Effect = "Allow"
         Action = [
@@ -41,7 +41,13 @@ resource "aws_iam_role_policy" "lambda_s3_access" {
           "${var.plant_data_bucket_arn}/*"
         ]
       }
-    ]
+      ], length(var.writable_prefixes) == 0 ? [] : [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:PutObject"]
+        Resource = [for prefix in var.writable_prefixes : "${var.plant_data_bucket_arn}/${prefix}*"]
+      }
+    ])
   })
 }
 
@@ -83,6 +89,7 @@ resource "aws_lambda_function" "function" {
   runtime         = var.runtime
   timeout         = var.timeout
   memory_size     = var.memory_size
+  layers          = var.layers
 
   environment {
     variables = var.environment_variables
@@ -32,6 +32,12 @@ variable "source_file" {
   type        = string
 }
 
+variable "layers" {
+  description = "Lambda layer ARNs (vd. layer có numpy cho get_plant_history)"
+  type        = list(string)
+  default     = []
+}
+
 variable "environment_variables" {
   description = "Environment variables for Lambda"
   type        = map(string)
@@ -43,6 +49,12 @@ variable "plant_data_bucket_arn" {
   type        = string
 }
 
+variable "writable_prefixes" {
+  description = "Prefix trong plant data bucket mà Lambda được PutObject (vd. latest/ để backfill pointer); rỗng = chỉ đọc"
+  type        = list(string)
+  default     = []
+}
+
 variable "log_retention_days" {
   description = "CloudWatch log retention in days"
   type        = number
@@ -36,7 +36,18 @@ resource "aws_iam_role_policy" "s3_write_access" {
           "s3:PutObject",
           "s3:PutObjectAcl"
         ]
-        Resource = "${var.plant_data_bucket_arn}/raw_data/*"
+        Resource = [
+          "${var.plant_data_bucket_arn}/raw_data/*",
+          "${var.plant_data_bucket_arn}/${var.data_path_prefix}latest/*"
+        ]
+      },
+      {
+        # Đọc pointer hiện có để chỉ ghi khi record mới hơn (update_latest_pointer)
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject"
+        ]
+        Resource = "${var.plant_data_bucket_arn}/${var.data_path_prefix}latest/*"
       },
       {
         Effect = "Allow"
@@ -87,16 +98,52 @@ resource "aws_lambda_function" "hivemq_processor" {
   runtime         = var.lambda_runtime
   timeout         = var.lambda_timeout
   memory_size     = var.lambda_memory_size
+  layers          = var.layers
 
   environment {
     variables = {
       PLANT_DATA_BUCKET = var.plant_data_bucket_name
+      PLANT_ID          = var.plant_id
+      DATA_PATH_PREFIX  = var.data_path_prefix
     }
   }
 
   tags = var.tags
 }
 
+# SQS -> Lambda (tùy chọn): batch message, chỉ message lỗi được giao lại (batchItemFailures)
+resource "aws_iam_role_policy" "sqs_consume" {
+  count = var.sqs_queue_arn == "" ? 0 : 1
+  name  = "sqs-consume"
+  role  = aws_iam_role.hivemq_processor.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
+        ]
+        Resource = var.sqs_queue_arn
+      }
+    ]
+  })
+}
+
+resource "aws_lambda_event_source_mapping" "sqs" {
+  count                              = var.sqs_queue_arn == "" ? 0 : 1
+  event_source_arn                   = var.sqs_queue_arn
+  function_name                      = aws_lambda_function.hivemq_processor.arn
+  batch_size                         = var.sqs_batch_size
+  maximum_batching_window_in_seconds = var.sqs_batching_window_seconds
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  depends_on = [aws_iam_role_policy.sqs_consume]
+}
+
 # CloudWatch Log Group
 resource "aws_cloudwatch_log_group" "hivemq_processor" {
   name              = "/aws/lambda/${aws_lambda_function.hivemq_processor.function_name}"
@@ -53,6 +53,42 @@ variable "plant_data_bucket_arn" {
   type        = string
 }
 
+variable "plant_id" {
+  description = "Plant ID dùng cho pointer latest/<plant_id>/..."
+  type        = string
+  default     = "plant_001"
+}
+
+variable "data_path_prefix" {
+  description = "Prefix của pointer <prefix>latest/..., phải khớp DATA_PATH_PREFIX của get_plant_data"
+  type        = string
+  default     = ""
+}
+
+variable "layers" {
+  description = "Lambda layer ARNs (numpy cho validate / gom batch trong hivemq_processor)"
+  type        = list(string)
+  default     = []
+}
+
+variable "sqs_queue_arn" {
+  description = "SQS queue ARN làm nguồn batch cho hivemq_processor (rỗng = không tạo trigger)"
+  type        = string
+  default     = ""
+}
+
+variable "sqs_batch_size" {
+  description = "Số message SQS tối đa mỗi invocation"
+  type        = number
+  default     = 100
+}
+
+variable "sqs_batching_window_seconds" {
+  description = "Thời gian tối đa SQS gom batch trước khi gọi Lambda"
+  type        = number
+  default     = 5
+}
+
 variable "log_retention_days" {
   description = "CloudWatch log retention in days"
   type        = number
@@ -44,3 +44,13 @@ variable "data_path_prefix" {
   type        = string
   default     = ""
 }
+
+variable "numpy_layer_arns" {
+  description = "Layer ARNs cung cấp numpy cho Lambda get_plant_history và hivemq_processor (vd. AWS SDK for pandas layer của region); bắt buộc vì get_plant_history import numpy"
+  type        = list(string)
+
+  validation {
+    condition     = length(var.numpy_layer_arns) > 0
+    error_message = "numpy_layer_arns must contain at least one layer that provides numpy (get_plant_history imports it at load time)."
+  }
+}
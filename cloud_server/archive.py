@@ -0,0 +1,37 @@
+import io
+import os
+
+from PIL import Image
+
+# ARCHIVE_MODE:
+#   original  - upload nguyên bytes ESP32 gửi lên (không decode/encode lại)
+#   thumbnail - downscale về ARCHIVE_MAX_SIDE rồi encode JPEG
+ARCHIVE_MODE = os.environ.get("ARCHIVE_MODE", "original")
+ARCHIVE_MAX_SIDE = int(os.environ.get("ARCHIVE_MAX_SIDE", "640"))
+ARCHIVE_JPEG_QUALITY = int(os.environ.get("ARCHIVE_JPEG_QUALITY", "85"))
+
+# magic bytes -> (content type, extension)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ("image/jpeg", "jpg")),
+    (b"\x89PNG\r\n\x1a\n", ("image/png", "png")),
+)
+
+
+def sniff_image_type(data):
+    """Trả về (content_type, ext) theo magic bytes, hoặc None nếu không phải ảnh hỗ trợ."""
+    for magic, info in _SIGNATURES:
+        if data[:len(magic)] == magic:
+            return info
+    return None
+
+
+def make_thumbnail(image_data, max_side=ARCHIVE_MAX_SIDE, quality=ARCHIVE_JPEG_QUALITY):
+    """Downscale (giữ tỉ lệ) và encode JPEG; dùng cho ARCHIVE_MODE=thumbnail."""
+    img = Image.open(io.BytesIO(image_data))
+    # thumbnail() tự dùng draft mode cho JPEG nên không decode full-resolution
+    img.thumbnail((max_side, max_side), reducing_gap=2.0)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
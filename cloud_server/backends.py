@@ -0,0 +1,57 @@
+import os
+
+import torch
+
+from model import Model2Class
+
+# Backend phục vụ inference:
+#   eager       - Model2Class + state_dict (model.pth)
+#   torchscript - artifact torch.jit (export.py --format torchscript)
+#   int8        - artifact TorchScript đã quantize (export.py --format int8_dynamic/int8_static)
+#   onnx        - ONNX Runtime (export.py --format onnx)
+BACKENDS = ("eager", "torchscript", "int8", "onnx")
+
+
+class OnnxRuntimeModel:
+    """Bọc onnxruntime.InferenceSession để dùng giống nn.Module: tensor in, tensor out."""
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        output = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0]
+        return torch.from_numpy(output)
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def load_model(backend="eager", path="model.pth", model_name="resnet18", device="cpu", mmap=False):
+    """Load model cho serving theo backend; kết quả luôn gọi được với batch (N, 3, H, W)."""
+    if backend == "eager":
+        # Không tải pretrained weights vì sẽ bị checkpoint ghi đè ngay
+        model = Model2Class(model_name, pretrained=False)
+        # mmap: đọc tensor trực tiếp từ file, assign=True để không copy thêm lần nữa
+        state_dict = torch.load(path, map_location=device, mmap=mmap, weights_only=True)
+        model.load_state_dict(state_dict, assign=mmap)
+        model.to(device)
+    elif backend in ("torchscript", "int8"):
+        if backend == "int8" and torch.device(device).type != "cpu":
+            raise ValueError("INT8 quantized models only run on CPU")
+        model = torch.jit.load(path, map_location=device)
+    elif backend == "onnx":
+        model = OnnxRuntimeModel(path, num_threads=int(os.environ.get("ORT_NUM_THREADS", "0")) or None)
+    else:
+        raise ValueError(f"Backend {backend} not supported! Choose one of {BACKENDS}")
+    model.eval()
+    return model
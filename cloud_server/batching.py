@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+import torch
+
+from metrics import BATCH_SIZE, ERRORS, STAGE_SECONDS
+from runtime import Overloaded
+
+# Latency/throughput knob:
+#   BATCH_MAX_SIZE  - số ảnh tối đa trong một forward pass
+#   BATCH_MAX_WAIT_MS - thời gian tối đa chờ gom thêm request (0 = không chờ)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+
+
+class BatchScheduler:
+    """
+    Gom các request đồng thời thành một batch cho Model2Class.
+
+    Mỗi caller gọi `await submit(tensor)` với tensor (C, H, W) và nhận lại
+    vector softmax (num_classes,) của riêng mình.
+    """
+
+    def __init__(self, model, device, max_batch_size=BATCH_MAX_SIZE,
+                 max_wait_ms=BATCH_MAX_WAIT_MS, pool=None, max_queue=0, name="default"):
+        self.name = name
+        self.model = model
+        self.device = device
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        # runtime.BoundedPool chạy forward pass (None = executor mặc định của event loop)
+        self.pool = pool
+        # 0 = không giới hạn; >0 thì submit() raise Overloaded khi queue đầy
+        self.max_queue = max_queue
+        self.rejected = 0
+        # Số ảnh đang chạy qua run_batch (ngoài queue), tính chung vào max_queue
+        self._direct = 0
+
+        self._queue = None
+        self._worker = None
+
+        # Metrics theo batch size
+        self.batch_count = defaultdict(int)
+        self.batch_latency = defaultdict(float)
+
+    async def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _check_running(self):
+        # Scheduler đã stop (model bị retire) không tự khởi động lại, tránh rò worker task
+        if self._worker is None:
+            raise RuntimeError(f"batch scheduler {self.name} is not running")
+
+    def _depth(self):
+        return (self._queue.qsize() if self._queue is not None else 0) + self._direct
+
+    async def submit(self, tensor):
+        self._check_running()
+        if self.max_queue and self._depth() >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"batch queue full ({self.max_queue})")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tensor, future))
+        return await future
+
+    async def run_batch(self, tensors):
+        """
+        Chạy list tensor theo chunk max_batch_size, không qua queue gom batch.
+
+        Số ảnh đang chạy ở đây được tính chung với queue vào max_queue, nên một
+        request lớn cũng bị Overloaded (503) như submit() khi server quá tải.
+        """
+        self._check_running()
+        if self.max_queue and self._depth() + len(tensors) > self.max_queue:
+            self.rejected += 1
+            raise Overloaded(f"batch queue full ({self._depth()}+{len(tensors)}/{self.max_queue})")
+        self._direct += len(tensors)
+        try:
+            chunks = []
+            for start in range(0, len(tensors), self.max_batch_size):
+                chunk = tensors[start:start + self.max_batch_size]
+                started = time.perf_counter()
+                try:
+                    chunks.append(await self._run_forward(chunk))
+                except Exception:
+                    ERRORS.inc(stage="forward", model=self.name)
+                    raise
+                self._record(len(chunk), time.perf_counter() - started)
+        finally:
+            self._direct -= len(tensors)
+        return torch.cat(chunks)
+
+    def _record(self, size, elapsed):
+        self.batch_count[size] += 1
+        self.batch_latency[size] += elapsed
+        STAGE_SECONDS.observe(elapsed, stage="forward", model=self.name)
+        BATCH_SIZE.observe(size, model=self.name)
+
+    async def _collect(self):
+        """Chờ request đầu tiên, sau đó gom thêm tới max_batch_size hoặc hết max_wait."""
+        items = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Vẫn lấy những gì đã nằm sẵn trong queue, không chờ thêm
+                while len(items) < self.max_batch_size and not self._queue.empty():
+                    items.append(self._queue.get_nowait())
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _forward(self, tensors):
+        batch = torch.stack(tensors).to(self.device)
+        with torch.inference_mode():
+            output = self.model(batch)
+            probs = torch.softmax(output, dim=1)
+        return probs.cpu()
+
+    async def _run_forward(self, tensors):
+        if self.pool is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self._forward, tensors)
+        return await self.pool.run(self._forward, tensors)
+
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            tensors = [t for t, _ in items]
+            started = time.perf_counter()
+            try:
+                probs = await self._run_forward(tensors)
+            except Exception as e:
+                ERRORS.inc(stage="forward", model=self.name)
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._record(len(items), time.perf_counter() - started)
+
+            for i, (_, future) in enumerate(items):
+                if not future.done():
+                    future.set_result(probs[i])
+
+    def stats(self):
+        per_size = {}
+        for size, count in sorted(self.batch_count.items()):
+            per_size[size] = {
+                "batches": count,
+                "avg_latency_ms": round(self.batch_latency[size] / count * 1000, 3),
+            }
+        total_batches = sum(self.batch_count.values())
+        total_images = sum(size * count for size, count in self.batch_count.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._depth(),
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "total_batches": total_batches,
+            "total_images": total_images,
+            "avg_batch_size": round(total_images / total_batches, 3) if total_batches else 0,
+            "per_batch_size": per_size,
+        }
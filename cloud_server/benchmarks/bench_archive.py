@@ -0,0 +1,66 @@
+"""
+So sánh chi phí CPU mỗi request khi archive ảnh:
+  - reencode: PIL decode -> convert RGB -> save JPEG (cách cũ)
+  - thumbnail: decode -> downscale -> save JPEG (ARCHIVE_MODE=thumbnail)
+  - original: upload nguyên bytes (ARCHIVE_MODE=original, chỉ sniff magic bytes)
+
+Chạy từ thư mục cloud_server:
+    python -m benchmarks.bench_archive --images ../device_server/uploads
+"""
+import argparse
+import io
+import os
+import time
+
+from PIL import Image
+
+from archive import sniff_image_type, make_thumbnail
+
+
+def reencode(data):
+    pil_image = Image.open(io.BytesIO(data)).convert("RGB")
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def thumbnail(data):
+    return make_thumbnail(data)
+
+
+def original(data):
+    sniff_image_type(data)
+    return data
+
+
+def bench(fn, blobs, repeat):
+    started = time.process_time()
+    for _ in range(repeat):
+        for data in blobs:
+            fn(data)
+    return (time.process_time() - started) / (repeat * len(blobs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default="../device_server/uploads")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    blobs = []
+    for name in sorted(os.listdir(args.images)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(args.images, name), "rb") as f:
+                blobs.append(f.read())
+    if not blobs:
+        raise SystemExit(f"No images in {args.images}")
+
+    print(f"{len(blobs)} images, avg {sum(map(len, blobs)) / len(blobs) / 1024:.1f} KiB")
+    baseline = bench(reencode, blobs, args.repeat)
+    for name, fn in (("reencode", reencode), ("thumbnail", thumbnail), ("original", original)):
+        cpu = baseline if fn is reencode else bench(fn, blobs, args.repeat)
+        print(f"{name:<10} {cpu * 1000:8.3f} ms CPU/request   saved {(baseline - cpu) * 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
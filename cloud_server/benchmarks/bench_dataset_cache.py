@@ -0,0 +1,77 @@
+"""
+So sánh thời gian một epoch đọc dữ liệu của CustomDataset có/không có ImageCache.
+
+Chỉ đo phần data loading (decode + augmentation + collate), không forward model,
+để thấy rõ phần decode bị loại bỏ. Epoch đầu của bản cache gồm cả thời gian build.
+
+Chạy từ thư mục cloud_server:
+    python -m benchmarks.bench_dataset_cache --data-root dataset --workers 4 --epochs 3
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+from custom_dataset import CustomDataset
+from tensor_cache import ImageCache
+from utils import load_dataset, transform
+
+# Augmentation on-the-fly giống lúc train, chạy trên ảnh đã cache
+train_transform = transforms.Compose([
+    transforms.RandomHorizontalFlip(),
+    transforms.RandomRotation(10),
+    transform,
+])
+
+
+def run_epochs(dataset, epochs, batch_size, workers):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers,
+                        persistent_workers=workers > 0)
+    times = []
+    for _ in range(epochs):
+        started = time.perf_counter()
+        for _images, _labels in loader:
+            pass
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-root", required=True)
+    parser.add_argument("--eval-per-class", type=int, default=100)
+    parser.add_argument("--cache-dir", default=None, help="mặc định: thư mục tạm, xóa sau khi chạy")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    train_paths, train_labels, _, _ = load_dataset(args.data_root, eval_per_class=args.eval_per_class)
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="img_cache_")
+    try:
+        uncached = run_epochs(CustomDataset(train_paths, train_labels, train_transform),
+                              args.epochs, args.batch_size, args.workers)
+
+        started = time.perf_counter()
+        cache = ImageCache.build_or_load(train_paths, cache_dir, "train")
+        build = time.perf_counter() - started
+        cached = run_epochs(CustomDataset(train_paths, train_labels, train_transform, cache=cache),
+                            args.epochs, args.batch_size, args.workers)
+    finally:
+        if args.cache_dir is None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    n = len(train_paths)
+    print(f"{n} train images, {args.workers} workers, batch {args.batch_size}")
+    print(f"cache build: {build:.2f}s")
+    for epoch, (u, c) in enumerate(zip(uncached, cached), 1):
+        print(f"epoch {epoch}: uncached {u:.2f}s ({n / u:.0f} img/s)   cached {c:.2f}s ({n / c:.0f} img/s)"
+              f"   speedup x{u / c:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+So sánh preprocess.preprocess (draft decode + LUT normalize) với utils.transform.
+
+  - Kiểm tra sai lệch so với transform cũ (max/mean abs diff, phải < --tolerance)
+  - Đo throughput images/sec trên CPU, cả đơn lẻ và preprocess_batch
+
+Chạy từ thư mục cloud_server:
+    python -m benchmarks.bench_preprocess --images ../device_server/uploads
+"""
+import argparse
+import io
+import os
+import time
+
+import torch
+from PIL import Image
+
+from preprocess import preprocess, preprocess_batch
+from utils import transform
+
+
+def baseline(data):
+    return transform(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def images_per_sec(fn, blobs, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(blobs)
+    return repeat * len(blobs) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", default="../device_server/uploads")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="max mean abs diff (đơn vị sau normalize) cho phép")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    blobs = []
+    for name in sorted(os.listdir(args.images)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(args.images, name), "rb") as f:
+                blobs.append(f.read())
+    if not blobs:
+        raise SystemExit(f"No images in {args.images}")
+
+    # Correctness: draft decode + resize khác một chút so với full decode,
+    # nên so sánh theo mean abs diff, max abs diff chỉ để tham khảo
+    worst = 0.0
+    for data in blobs:
+        ref = baseline(data)
+        fast = preprocess(data)
+        assert fast.shape == ref.shape and fast.dtype == ref.dtype
+        diff = (fast - ref).abs()
+        worst = max(worst, diff.mean().item())
+        print(f"mean abs diff {diff.mean().item():.4f}  max abs diff {diff.max().item():.4f}")
+    batch = preprocess_batch(blobs)
+    assert torch.allclose(batch, torch.stack([preprocess(d) for d in blobs]))
+    status = "OK" if worst <= args.tolerance else "FAIL"
+    print(f"parity {status}: worst mean abs diff {worst:.4f} (tolerance {args.tolerance})")
+
+    print(f"transform        {images_per_sec(lambda b: [baseline(d) for d in b], blobs, args.repeat):8.1f} img/s")
+    print(f"preprocess       {images_per_sec(lambda b: [preprocess(d) for d in b], blobs, args.repeat):8.1f} img/s")
+    print(f"preprocess_batch {images_per_sec(preprocess_batch, blobs, args.repeat):8.1f} img/s")
+    if status != "OK":
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Benchmark tổng hợp, ghi kết quả ra JSON để so sánh giữa các lần chạy / máy.
+
+  - models:     p50/p95/p99 latency + img/s cho từng backbone × số thread × batch size,
+                kích thước weights, peak RSS; accuracy nếu có --data-root và checkpoint
+  - preprocess: utils.transform vs preprocess.preprocess (ms/ảnh)
+  - e2e:        POST /inference qua inference.app (TestClient), S3 giả lập bằng moto
+
+Chạy từ thư mục cloud_server:
+    python -m benchmarks.bench_suite --out bench_report.json
+    python -m benchmarks.bench_suite --models resnet18 mobilenet_v3_small --threads 1 4 \\
+        --data-root dataset --checkpoint-dir checkpoints --sections models e2e
+
+So sánh hai report:
+    python -m benchmarks.bench_suite --compare old.json new.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from export import build_eager, evaluate, measure_latency
+from model import model_dict
+
+SECTIONS = ("models", "preprocess", "e2e")
+REPORT_VERSION = 1
+
+
+def percentiles(times_ms):
+    times_ms = np.asarray(times_ms)
+    return {
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "mean_ms": float(times_ms.mean()),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss: KB trên Linux, bytes trên macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+    }
+
+
+def load_images(folder):
+    blobs = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(folder, name), "rb") as f:
+                blobs.append(f.read())
+    if not blobs:
+        raise SystemExit(f"No images in {folder}")
+    return blobs
+
+
+def eval_loader(data_root, eval_per_class):
+    from torch.utils.data import DataLoader
+
+    from custom_dataset import CustomDataset
+    from utils import load_dataset, transform
+
+    _, _, eval_paths, eval_labels = load_dataset(data_root, eval_per_class=eval_per_class)
+    return DataLoader(CustomDataset(eval_paths, eval_labels, transform), batch_size=32, num_workers=2)
+
+
+def bench_models(args):
+    results = []
+    loader = eval_loader(args.data_root, args.eval_per_class) if args.data_root else None
+    default_threads = torch.get_num_threads()
+    for name in args.models:
+        checkpoint = os.path.join(args.checkpoint_dir, f"{name}.pth") if args.checkpoint_dir else None
+        if checkpoint and not os.path.exists(checkpoint):
+            checkpoint = None
+        model = build_eager(name, checkpoint)
+        entry = {
+            "model": name,
+            "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+            "weights_mb": sum(t.numel() * t.element_size()
+                              for t in list(model.parameters()) + list(model.buffers())) / 2**20,
+            "checkpoint": checkpoint,
+            "accuracy": None,
+            "latency": [],
+        }
+        if loader is not None and checkpoint:
+            entry["accuracy"], _ = evaluate(model, loader)
+        for threads in args.threads:
+            torch.set_num_threads(threads)
+            for bs in args.batch_sizes:
+                torch.manual_seed(0)
+                r = measure_latency(model, bs, args.iters, args.warmup)
+                r.update(threads=threads, batch_size=bs)
+                entry["latency"].append(r)
+                print(f"{name:<22}threads {threads:<3}batch {bs:<4}p50 {r['p50_ms']:8.2f}  "
+                      f"p95 {r['p95_ms']:8.2f}  p99 {r['p99_ms']:8.2f} ms  {r['images_per_sec']:8.1f} img/s")
+        entry["peak_rss_mb"] = peak_rss_mb()
+        results.append(entry)
+        del model
+    torch.set_num_threads(default_threads)
+    return results
+
+
+def bench_preprocess(args, blobs):
+    from preprocess import preprocess
+    from utils import transform
+
+    def baseline(data):
+        return transform(Image.open(io.BytesIO(data)).convert("RGB"))
+
+    results = {}
+    for label, fn in (("transform", baseline), ("preprocess", preprocess)):
+        for data in blobs[:2]:
+            fn(data)
+        times = []
+        for _ in range(args.repeat):
+            for data in blobs:
+                started = time.perf_counter()
+                fn(data)
+                times.append((time.perf_counter() - started) * 1000)
+        results[label] = percentiles(times)
+        results[label]["images_per_sec"] = 1000 / results[label]["mean_ms"]
+        print(f"{label:<12}p50 {results[label]['p50_ms']:6.2f}  p95 {results[label]['p95_ms']:6.2f}  "
+              f"p99 {results[label]['p99_ms']:6.2f} ms/img")
+    return results
+
+
+def bench_e2e(args, blobs):
+    """Chạy inference.app trong process, S3 là moto; result cache tắt để mỗi request đều forward."""
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("e2e: moto not installed, skipping")
+        return None
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    checkpoint = os.path.join(workdir, "model.pth")
+    torch.save(build_eager(args.e2e_model).state_dict(), checkpoint)
+    env = {
+        "MODEL_NAME": args.e2e_model,
+        "MODEL_PATH": checkpoint,
+        "RESULT_CACHE_ENABLED": "0",
+        "S3_SPILL_DIR": os.path.join(workdir, "spill"),
+        "LOG_SAMPLE_RATE": "0",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    results = {}
+    try:
+        with mock_aws():
+            import boto3
+
+            boto3.client("s3").create_bucket(Bucket="iot-gardernice")
+            import inference
+            from fastapi.testclient import TestClient
+
+            with TestClient(inference.app) as client:
+                deadline = time.monotonic() + 120
+                while client.get("/health").status_code != 200:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"server not ready: {client.get('/health').json()}")
+                    time.sleep(0.1)
+
+                for concurrency in args.concurrency:
+                    times, errors = [], 0
+                    lock = threading.Lock()
+
+                    def worker(n):
+                        nonlocal errors
+                        for i in range(n):
+                            started = time.perf_counter()
+                            r = client.post("/inference", content=blobs[i % len(blobs)])
+                            elapsed = (time.perf_counter() - started) * 1000
+                            with lock:
+                                times.append(elapsed)
+                                errors += r.status_code != 200
+
+                    for i in range(2):
+                        client.post("/inference", content=blobs[i % len(blobs)])
+                    per_worker = max(1, args.e2e_requests // concurrency)
+                    started = time.perf_counter()
+                    threads = [threading.Thread(target=worker, args=(per_worker,)) for _ in range(concurrency)]
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                    wall = time.perf_counter() - started
+                    r = percentiles(times)
+                    r.update(requests=len(times), errors=errors, requests_per_sec=len(times) / wall)
+                    results[f"concurrency_{concurrency}"] = r
+                    print(f"e2e concurrency {concurrency:<3}p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  "
+                          f"p99 {r['p99_ms']:8.2f} ms  {r['requests_per_sec']:7.1f} req/s  errors {errors}")
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(old_path, new_path, threshold):
+    """In các cấu hình p95 tệ hơn threshold (tỉ lệ); exit 1 nếu có regression."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def flatten(report):
+        out = {}
+        for m in report.get("models") or []:
+            for r in m["latency"]:
+                out[f"models/{m['model']}/t{r['threads']}/b{r['batch_size']}"] = r["p95_ms"]
+        for k, r in (report.get("preprocess") or {}).items():
+            out[f"preprocess/{k}"] = r["p95_ms"]
+        for k, r in (report.get("e2e") or {}).items():
+            out[f"e2e/{k}"] = r["p95_ms"]
+        return out
+
+    before, after = flatten(old), flatten(new)
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / max(before[key], 1e-9)
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        regressions += bool(flag)
+        print(f"{key:<50}{before[key]:10.2f}{after[key]:10.2f} ms  x{ratio:5.2f} {flag}")
+    if regressions:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_report.json")
+    parser.add_argument("--sections", nargs="+", default=list(SECTIONS), choices=SECTIONS)
+    parser.add_argument("--models", nargs="+", default=list(model_dict), choices=list(model_dict))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iters", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--data-root", help="dataset để đo accuracy (eval split)")
+    parser.add_argument("--eval-per-class", type=int, default=100)
+    parser.add_argument("--checkpoint-dir", help="chứa <model>.pth cho từng backbone")
+    parser.add_argument("--images", default="../device_server/uploads")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--e2e-model", default="resnet18", choices=list(model_dict))
+    parser.add_argument("--e2e-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.10, help="regression nếu p95 tăng quá tỉ lệ này")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, args.threshold)
+        return
+
+    torch.manual_seed(0)
+    report = {"version": REPORT_VERSION, "environment": environment(), "config": vars(args)}
+    blobs = load_images(args.images) if {"preprocess", "e2e"} & set(args.sections) else None
+    if "models" in args.sections:
+        report["models"] = bench_models(args)
+    if "preprocess" in args.sections:
+        report["preprocess"] = bench_preprocess(args, blobs)
+    if "e2e" in args.sections:
+        report["e2e"] = bench_e2e(args, blobs)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
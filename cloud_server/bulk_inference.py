@@ -0,0 +1,194 @@
+"""
+Chấm điểm hàng loạt ảnh từ thư mục local hoặc S3 prefix.
+
+Ảnh được stream qua DataLoader (decode song song bằng worker), forward theo batch
+trong torch.inference_mode(), kết quả ghi dần ra CSV hoặc Parquet.
+
+Ví dụ (chạy trong thư mục cloud_server):
+    python bulk_inference.py image --out predictions.csv
+    python bulk_inference.py s3://iot-gardernice/images/ --out season.parquet \\
+        --checkpoint model.pth --workers 8 --batch-size 64
+"""
+import argparse
+import csv
+import os
+import time
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from backends import BACKENDS, load_model
+from model import model_dict
+from preprocess import preprocess
+
+ID2LABEL = {0: "bacterial", 1: "fungal", 2: "healthy"}
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+COLUMNS = ["path", "result", "confidence"] + [f"prob_{label}" for label in ID2LABEL.values()]
+
+
+def parse_s3_uri(uri):
+    bucket, _, prefix = uri[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_images(source):
+    """Liệt kê ảnh trong thư mục (đệ quy) hoặc S3 prefix (phân trang, không giới hạn 1000 key)."""
+    if source.startswith("s3://"):
+        import boto3
+
+        bucket, prefix = parse_s3_uri(source)
+        paginator = boto3.client("s3").get_paginator("list_objects_v2")
+        keys = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].lower().endswith(IMAGE_EXTS):
+                    keys.append(f"s3://{bucket}/{obj['Key']}")
+        return sorted(keys)
+
+    paths = []
+    for root, _, files in os.walk(source):
+        for f in files:
+            if f.lower().endswith(IMAGE_EXTS):
+                paths.append(os.path.join(root, f))
+    return sorted(paths)
+
+
+class ImageSource(Dataset):
+    """Đọc bytes (local/S3) và preprocess trong worker; ảnh lỗi trả về None và bị bỏ qua."""
+
+    def __init__(self, items):
+        self.items = items
+        self._s3 = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def _read(self, item):
+        if item.startswith("s3://"):
+            if self._s3 is None:
+                # Mỗi worker process tạo client riêng (boto3 client không pickle được)
+                import boto3
+                self._s3 = boto3.client("s3")
+            bucket, key = parse_s3_uri(item)
+            return self._s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        with open(item, "rb") as f:
+            return f.read()
+
+    def __getitem__(self, idx):
+        item = self.items[idx]
+        try:
+            return item, preprocess(self._read(item))
+        except Exception as e:
+            print(f"skip {item}: {e}")
+            return item, None
+
+
+def collate(batch):
+    batch = [(path, tensor) for path, tensor in batch if tensor is not None]
+    if not batch:
+        return [], None
+    paths, tensors = zip(*batch)
+    return list(paths), torch.stack(tensors)
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.f = open(path, "w", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    """Mỗi batch là một row group; cần pyarrow."""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([("path", pa.string()), ("result", pa.string())]
+                                + [(c, pa.float32()) for c in COLUMNS[2:]])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(col, type=field.type) for col, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_writer(path):
+    return ParquetWriter(path) if path.endswith(".parquet") else CsvWriter(path)
+
+
+def run(source, out, checkpoint="model.pth", model_name="resnet18", backend="eager",
+        batch_size=32, workers=4, prefetch=2, log_every=10):
+    device = torch.device("cuda" if torch.cuda.is_available() and backend in ("eager", "torchscript")
+                          else "cpu")
+    model = load_model(backend, checkpoint, model_name, device)
+
+    items = list_images(source)
+    print(f"{len(items)} images from {source}")
+    loader = DataLoader(
+        ImageSource(items), batch_size=batch_size, num_workers=workers, collate_fn=collate,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=prefetch if workers > 0 else None,
+        persistent_workers=False,
+    )
+
+    writer = open_writer(out)
+    done, started = 0, time.perf_counter()
+    try:
+        with torch.inference_mode():
+            for step, (paths, images) in enumerate(loader, 1):
+                if images is None:
+                    continue
+                probs = torch.softmax(model(images.to(device, non_blocking=True)), dim=1).float().cpu()
+                confidence, pred = probs.max(dim=1)
+                writer.write([
+                    (path, ID2LABEL[p], c) + tuple(row)
+                    for path, p, c, row in zip(paths, pred.tolist(), confidence.tolist(), probs.tolist())
+                ])
+                done += len(paths)
+                if step % log_every == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"{done}/{len(items)} images, {done / elapsed:.1f} img/s")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {done} images in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} img/s) -> {out}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="thư mục ảnh hoặc s3://bucket/prefix")
+    parser.add_argument("--out", default="predictions.csv", help=".csv hoặc .parquet")
+    parser.add_argument("--checkpoint", default="model.pth")
+    parser.add_argument("--model", default="resnet18", choices=list(model_dict))
+    parser.add_argument("--backend", default="eager", choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = mặc định)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    run(args.source, args.out, args.checkpoint, args.model, args.backend,
+        args.batch_size, args.workers, args.prefetch)
+
+
+if __name__ == "__main__":
+    main()
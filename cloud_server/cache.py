@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "300"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(1024 * 1024)))
+# Perceptual hash (dHash 64-bit) cho các frame gần giống nhau; 0 = tắt
+RESULT_CACHE_PHASH = os.environ.get("RESULT_CACHE_PHASH", "0") == "1"
+RESULT_CACHE_PHASH_DISTANCE = int(os.environ.get("RESULT_CACHE_PHASH_DISTANCE", "4"))
+# Không archive lên S3 các frame trùng với frame đã có trong cache
+SKIP_DUPLICATE_ARCHIVE = os.environ.get("SKIP_DUPLICATE_ARCHIVE", "0") == "1"
+
+# Ước lượng overhead mỗi entry (key, tuple, dict) để tính memory budget
+_ENTRY_OVERHEAD = 512
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(data, hash_size=8):
+    """
+    dHash: so sánh độ sáng các pixel liền kề trên ảnh grayscale (hash_size+1, hash_size).
+
+    None nếu ảnh không decode được; caller chỉ tra exact key, lỗi được báo ở bước decode.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        # draft: decode JPEG ở scale nhỏ nhất, đủ cho ảnh 9x8
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        img = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return None
+    pixels = img.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+class ResultCache:
+    """
+    Cache kết quả inference theo content hash (+ perceptual hash tùy chọn).
+
+    LRU + TTL, giới hạn cả số entry và tổng dung lượng ước lượng.
+    Value là dict nhỏ (result, confidence, saved keys), không lưu ảnh.
+    Mỗi entry thuộc một partition (vd "<model>:<version>"): phash chỉ khớp trong cùng
+    partition, nên ảnh gần giống không nhận kết quả của model khác / version đã reload.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL,
+                 max_bytes=RESULT_CACHE_MAX_BYTES, phash_distance=RESULT_CACHE_PHASH_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance
+
+        # key -> (expires_at, partition, phash, value, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _size(value):
+        return _ENTRY_OVERHEAD + sum(len(str(v)) for v in value.values())
+
+    def _remove(self, key):
+        _, _, _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key, phash=None, count_miss=True, partition=None):
+        """
+        Trả về value hoặc None. Thử exact key trước, sau đó phash nếu có (chỉ trong partition).
+
+        count_miss=False khi caller sẽ thử lại với phash, để không đếm miss hai lần.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[3]
+                self._remove(key)
+                self.expirations += 1
+
+            if phash is not None:
+                # Quét tuyến tính: cache nhỏ (vài nghìn entry), XOR + popcount rất rẻ
+                for k, (expires_at, other_partition, other, value, _) in reversed(self._entries.items()):
+                    if other is not None and other_partition == partition and expires_at > now \
+                            and (phash ^ other).bit_count() <= self.phash_distance:
+                        self._entries.move_to_end(k)
+                        self.phash_hits += 1
+                        return value
+
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def put(self, key, value, phash=None, partition=None):
+        size = self._size(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, partition, phash, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.phash_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "phash_hits": self.phash_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.phash_hits) / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
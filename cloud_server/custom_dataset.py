@@ -1,17 +1,38 @@
+import io
+
 from PIL import Image
 from torch.utils.data import Dataset
 
+from manifest import read_bytes
+
 class CustomDataset(Dataset):
-    def __init__(self, image_paths, labels, transform=None):
+    def __init__(self, image_paths, labels, transform=None, cache=None):
         self.image_paths = image_paths
         self.labels = labels
         self.transform = transform
+        # cache: tensor_cache.ImageCache build từ đúng image_paths này (cùng thứ tự);
+        # None = decode JPEG mỗi lần như cũ
+        self.cache = cache
+        if cache is not None and len(cache) != len(image_paths):
+            raise ValueError("Cache size does not match image_paths")
     
+    def _read_s3(self, uri):
+        # Dataset từ manifest S3 (utils.load_dataset với root s3://...); client tạo lazy trong từng worker
+        if getattr(self, "_s3", None) is None:
+            import boto3
+            self._s3 = boto3.client("s3")
+        return read_bytes(uri, self._s3)
+
     def __len__(self):
         return len(self.image_paths)
     
     def __getitem__(self, idx):
-        img = Image.open(self.image_paths[idx]).convert("RGB")
+        if self.cache is not None:
+            img = self.cache[idx]
+        elif self.image_paths[idx].startswith("s3://"):
+            img = Image.open(io.BytesIO(self._read_s3(self.image_paths[idx]))).convert("RGB")
+        else:
+            img = Image.open(self.image_paths[idx]).convert("RGB")
         if self.transform:
             img = self.transform(img)
-        return img, self.labels[idx]
\ No newline at end of file
+        return img, self.labels[idx]
@@ -0,0 +1,228 @@
+"""
+Export checkpoint Model2Class thành artifact tối ưu cho serving.
+
+Ví dụ (chạy trong thư mục cloud_server):
+    # TorchScript (trace + freeze)
+    python export.py --checkpoint model.pth --format torchscript --out model.ts.pt
+    # ONNX Runtime
+    python export.py --checkpoint model.pth --format onnx --out model.onnx
+    # INT8 static quantization, calibrate trên ảnh train, kiểm tra accuracy trên eval split
+    python export.py --checkpoint model.pth --format int8_static --out model.int8.pt \\
+        --data-root dataset --parity
+    # So sánh latency/throughput từng backbone trong model_dict với mọi backend
+    python export.py --benchmark --models resnet18 mobilenet_v3_small
+
+Serving: INFERENCE_BACKEND=torchscript|int8|onnx MODEL_PATH=<artifact> python inference.py
+"""
+import argparse
+import copy
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from backends import load_model
+from custom_dataset import CustomDataset
+from model import Model2Class, model_dict
+from utils import load_dataset, transform
+
+FORMATS = ("torchscript", "onnx", "int8_dynamic", "int8_static")
+# Backend dùng để load lại từng format khi serving
+FORMAT_BACKEND = {
+    "torchscript": "torchscript",
+    "onnx": "onnx",
+    "int8_dynamic": "int8",
+    "int8_static": "int8",
+}
+IMAGE_SHAPE = (3, 224, 224)
+
+
+def build_eager(model_name, checkpoint=None):
+    # Benchmark latency không cần pretrained weights, checkpoint thì ghi đè luôn
+    model = Model2Class(model_name, pretrained=False)
+    if checkpoint:
+        model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+    return model.to("cpu").eval()
+
+
+def export_torchscript(model, out):
+    example = torch.randn(1, *IMAGE_SHAPE)
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    torch.jit.freeze(traced).save(out)
+
+
+def export_onnx(model, out):
+    example = torch.randn(1, *IMAGE_SHAPE)
+    torch.onnx.export(
+        model, (example,), out,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17, dynamo=False,
+    )
+
+
+def export_int8_dynamic(model, out):
+    # Dynamic quantization chỉ áp dụng cho Linear (classifier head)
+    quantized = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8)
+    export_torchscript(quantized, out)
+
+
+def export_int8_static(model, out, calib_loader):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = torch.randn(1, *IMAGE_SHAPE)
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping("x86"), (example,))
+    with torch.inference_mode():
+        for images, _ in calib_loader:
+            prepared(images)
+    export_torchscript(convert_fx(prepared), out)
+
+
+def random_loader(batches=4, batch_size=8):
+    """Calibration giả khi không có dataset (chỉ dùng cho benchmark latency)."""
+    return [(torch.randn(batch_size, *IMAGE_SHAPE), None) for _ in range(batches)]
+
+
+def export(model, fmt, out, calib_loader=None):
+    if fmt == "torchscript":
+        export_torchscript(model, out)
+    elif fmt == "onnx":
+        export_onnx(model, out)
+    elif fmt == "int8_dynamic":
+        export_int8_dynamic(model, out)
+    elif fmt == "int8_static":
+        export_int8_static(model, out, calib_loader or random_loader())
+    else:
+        raise ValueError(f"Format {fmt} not supported! Choose one of {FORMATS}")
+
+
+@torch.inference_mode()
+def evaluate(model, loader):
+    """Trả về (accuracy, logits) trên loader."""
+    correct, total, all_logits = 0, 0, []
+    for images, labels in loader:
+        logits = model(images)
+        correct += (logits.argmax(dim=1) == labels).sum().item()
+        total += labels.numel()
+        all_logits.append(logits.float())
+    return correct / max(total, 1), torch.cat(all_logits)
+
+
+@torch.inference_mode()
+def measure_latency(model, batch_size, iters=30, warmup=5):
+    x = torch.randn(batch_size, *IMAGE_SHAPE)
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(iters):
+        started = time.perf_counter()
+        model(x)
+        times.append(time.perf_counter() - started)
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p95_ms": float(np.percentile(times, 95)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "images_per_sec": float(batch_size * iters / (times.sum() / 1000)),
+    }
+
+
+def parity_check(eager, exported, eval_loader):
+    eager_acc, eager_logits = evaluate(eager, eval_loader)
+    exported_acc, exported_logits = evaluate(exported, eval_loader)
+    agreement = (eager_logits.argmax(1) == exported_logits.argmax(1)).float().mean().item()
+    max_diff = (eager_logits - exported_logits).abs().max().item()
+    print(f"eager accuracy    {eager_acc:.4f}")
+    print(f"exported accuracy {exported_acc:.4f}  (delta {exported_acc - eager_acc:+.4f})")
+    print(f"top-1 agreement   {agreement:.4f}  max |logit diff| {max_diff:.4f}")
+    return exported_acc - eager_acc
+
+
+def run_benchmark(model_names, batch_sizes, iters):
+    print(f"{'model':<22}{'backend':<14}{'batch':>6}{'p50 ms':>10}{'p95 ms':>10}{'img/s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in model_names:
+            eager = build_eager(name)
+            candidates = [("eager", eager)]
+            for fmt in FORMATS:
+                out = os.path.join(tmp, f"{name}.{fmt}")
+                try:
+                    export(eager, fmt, out)
+                    candidates.append((fmt, load_model(FORMAT_BACKEND[fmt], out, name)))
+                except Exception as e:
+                    print(f"{name:<22}{fmt:<14} export failed: {e}")
+            for backend, model in candidates:
+                for bs in batch_sizes:
+                    r = measure_latency(model, bs, iters)
+                    print(f"{name:<22}{backend:<14}{bs:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+                          f"{r['images_per_sec']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="model.pth")
+    parser.add_argument("--model", default="resnet18", choices=list(model_dict))
+    parser.add_argument("--format", choices=FORMATS)
+    parser.add_argument("--out")
+    parser.add_argument("--data-root", help="dataset cho calibration (int8_static) và --parity")
+    parser.add_argument("--eval-per-class", type=int, default=100)
+    parser.add_argument("--manifest", default=None, help="đường dẫn manifest (manifest.py); bắt buộc với s3://")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--calib-batches", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--parity", action="store_true", help="so sánh accuracy với eager trên eval split")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--models", nargs="+", default=list(model_dict))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iters", type=int, default=30)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if args.benchmark:
+        run_benchmark(args.models, args.batch_sizes, args.iters)
+        return
+
+    if not args.format or not args.out:
+        parser.error("--format and --out are required unless --benchmark is given")
+
+    eager = build_eager(args.model, args.checkpoint)
+
+    train_loader = eval_loader = None
+    if args.data_root:
+        train_paths, train_labels, eval_paths, eval_labels = load_dataset(
+            args.data_root, eval_per_class=args.eval_per_class, seed=args.seed, manifest_path=args.manifest)
+        train_loader = DataLoader(CustomDataset(train_paths, train_labels, transform),
+                                  batch_size=args.batch_size, shuffle=True)
+        eval_loader = DataLoader(CustomDataset(eval_paths, eval_labels, transform),
+                                 batch_size=args.batch_size)
+
+    calib_loader = None
+    if train_loader is not None:
+        calib_loader = [batch for _, batch in zip(range(args.calib_batches), train_loader)]
+    elif args.format == "int8_static":
+        print("WARNING: no --data-root, calibrating int8_static on random inputs")
+
+    export(eager, args.format, args.out, calib_loader)
+    print(f"Exported {args.model} ({args.format}) -> {args.out}")
+
+    if args.parity:
+        if eval_loader is None:
+            parser.error("--parity requires --data-root")
+        exported = load_model(FORMAT_BACKEND[args.format], args.out, args.model)
+        drop = -parity_check(eager, exported, eval_loader)
+        if drop > args.max_accuracy_drop:
+            raise SystemExit(f"Accuracy drop {drop:.4f} > {args.max_accuracy_drop}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,593 @@
 import os
 import time
-import boto3
+import asyncio
+import hmac
+import json
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import uvicorn
-from PIL import Image
-import io
-from utils import transform
-from model import Model2Class
-import torch
+from runtime import Overloaded, decode_pool, model_pool, io_pool, shutdown_pools, MODEL_MAX_PENDING
+from metrics import METRICS, REQUEST_SECONDS, REQUESTS, ERRORS, register_gauge, timed, log_sampled
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# torch / boto3 / PIL được import lazy trong load_server() để process bind port
+# ngay, /health trả 503 "starting" cho tới khi model load + warm-up xong.
 
-# load model
-model = Model2Class()
-model.load_state_dict(torch.load("model.pth", map_location=device))
-model.to(device)
-model.eval()
+# Serving backend: eager | torchscript | int8 | onnx (artifact tạo bởi export.py)
+# Dùng cho model "default" khi không có MODEL_REGISTRY (xem registry.py)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "eager")
+MODEL_NAME = os.environ.get("MODEL_NAME", "resnet18")
+MODEL_PATH = os.environ.get("MODEL_PATH", "model.pth")
+# Đọc checkpoint bằng mmap (chỉ backend eager)
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "0") == "1"
+# Warm-up: các batch size chạy thử trước khi báo ready, vd "1,8"; rỗng = bỏ qua
+WARMUP_BATCH_SIZES = [int(x) for x in os.environ.get("WARMUP_BATCH_SIZES", "1").split(",") if x.strip()]
+WARMUP_ITERS = int(os.environ.get("WARMUP_ITERS", "2"))
+
+BUCKET = "iot-gardernice"
+# Pointer <DATA_PATH_PREFIX>latest/<PLANT_ID>/... mà Lambda get_plant_data đọc
+# (phải khớp PLANT_ID và DATA_PATH_PREFIX của Lambda)
+PLANT_ID = os.environ.get("PLANT_ID", "plant_001")
+DATA_PATH_PREFIX = os.environ.get("DATA_PATH_PREFIX", "")
+# Số ảnh tối đa trong một request /inference/batch
+BATCH_ENDPOINT_MAX_IMAGES = int(os.environ.get("BATCH_ENDPOINT_MAX_IMAGES", "64"))
+# Token bảo vệ endpoint reload model; rỗng = tắt endpoint reload (403)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Reload chỉ được load file nằm trong thư mục này (path tương đối tính từ đây); mặc định thư mục của MODEL_PATH
+MODEL_DIR = os.path.realpath(os.environ.get("MODEL_DIR") or os.path.dirname(os.path.abspath(MODEL_PATH)))
 
 app = FastAPI()
 
-# init S3 client
-s3 = boto3.client("s3")
-BUCKET = "iot-gardernice"
+# Được gán trong load_server()
+registry = None
+s3_writer = None
+ARCHIVE_MODE = "original"
+decode_resized = normalize_into = sniff_image_type = make_thumbnail = None
+DecodeError = None
+cache_module = None
+result_cache = None
+
+startup = {"ready": False, "error": None, "phases": {}}
+
+
+def timed_phase(name, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    startup["phases"][name] = round(elapsed * 1000, 1)
+    print(f"[startup] {name}: {elapsed * 1000:.1f} ms")
+    return result
+
+
+def _import_modules():
+    global decode_resized, normalize_into, sniff_image_type, make_thumbnail, ARCHIVE_MODE, \
+        cache_module, result_cache, DecodeError
+    import torch  # noqa: F401
+    import preprocess
+    import archive
+    import cache
+    cache_module = cache
+    if cache.RESULT_CACHE_ENABLED:
+        result_cache = cache.ResultCache()
+    decode_resized = preprocess.decode_resized
+    normalize_into = preprocess.normalize_into
+    DecodeError = preprocess.DecodeError
+    sniff_image_type = archive.sniff_image_type
+    make_thumbnail = archive.make_thumbnail
+    ARCHIVE_MODE = archive.ARCHIVE_MODE
+
+
+def _load_models():
+    """Load + warm-up mọi model trong registry (blocking)."""
+    global registry
+    from registry import ModelRegistry, registry_specs
+
+    specs, default = registry_specs({
+        "backend": INFERENCE_BACKEND,
+        "model_name": MODEL_NAME,
+        "path": MODEL_PATH,
+        "mmap": MODEL_MMAP,
+    })
+    # Forward pass chạy trên model pool; các thread dùng chung weights của mỗi model
+    registry = ModelRegistry(specs, default, pool=model_pool, max_queue=MODEL_MAX_PENDING,
+                             warmup_batch_sizes=WARMUP_BATCH_SIZES, warmup_iters=WARMUP_ITERS)
+    return [registry.build(name, spec) for name, spec in specs.items()]
+
+
+def _init_s3_writer():
+    global s3_writer
+    from s3_writer import WriteBehindQueue
+
+    # S3 write-behind: response trả về ngay sau khi phân loại, upload chạy nền
+    s3_writer = WriteBehindQueue(BUCKET)
+    s3_writer.start()
+
+
+def load_server():
+    started = time.perf_counter()
+    timed_phase("imports", _import_modules)
+    entries = timed_phase("load_models", _load_models)
+    timed_phase("s3_writer", _init_s3_writer)
+    startup["phases"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[startup] ready in {startup['phases']['total']:.1f} ms")
+    return entries
+
+
+async def _startup_task():
+    try:
+        entries = await asyncio.get_running_loop().run_in_executor(None, load_server)
+        for entry in entries:
+            await registry.activate(entry)
+        startup["ready"] = True
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"[startup] FAILED: {e}")
+
+
+@app.on_event("startup")
+async def start_server():
+    # Load chạy nền để /health trả lời ngay trong lúc khởi động
+    app.state.startup_task = asyncio.create_task(_startup_task())
+
+
+@app.on_event("shutdown")
+async def stop_server():
+    if registry is not None:
+        await registry.stop()
+    shutdown_pools()
+    # Drain queue upload, phần còn lại spill xuống đĩa
+    if s3_writer is not None:
+        s3_writer.stop()
 
 print("Server AI đang khởi động...")
 # Endpoint dành riêng cho Health Check của Load Balancer
-@app.route('/health', methods=['GET'])
-def health_check():
-    # Trả về mã 200 OK và tin nhắn xác nhận
-    return jsonify({"status": "healthy"}), 200
+@app.get("/health")
+async def health_check():
+    # 200 OK chỉ khi model đã load + warm-up xong, còn lại 503
+    if startup["ready"]:
+        return {"status": "healthy", "startup_ms": startup["phases"]}
+    status = "failed" if startup["error"] else "starting"
+    return JSONResponse(status_code=503, content={
+        "status": status,
+        "error": startup["error"],
+        "startup_ms": startup["phases"],
+    })
+
+
+def decode_image(image_data):
+    """CPU-bound: decode (draft mode) + resize + normalize, chạy trên decode pool."""
+    import numpy as np
+    import torch
+
+    with timed("decode"):
+        array = decode_resized(image_data)
+    with timed("transform"):
+        out = np.empty((3,) + array.shape[:2], dtype=np.float32)
+        normalize_into(array, out)
+    return torch.from_numpy(out)
+
+def latest_pointer_key(metric):
+    """Cùng quy tắc với get_plant_data.latest_pointer_key: <DATA_PATH_PREFIX>latest/<PLANT_ID>/<metric>.json"""
+    return f"{DATA_PATH_PREFIX}latest/{PLANT_ID}/{metric}.json"
+
+
+def latest_pointer(metric, record):
+    """
+    Job ghi đè pointer latest của metric để dashboard đọc trạng thái mới nhất bằng 1 GET
+    thay vì list + sort cả prefix. Truyền vào `then=` của PUT object mà nó trỏ tới: pointer
+    chỉ được enqueue sau khi object đó đã lên S3. Chỉ ghi khi updated_at không cũ hơn pointer
+    hiện có (retry / spill nạp lại muộn không kéo lùi).
+    """
+    from s3_writer import make_job
+
+    now_ms = time.time_ns() // 1_000_000
+    record["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now_ms // 1000)) + f".{now_ms % 1000:03d}Z"
+    return make_job(latest_pointer_key(metric), json.dumps(record).encode("utf-8"),
+                    content_type="application/json", stage="s3_pointer_upload", if_newer="updated_at")
+
+
+def archive_thumbnail(image_data, image_key):
+    s3_writer.put(image_key, make_thumbnail(image_data), content_type="image/jpeg", stage="s3_image_upload",
+                  then=[latest_pointer("image", {"key": image_key})])
+
+
+def archive_to_s3(image_data, content_type, ext, result, confidence, suffix=""):
+    """Đưa ảnh + kết quả vào write-behind queue, trả về (image_key, result_key)."""
+    # Millisecond để hai ảnh trong cùng một giây không ghi đè key của nhau
+    timestamp = f"{time.time_ns() // 1_000_000}{suffix}"
+    result_key = f"results/{timestamp}.txt"
+
+    if ARCHIVE_MODE == "thumbnail":
+        # Downscale + encode trên io pool rồi đưa vào write-behind queue
+        image_key = f"images/{timestamp}.jpg"
+        try:
+            io_pool.submit(archive_thumbnail, image_data, image_key)
+        except Overloaded:
+            # io pool đầy: bỏ thumbnail thay vì encode ngay trên event loop lúc đang quá tải
+            ERRORS.inc(stage="thumbnail_dropped")
+            log_sampled("thumbnail_dropped", key=image_key)
+            image_key = None
+    else:
+        # Upload nguyên bytes gốc, không decode/encode lại
+        image_key = f"images/{timestamp}.{ext}"
+        s3_writer.put(image_key, image_data, content_type=content_type, stage="s3_image_upload",
+                      then=[latest_pointer("image", {"key": image_key})])
+
+    # Upload result text
+    s3_writer.put(
+        result_key,
+        f"{result}\n{confidence:.4f}".encode("utf-8"),  # use confidence
+        content_type="text/plain",
+        stage="s3_result_upload",
+        then=[latest_pointer("ai_evaluation",
+                             {"result": result, "confidence": round(confidence, 4), "result_key": result_key})],
+    )
+    return image_key, result_key
+
 
 @app.post("/inference")
 async def upload_image(request: Request):
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Model chưa sẵn sàng", headers={"Retry-After": "5"})
     try:
         # 1. Nhận raw bytes từ ESP32
-        image_data = await request.body()
+        with timed("body_read"):
+            image_data = await request.body()
         if not image_data:
             raise HTTPException(status_code=400, detail="Không có dữ liệu ảnh")
 
-        # 2. Convert raw bytes to PIL (để upload)
-        pil_image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        image_type = sniff_image_type(image_data)
+        if image_type is None:
+            raise HTTPException(status_code=415, detail="Chỉ hỗ trợ ảnh JPEG/PNG")
+        content_type, ext = image_type
 
-        # 2. Transform → Tensor
-        tensor_img = transform(pil_image)
-        tensor_img = tensor_img.unsqueeze(0).to(device)
+        # Chọn model theo header X-Model hoặc query ?model=, mặc định DEFAULT_MODEL
+        model_name = request.headers.get("x-model") or request.query_params.get("model")
+        try:
+            # Giữ entry ngay từ lúc lookup tới khi xong: reload giữa chừng vẫn chạy trên bản cũ
+            entry = registry.acquire(model_name)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Model {model_name} không tồn tại")
+        try:
+            return await classify_image(entry, image_data, content_type, ext)
+        finally:
+            entry.release()
 
-        # 3. Inference
-        output = model(tensor_img)
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        ERRORS.inc(stage="overloaded")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        ERRORS.inc(stage="internal")
+        log_sampled("inference_error", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Vì model output 3 class → dùng softmax
-        probs = torch.softmax(output, dim=1)
-        print("Probabilities:", probs)
 
-        # 4. Lấy class dự đoán
-        pred_class = torch.argmax(probs, dim=1).item()
+async def lookup_cache(entry, image_data):
+    """Tra cache theo hash bytes (+ perceptual hash nếu bật); trả về (cache_key, phash, cached)."""
+    if result_cache is None:
+        return None, None, None
+    # Key và partition phash gồm cả version: reload model thì kết quả cũ tự động không còn được dùng
+    partition = cache_partition(entry)
+    cache_key = f"{partition}:{cache_module.content_hash(image_data)}"
+    phash = None
+    cached = result_cache.get(cache_key, count_miss=not cache_module.RESULT_CACHE_PHASH)
+    if cached is None and cache_module.RESULT_CACHE_PHASH:
+        phash = await decode_pool.run(cache_module.perceptual_hash, image_data)
+        cached = result_cache.get(cache_key, phash, partition=partition)
+    return cache_key, phash, cached
 
-        # 5. Ánh xạ class → label
-        id2label = {0: "bacterial", 1: "fungal", 2: "healthy"}
-        result = id2label[pred_class]
 
-        confidence = probs[0][pred_class].item()
+def cache_partition(entry):
+    return f"{entry.name}:{entry.version}"
 
-        print(f"Result: {result}, Confidence: {confidence:.4f}")
 
-        # 4. SAVE TO S3
-        timestamp = int(time.time())
-        image_key = f"images/{timestamp}.jpg"
-        result_key = f"results/{timestamp}.txt"
-
-        # Upload image
-        buffer = io.BytesIO()
-        pil_image.save(buffer, format="JPEG")
-        buffer.seek(0)
-
-        s3.upload_fileobj(
-            buffer,
-            BUCKET,
-            image_key,
-            ExtraArgs={"ContentType": "image/jpeg"}
-        )
-
-        # Upload result text
-        s3.put_object(
-            Bucket=BUCKET,
-            Key=result_key,
-            Body=f"{result}\n{confidence:.4f}".encode("utf-8"),  # use confidence
-            ContentType="text/plain"
-        )
-
-        # 5. Trả response
-        return JSONResponse(content={
-            "result": result,
-            "confidence": confidence,  # use confidence here too
-            "saved_image": image_key,
-            "saved_text": result_key
-        })
+def cached_response(entry, cached, image_data, content_type, ext, suffix=""):
+    """Response cho frame trùng; vẫn archive trừ khi SKIP_DUPLICATE_ARCHIVE."""
+    if cache_module.SKIP_DUPLICATE_ARCHIVE:
+        image_key, result_key = cached["saved_image"], cached["saved_text"]
+    else:
+        image_key, result_key = archive_to_s3(
+            image_data, content_type, ext, cached["result"], cached["confidence"], suffix=suffix)
+    return {
+        "result": cached["result"],
+        "confidence": cached["confidence"],
+        "saved_image": image_key,
+        "saved_text": result_key,
+        "model": entry.name,
+        "cached": True
+    }
+
+
+async def classify_image(entry, image_data, content_type, ext):
+    """Cache → decode → forward → archive cho một ảnh; caller đã acquire entry."""
+    # Cache theo hash bytes (+ perceptual hash nếu bật): frame trùng không cần forward pass
+    cache_key, phash, cached = await lookup_cache(entry, image_data)
+    if cached is not None:
+        return JSONResponse(content=cached_response(entry, cached, image_data, content_type, ext))
+
+    # 2. Decode + Transform → Tensor (trên decode pool)
+    try:
+        tensor_img = await decode_pool.run(decode_image, image_data)
+    except DecodeError as e:
+        ERRORS.inc(stage="decode")
+        raise HTTPException(status_code=400, detail=str(e))
 
+    # 3. Inference (gom batch với các request đồng thời, trả về softmax)
+    probs = await entry.scheduler.submit(tensor_img)
+    probs = probs.unsqueeze(0)
+
+    # 4. Lấy class dự đoán
+    pred_class = probs.argmax(dim=1).item()
+
+    # 5. Ánh xạ class → label
+    id2label = {0: "bacterial", 1: "fungal", 2: "healthy"}
+    result = id2label[pred_class]
+
+    confidence = probs[0][pred_class].item()
+
+    log_sampled("inference", model=entry.name, result=result, confidence=round(confidence, 4),
+                probs=[round(p, 4) for p in probs[0].tolist()], bytes=len(image_data))
+
+    # 4. SAVE TO S3
+    image_key, result_key = archive_to_s3(image_data, content_type, ext, result, confidence)
+
+    response = {
+        "result": result,
+        "confidence": confidence,  # use confidence here too
+        "saved_image": image_key,
+        "saved_text": result_key,
+        "model": entry.name
+    }
+    if result_cache is not None:
+        result_cache.put(cache_key, response, phash, partition=cache_partition(entry))
+
+    # 5. Trả response
+    return JSONResponse(content=response)
+
+
+def parse_length_prefixed(body):
+    """Stream các frame [4 byte big-endian length][bytes ảnh]."""
+    images, offset = [], 0
+    while offset < len(body):
+        if offset + 4 > len(body):
+            raise ValueError("truncated length prefix")
+        size = int.from_bytes(body[offset:offset + 4], "big")
+        offset += 4
+        if offset + size > len(body):
+            raise ValueError("truncated frame")
+        images.append((f"frame-{len(images)}", body[offset:offset + size]))
+        offset += size
+    return images
+
+
+async def read_batch_images(request):
+    """Trả về list (filename, bytes) từ multipart/form-data hoặc length-prefixed stream."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        images = []
+        form = await request.form(max_files=BATCH_ENDPOINT_MAX_IMAGES + 1)
+        for _, value in form.multi_items():
+            if hasattr(value, "read"):
+                images.append((value.filename, await value.read()))
+        return images
+    if content_type.startswith("application/x-length-prefixed"):
+        try:
+            return parse_length_prefixed(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Length-prefixed stream lỗi: {e}")
+    raise HTTPException(status_code=415,
+                        detail="Dùng multipart/form-data hoặc application/x-length-prefixed")
+
+
+@app.post("/inference/batch")
+async def upload_images(request: Request):
+    """
+    Nhiều ảnh trong một request (gateway flush backlog uploads/).
+
+    Ảnh hợp lệ được forward theo chunk BATCH_MAX_SIZE và tính vào giới hạn queue
+    của model (quá tải → 503); kết quả trả về theo thứ tự gửi lên, ảnh lỗi có
+    "error" riêng mà không làm hỏng cả batch.
+    """
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Model chưa sẵn sàng", headers={"Retry-After": "5"})
+    try:
+        with timed("body_read"):
+            images = await read_batch_images(request)
+        if not images:
+            raise HTTPException(status_code=400, detail="Không có dữ liệu ảnh")
+        if len(images) > BATCH_ENDPOINT_MAX_IMAGES:
+            raise HTTPException(status_code=413, detail=f"Tối đa {BATCH_ENDPOINT_MAX_IMAGES} ảnh mỗi request")
+
+        model_name = request.headers.get("x-model") or request.query_params.get("model")
+        try:
+            entry = registry.acquire(model_name)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Model {model_name} không tồn tại")
+        try:
+            return await classify_images(entry, images)
+        finally:
+            entry.release()
+
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        ERRORS.inc(stage="overloaded")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
+        ERRORS.inc(stage="internal")
+        log_sampled("inference_error", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def classify_images(entry, images):
+    """Phần thân /inference/batch cho list (filename, bytes); caller đã acquire entry."""
+    results = [None] * len(images)
+    candidates = []  # (index, filename, bytes, content_type, ext)
+    for i, (filename, image_data) in enumerate(images):
+        image_type = sniff_image_type(image_data) if image_data else None
+        if image_type is None:
+            results[i] = {"index": i, "filename": filename, "error": "Chỉ hỗ trợ ảnh JPEG/PNG"}
+            continue
+        candidates.append((i, filename, image_data) + image_type)
+
+    # Cache (+ phash) như /inference; frame trùng không cần forward pass
+    lookups = await asyncio.gather(*(lookup_cache(entry, item[2]) for item in candidates))
+    pending = []  # (index, filename, bytes, content_type, ext, cache_key, phash)
+    for (i, filename, image_data, content_type, ext), (cache_key, phash, cached) in zip(candidates, lookups):
+        if cached is not None:
+            results[i] = {"index": i, "filename": filename,
+                          **cached_response(entry, cached, image_data, content_type, ext, suffix=f"_{i}")}
+        else:
+            pending.append((i, filename, image_data, content_type, ext, cache_key, phash))
+
+    # Decode song song trên decode pool, rồi forward theo chunk BATCH_MAX_SIZE
+    decoded = await asyncio.gather(
+        *(decode_pool.run(decode_image, item[2]) for item in pending), return_exceptions=True)
+    ok = []
+    for item, tensor in zip(pending, decoded):
+        if isinstance(tensor, DecodeError):
+            ERRORS.inc(stage="decode")
+            results[item[0]] = {"index": item[0], "filename": item[1], "error": f"Decode lỗi: {tensor}"}
+        elif isinstance(tensor, BaseException):
+            raise tensor
+        else:
+            ok.append((item, tensor))
+
+    if ok:
+        # Tính vào max_queue của scheduler: batch lớn khi đang quá tải cũng bị 503
+        probs = await entry.scheduler.run_batch([tensor for _, tensor in ok])
+
+        id2label = {0: "bacterial", 1: "fungal", 2: "healthy"}
+        for ((i, filename, image_data, content_type, ext, cache_key, phash), _), row in zip(ok, probs):
+            pred_class = row.argmax().item()
+            result, confidence = id2label[pred_class], row[pred_class].item()
+            # Upload chạy nền song song qua write-behind queue; suffix tránh trùng key
+            image_key, result_key = archive_to_s3(
+                image_data, content_type, ext, result, confidence, suffix=f"_{i}")
+            response = {
+                "result": result,
+                "confidence": confidence,
+                "saved_image": image_key,
+                "saved_text": result_key,
+                "model": entry.name
+            }
+            if result_cache is not None:
+                result_cache.put(cache_key, response, phash, partition=cache_partition(entry))
+            results[i] = {"index": i, "filename": filename, **response}
+
+    log_sampled("inference_batch", model=entry.name, images=len(images), forwarded=len(ok))
+    return JSONResponse(content={"model": entry.name, "count": len(results), "results": results})
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if not request.url.path.startswith("/inference"):
+        return await call_next(request)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, path=request.url.path)
+        model = request.headers.get("x-model") or request.query_params.get("model")
+        if registry is None or model is None:
+            model = "default"
+        elif model not in registry.names():
+            # Không dùng tên tùy ý làm label để tránh bùng nổ số series
+            model = "unknown"
+        REQUESTS.inc(model=model, status=status)
+
+
+def _queue_depths():
+    depths = {(("queue", f"pool:{pool.name}"),): pool.pending for pool in (decode_pool, model_pool, io_pool)}
+    if registry is not None:
+        depths.update(registry.queue_depths())
+    if s3_writer is not None:
+        stats = s3_writer.stats()
+        depths[(("queue", "s3_writer"),)] = stats["queue_depth"]
+        depths[(("queue", "s3_spill"),)] = stats["spill_depth"]
+    return depths
+
+
+register_gauge("inference_queue_depth", "Pending items per queue", _queue_depths)
+register_gauge("inference_ready", "1 when models are loaded and warmed up", lambda: int(startup["ready"]))
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/batch_stats")
+def batch_stats():
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Model chưa sẵn sàng")
+    stats = {"models": registry.stats()}
+    stats["pools"] = {pool.name: pool.stats() for pool in (decode_pool, model_pool, io_pool)}
+    stats["s3_writer"] = s3_writer.stats()
+    if result_cache is not None:
+        stats["result_cache"] = result_cache.stats()
+    return stats
+
+
+@app.get("/models")
+def list_models():
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Model chưa sẵn sàng")
+    return registry.info()
+
+
+def resolve_model_path(path):
+    """Path trong body reload -> path tuyệt đối; 400 nếu nằm ngoài MODEL_DIR (kể cả qua symlink / ..)."""
+    if not isinstance(path, str) or not path:
+        raise HTTPException(status_code=400, detail="path phải là string")
+    resolved = os.path.realpath(os.path.join(MODEL_DIR, path))
+    if os.path.commonpath([resolved, MODEL_DIR]) != MODEL_DIR:
+        raise HTTPException(status_code=400, detail="path phải nằm trong MODEL_DIR")
+    if not os.path.isfile(resolved):
+        raise HTTPException(status_code=400, detail=f"Không tìm thấy file {path}")
+    return resolved
+
+
+@app.post("/models/{name}/reload")
+async def reload_model(name: str, request: Request):
+    """
+    Hot reload một model; body JSON tùy chọn để đổi path/backend/model_name, vd:
+        {"path": "model_v2.pth"}
+    Request đang chạy hoàn tất trên model cũ, request mới dùng model mới.
+    Cần header X-Admin-Token = ADMIN_TOKEN; path phải nằm trong MODEL_DIR.
+    """
+    from backends import BACKENDS
+
+    if not startup["ready"]:
+        raise HTTPException(status_code=503, detail="Model chưa sẵn sàng")
+    if not ADMIN_TOKEN or not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    body = await request.body()
+    try:
+        overrides = json.loads(body) if body else {}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Body JSON lỗi: {e}")
+    if not isinstance(overrides, dict):
+        raise HTTPException(status_code=400, detail="Body phải là JSON object")
+    overrides = {k: v for k, v in overrides.items() if k in ("path", "backend", "model_name", "mmap")}
+    if "path" in overrides:
+        overrides["path"] = resolve_model_path(overrides["path"])
+    if "backend" in overrides and overrides["backend"] not in BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend phải là một trong {BACKENDS}")
+    if "mmap" in overrides and not isinstance(overrides["mmap"], bool):
+        raise HTTPException(status_code=400, detail="mmap phải là true/false")
+    try:
+        entry = await registry.reload(name, overrides)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model {name} không tồn tại")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, keeping old model: {e}")
+    return {"reloaded": name, **entry.info()}
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
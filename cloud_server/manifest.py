@@ -0,0 +1,194 @@
+"""
+Manifest dataset được lưu lại giữa các lần chạy (path, label, size, mtime, hash).
+
+Re-scan chỉ stat các file (os.scandir), file không đổi size/mtime thì dùng lại
+entry cũ; chỉ file mới/đổi mới bị đọc để hash + kiểm tra ảnh hỏng. File không
+phải ảnh bị bỏ qua, ảnh hỏng được ghi nhận một lần và loại khỏi dataset.
+
+    python manifest.py dataset                      # scan local, ghi dataset/manifest.json
+    python manifest.py s3://bucket/dataset --out manifest_s3.json
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+
+from PIL import Image
+
+CLASS_DIRS = {0: "Bacterial", 1: "fungal", 2: "healthy"}
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+MANIFEST_VERSION = 1
+
+
+def default_manifest_path(root_dir):
+    return os.path.join(root_dir, "manifest.json")
+
+
+def load_manifest(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data["entries"]
+
+
+def save_manifest(path, root, entries):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "root": root, "entries": entries}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def read_bytes(path, s3=None):
+    """Đọc bytes của một path trong manifest (local hoặc s3://); s3 là boto3 client dùng lại nếu có."""
+    if path.startswith("s3://"):
+        if s3 is None:
+            import boto3
+            s3 = boto3.client("s3")
+        bucket, key = split_s3_uri(path)
+        return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def path_signature(path, entries=None, s3=None):
+    """
+    Chuỗi đổi khi nội dung file đổi: local = size + mtime (stat);
+    s3:// = size + ETag lấy từ manifest entries, không có thì HEAD object.
+    """
+    if not path.startswith("s3://"):
+        st = os.stat(path)
+        return f"{st.st_size}\0{st.st_mtime_ns}"
+    entry = entries.get(path) if entries else None
+    if entry is not None:
+        return f"{entry[1]}\0{entry[3]}"
+    if s3 is None:
+        import boto3
+        s3 = boto3.client("s3")
+    bucket, key = split_s3_uri(path)
+    head = s3.head_object(Bucket=bucket, Key=key)
+    etag = head["ETag"].strip('"')
+    return f"{head['ContentLength']}\0{etag}"
+
+
+def inspect_file(path):
+    """Hash nội dung + kiểm tra ảnh decode được. Trả về (hash, valid)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        # verify() chỉ kiểm tra cấu trúc file, không phát hiện JPEG bị cắt: decode hết một lần
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+        return digest, True
+    except Exception:
+        return digest, False
+
+
+def scan_local(root_dir, previous):
+    """
+    Trả về (entries, stats). entries: {path: [label, size, mtime_ns, hash, valid]}.
+    """
+    entries = {}
+    stats = {"reused": 0, "inspected": 0, "corrupt": 0, "skipped": 0}
+    for label, class_name in CLASS_DIRS.items():
+        class_dir = os.path.join(root_dir, class_name)
+        with os.scandir(class_dir) as it:
+            for e in it:
+                if not e.is_file():
+                    continue
+                if not e.name.lower().endswith(IMAGE_EXTS):
+                    stats["skipped"] += 1
+                    continue
+                st = e.stat()
+                old = previous.get(e.path)
+                if old and old[0] == label and old[1] == st.st_size and old[2] == st.st_mtime_ns:
+                    entries[e.path] = old
+                    stats["reused"] += 1
+                else:
+                    digest, valid = inspect_file(e.path)
+                    entries[e.path] = [label, st.st_size, st.st_mtime_ns, digest, valid]
+                    stats["inspected"] += 1
+                if not entries[e.path][4]:
+                    stats["corrupt"] += 1
+    return entries, stats
+
+
+def scan_s3(uri, previous):
+    """
+    Liệt kê s3://bucket/prefix/<class>/... bằng paginator (không giới hạn 1000 key).
+
+    Hash = ETag; mtime = LastModified. Không tải ảnh về để verify, ảnh hỏng được
+    phát hiện lúc đọc.
+    """
+    import boto3
+
+    bucket, prefix = split_s3_uri(uri)
+    prefix = prefix.rstrip("/") + "/" if prefix else ""
+    paginator = boto3.client("s3").get_paginator("list_objects_v2")
+    entries = {}
+    stats = {"reused": 0, "inspected": 0, "corrupt": 0, "skipped": 0}
+    for label, class_name in CLASS_DIRS.items():
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}{class_name}/"):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if not key.lower().endswith(IMAGE_EXTS):
+                    stats["skipped"] += 1
+                    continue
+                path = f"s3://{bucket}/{key}"
+                mtime_ns = int(obj["LastModified"].timestamp() * 1e9)
+                old = previous.get(path)
+                etag = obj["ETag"].strip('"')
+                if old and old[0] == label and old[3].strip('"') == etag:
+                    entries[path] = old
+                    stats["reused"] += 1
+                else:
+                    entries[path] = [label, obj["Size"], mtime_ns, etag, True]
+                    stats["inspected"] += 1
+    return entries, stats
+
+
+def update_manifest(root_dir, manifest_path=None):
+    """Scan (incremental) rồi ghi manifest; trả về entries."""
+    if manifest_path is None:
+        if root_dir.startswith("s3://"):
+            raise ValueError("manifest_path is required for s3:// datasets")
+        manifest_path = default_manifest_path(root_dir)
+    previous = load_manifest(manifest_path)
+    if root_dir.startswith("s3://"):
+        entries, stats = scan_s3(root_dir, previous)
+    else:
+        entries, stats = scan_local(root_dir, previous)
+    save_manifest(manifest_path, root_dir, entries)
+    print(f"Manifest {manifest_path}: {len(entries)} files "
+          f"({stats['reused']} reused, {stats['inspected']} inspected, "
+          f"{stats['corrupt']} corrupt, {stats['skipped']} non-image skipped)")
+    return entries
+
+
+def manifest_samples(entries):
+    """(paths, labels) hợp lệ, sắp xếp theo path để split không phụ thuộc thứ tự listdir."""
+    valid = sorted((path, e[0]) for path, e in entries.items() if e[4])
+    return [p for p, _ in valid], [lbl for _, lbl in valid]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="thư mục dataset hoặc s3://bucket/prefix")
+    parser.add_argument("--out", help="đường dẫn manifest (mặc định <root>/manifest.json)")
+    args = parser.parse_args()
+    update_manifest(args.root, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Tỉ lệ request được log chi tiết (structured JSON), 1.0 = log tất cả
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+logger = logging.getLogger("inference")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name, self.help, self.type = name, help, "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            return [f"{self.name}{_label_str(k)} {v}" for k, v in sorted(self._values.items())]
+
+
+class Gauge:
+    """Gauge lấy giá trị lúc scrape qua callback: fn() -> {labels dict as tuple: value} hoặc số."""
+
+    def __init__(self, name, help, fn):
+        self.name, self.help, self.type = name, help, "gauge"
+        self.fn = fn
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        if not isinstance(values, dict):
+            return [f"{self.name} {values}"]
+        return [f"{self.name}{_label_str(tuple(sorted(k)))} {v}" for k, v in values.items()]
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.type = name, help, "histogram"
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {state[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_label_str(key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+STAGE_SECONDS = METRICS.register(Histogram(
+    "inference_stage_seconds",
+    "Latency of each pipeline stage (body_read, decode, transform, forward, s3_image_upload, s3_result_upload)"))
+REQUEST_SECONDS = METRICS.register(Histogram(
+    "inference_request_seconds", "End-to-end /inference handler latency"))
+BATCH_SIZE = METRICS.register(Histogram(
+    "inference_batch_size", "Images per forward pass", buckets=(1, 2, 4, 8, 16, 32, 64)))
+REQUESTS = METRICS.register(Counter("inference_requests_total", "Requests by model and HTTP status"))
+ERRORS = METRICS.register(Counter("inference_errors_total", "Errors by stage"))
+
+
+def register_gauge(name, help, fn):
+    return METRICS.register(Gauge(name, help, fn))
+
+
+@contextmanager
+def timed(stage, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, **labels)
+
+
+def log_sampled(event, **fields):
+    """Log JSON một dòng cho một phần request (LOG_SAMPLE_RATE) thay vì print mọi request."""
+    if LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE:
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}))
@@ -25,9 +25,11 @@ model_dict = {
 }
 
 class Model2Class(nn.Module): 
-    def __init__(self, model_name="resnet18", model_dict=model_dict): 
+    def __init__(self, model_name="resnet18", model_dict=model_dict, pretrained=True): 
         super(Model2Class, self).__init__()
-        self.model = model_dict[model_name](pretrained=True)
+        # pretrained=False: chỉ dựng kiến trúc, không tải ImageNet weights
+        # (dùng khi load checkpoint ngay sau đó, vd. lúc serving)
+        self.model = model_dict[model_name](weights="DEFAULT" if pretrained else None)
         
         # Update the final layer depending on the model type
         if model_name.startswith("mobilenet") or model_name.startswith("efficientnet"):
@@ -0,0 +1,69 @@
+import io
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Giống utils.transform: Resize((224, 224)) + ToTensor + Normalize(ImageNet)
+IMAGE_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+# Lỗi PIL khi bytes qua được magic-byte check nhưng hỏng / bị cắt
+_DECODE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+class DecodeError(ValueError):
+    """Ảnh không decode được (hỏng, bị cắt); server trả 400."""
+
+
+# Lookup table (3, 256): uint8 -> (v / 255 - mean) / std cho từng channel.
+# ToTensor + Normalize gộp thành một lần tra bảng, ghi thẳng vào buffer output.
+_LUT = ((np.arange(256, dtype=np.float32)[None, :] / 255.0
+         - np.array(MEAN, dtype=np.float32)[:, None])
+        / np.array(STD, dtype=np.float32)[:, None]).astype(np.float32)
+
+
+def decode_resized(image, size=IMAGE_SIZE):
+    """
+    Decode ảnh (bytes hoặc PIL) thành uint8 array (size, size, 3).
+
+    Với JPEG dùng draft mode để decoder scale DCT (1/2, 1/4, 1/8) ngay khi
+    decode, nên ảnh full-resolution không bao giờ được giải nén hết.
+    Ảnh hỏng / bị cắt raise DecodeError.
+    """
+    try:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = Image.open(io.BytesIO(image))
+        if image.format == "JPEG":
+            # draft chọn scale nhỏ nhất mà vẫn >= size nên chất lượng resize không đổi nhiều
+            image.draft("RGB", (size, size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.BILINEAR)
+        return np.asarray(image)
+    except _DECODE_ERRORS as e:
+        raise DecodeError(f"không decode được ảnh: {e}") from e
+
+
+def normalize_into(array, out):
+    """Ghi (H, W, 3) uint8 vào `out` (3, H, W) float32 đã normalize."""
+    for c in range(3):
+        np.take(_LUT[c], array[..., c], out=out[c])
+    return out
+
+
+def preprocess(image, size=IMAGE_SIZE):
+    """Bytes/PIL -> tensor (3, size, size) float32, tương đương utils.transform."""
+    out = np.empty((3, size, size), dtype=np.float32)
+    normalize_into(decode_resized(image, size), out)
+    return torch.from_numpy(out)
+
+
+def preprocess_batch(images, size=IMAGE_SIZE):
+    """List bytes/PIL -> tensor (N, 3, size, size), ghi thẳng vào một buffer chung."""
+    out = np.empty((len(images), 3, size, size), dtype=np.float32)
+    for i, image in enumerate(images):
+        normalize_into(decode_resized(image, size), out[i])
+    return torch.from_numpy(out)
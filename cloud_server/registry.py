@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import torch
+
+from backends import load_model
+from batching import BatchScheduler
+
+# Cấu hình registry: JSON (string hoặc đường dẫn file), vd:
+#   {"fast": {"model_name": "mobilenet_v3_small", "path": "mobilenet.pth"},
+#    "accurate": {"model_name": "resnet18", "path": "model.pth", "backend": "torchscript"}}
+# Không có thì registry chỉ có một model "default" lấy từ INFERENCE_BACKEND/MODEL_NAME/MODEL_PATH.
+MODEL_REGISTRY = os.environ.get("MODEL_REGISTRY", "")
+DEFAULT_MODEL = os.environ.get("DEFAULT_MODEL", "")
+
+
+def registry_specs(default_spec):
+    """Đọc MODEL_REGISTRY, trả về (specs theo tên, tên model mặc định)."""
+    if not MODEL_REGISTRY:
+        return {"default": default_spec}, DEFAULT_MODEL or "default"
+    if os.path.isfile(MODEL_REGISTRY):
+        with open(MODEL_REGISTRY) as f:
+            specs = json.load(f)
+    else:
+        specs = json.loads(MODEL_REGISTRY)
+    specs = {name: {**default_spec, **spec} for name, spec in specs.items()}
+    default = DEFAULT_MODEL or next(iter(specs))
+    if default not in specs:
+        raise ValueError(f"DEFAULT_MODEL {default} not in MODEL_REGISTRY")
+    return specs, default
+
+
+class ModelEntry:
+    """Một phiên bản model đã load; instance được chia sẻ giữa các thread của model pool."""
+
+    def __init__(self, name, spec, model, device, version):
+        self.name = name
+        self.spec = spec
+        self.model = model
+        self.device = device
+        self.version = version
+        self.loaded_at = time.time()
+        self.scheduler = None
+        self.inflight = 0
+        self._idle = None
+
+    def acquire(self):
+        self.inflight += 1
+
+    def release(self):
+        self.inflight -= 1
+        if self.inflight == 0 and self._idle is not None:
+            self._idle.set()
+
+    async def wait_idle(self):
+        if self.inflight == 0:
+            return
+        self._idle = asyncio.Event()
+        await self._idle.wait()
+
+    def info(self):
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "inflight": self.inflight,
+            **self.spec,
+        }
+
+
+class ModelRegistry:
+    """
+    Giữ nhiều model theo tên, hot-swap nguyên tử.
+
+    `get()` trả về entry hiện tại; request giữ entry đó (acquire/release) cho tới khi
+    xong nên vẫn chạy trên model cũ nếu trong lúc đó có reload. Model cũ chỉ bị dừng
+    sau khi hết request in-flight.
+    """
+
+    def __init__(self, specs, default, pool=None, max_queue=0,
+                 warmup_batch_sizes=(1,), warmup_iters=2):
+        self.specs = dict(specs)
+        self.default = default
+        self.pool = pool
+        self.max_queue = max_queue
+        self.warmup_batch_sizes = warmup_batch_sizes
+        self.warmup_iters = warmup_iters
+
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        # Chỉ cho một reload chạy cùng lúc trên mỗi model
+        self._reload_locks = {}
+        # Giữ reference task retire: event loop chỉ giữ weak ref, task có thể bị GC khi đang chờ
+        self._retiring = set()
+
+    # ---------- load (blocking, chạy ngoài event loop) ----------
+    def build(self, name, spec):
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if spec["backend"] in ("int8", "onnx"):
+            # INT8 kernels (fbgemm) và ONNX Runtime CPU provider chỉ chạy trên CPU
+            device = torch.device("cpu")
+        model = load_model(spec["backend"], spec["path"], spec["model_name"], device,
+                           mmap=spec.get("mmap", False))
+        with torch.inference_mode():
+            for batch_size in self.warmup_batch_sizes:
+                x = torch.zeros(batch_size, 3, 224, 224, device=device)
+                for _ in range(self.warmup_iters):
+                    model(x)
+        with self._lock:
+            version = self._versions.get(name, 0) + 1
+            self._versions[name] = version
+        print(f"Loaded {name} v{version}: {spec['model_name']} ({spec['backend']}) from {spec['path']}")
+        return ModelEntry(name, spec, model, device, version)
+
+    # ---------- activate / swap (trên event loop) ----------
+    async def activate(self, entry):
+        entry.scheduler = BatchScheduler(entry.model, entry.device, pool=self.pool,
+                                         max_queue=self.max_queue, name=entry.name)
+        await entry.scheduler.start()
+        with self._lock:
+            old = self._entries.get(entry.name)
+            self._entries[entry.name] = entry
+            self.specs[entry.name] = entry.spec
+        if old is not None:
+            task = asyncio.create_task(self._retire(old))
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+
+    async def _retire(self, entry):
+        await entry.wait_idle()
+        await entry.scheduler.stop()
+        print(f"Retired {entry.name} v{entry.version}")
+
+    async def reload(self, name, overrides=None):
+        """Load lại (có thể với path/backend/model_name mới) rồi swap nguyên tử; chỉ model đã có trong registry."""
+        if name not in self.specs:
+            raise KeyError(name)
+        spec = {**self.specs[name], **(overrides or {})}
+        lock = self._reload_locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.build, name, spec)
+            await self.activate(entry)
+        return entry
+
+    async def stop(self):
+        for entry in list(self._entries.values()):
+            await entry.scheduler.stop()
+
+    # ---------- routing ----------
+    def get(self, name=None):
+        name = name or self.default
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(name)
+        return entry
+
+    def acquire(self, name=None):
+        """get() + entry.acquire() không có await ở giữa: reload không thể retire entry trước khi caller giữ nó."""
+        entry = self.get(name)
+        entry.acquire()
+        return entry
+
+    def names(self):
+        return list(self._entries)
+
+    def info(self):
+        return {
+            "default": self.default,
+            "models": {name: entry.info() for name, entry in self._entries.items()},
+        }
+
+    def stats(self):
+        return {name: entry.scheduler.stats() for name, entry in self._entries.items()}
+
+    def queue_depths(self):
+        return {(("queue", f"batch:{name}"),): entry.scheduler.stats()["queue_depth"]
+                for name, entry in self._entries.items()}
@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import ERRORS, logger
+
+# Execution model của inference server:
+#   - decode pool: PIL decode + transform (CPU-bound, PIL/torch nhả GIL)
+#   - model pool: forward pass, 1 worker vì torch đã tự dùng nhiều thread
+#   - io pool: S3 upload, tách riêng để S3 chậm không chặn decode/inference
+DECODE_WORKERS = int(os.environ.get("DECODE_WORKERS", str(os.cpu_count() or 2)))
+MODEL_WORKERS = int(os.environ.get("MODEL_WORKERS", "1"))
+IO_WORKERS = int(os.environ.get("IO_WORKERS", "8"))
+
+# Giới hạn số job đang chờ mỗi pool; vượt quá thì trả 503 thay vì để latency tăng vô hạn
+DECODE_MAX_PENDING = int(os.environ.get("DECODE_MAX_PENDING", "64"))
+MODEL_MAX_PENDING = int(os.environ.get("MODEL_MAX_PENDING", "64"))  # số ảnh chờ mỗi model (BatchScheduler)
+IO_MAX_PENDING = int(os.environ.get("IO_MAX_PENDING", "256"))
+
+
+class Overloaded(Exception):
+    """Pool đã đầy, request nên bị từ chối với 503."""
+
+
+class BoundedPool:
+    """ThreadPoolExecutor có giới hạn số job pending (đang chạy + đang chờ); max_pending=0 chỉ đếm."""
+
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.pending = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def try_acquire(self):
+        if self.max_pending and self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(f"{self.name} queue full ({self.pending}/{self.max_pending})")
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    async def run(self, fn, *args):
+        # pending chỉ được sửa trên event loop nên không cần lock
+        self.try_acquire()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.release()
+
+    def submit(self, fn, *args):
+        """Fire-and-forget trên event loop; trả về asyncio.Future. Lỗi được log + đếm ở done-callback."""
+        self.try_acquire()
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        future.add_done_callback(lambda f: self._done(f, fn))
+        return future
+
+    def _done(self, future, fn):
+        self.release()
+        if future.cancelled() or future.exception() is None:
+            return
+        self.failed += 1
+        ERRORS.inc(stage=f"{self.name}_task")
+        logger.error(json.dumps({"event": "background_task_error", "pool": self.name,
+                                 "task": getattr(fn, "__name__", str(fn)), "error": repr(future.exception())}))
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+decode_pool = BoundedPool("decode", DECODE_WORKERS, DECODE_MAX_PENDING)
+# Model: admission control nằm ở BatchScheduler (max_queue = MODEL_MAX_PENDING ảnh / model),
+# pool chỉ đếm forward pass đang chạy + chờ, không từ chối batch đã nhận vào queue
+model_pool = BoundedPool("model", MODEL_WORKERS, 0)
+io_pool = BoundedPool("io", IO_WORKERS, IO_MAX_PENDING)
+
+
+def shutdown_pools(wait=True):
+    for pool in (decode_pool, model_pool, io_pool):
+        pool.shutdown(wait=wait)
@@ -0,0 +1,278 @@
+import base64
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from metrics import ERRORS, STAGE_SECONDS
+
+S3_UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", "8"))
+S3_QUEUE_SIZE = int(os.environ.get("S3_QUEUE_SIZE", "1000"))
+S3_MAX_RETRIES = int(os.environ.get("S3_MAX_RETRIES", "5"))
+S3_SPILL_DIR = os.environ.get("S3_SPILL_DIR", "s3_spill")
+# Cho phép trỏ tới MinIO / moto server khi test local
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+
+
+def make_s3_client(max_pool_connections=S3_UPLOAD_WORKERS, endpoint_url=S3_ENDPOINT_URL):
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=max_pool_connections, retries={"max_attempts": 1}),
+    )
+
+
+def parse_time(value):
+    """ISO timestamp (có thể kết thúc bằng Z) -> datetime UTC; None nếu không parse được."""
+    try:
+        t = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def make_job(key, body, content_type="application/octet-stream", stage="s3_upload", if_newer=None, then=()):
+    """Job upload; `then` là các job chỉ được đưa vào queue sau khi PUT của job này thành công."""
+    return {"key": key, "body": body, "content_type": content_type, "stage": stage, "attempt": 0,
+            "if_newer": if_newer, "then": list(then)}
+
+
+def job_meta(job):
+    """Job -> dict JSON được (không kèm body của job gốc) để spill xuống đĩa; job chain mang body base64."""
+    return {"key": job["key"], "content_type": job["content_type"], "stage": job["stage"],
+            "if_newer": job.get("if_newer"),
+            "then": [dict(job_meta(j), body=base64.b64encode(j["body"]).decode("ascii")) for j in job.get("then", ())]}
+
+
+def job_from_meta(meta, body):
+    return make_job(meta["key"], body, meta["content_type"], meta.get("stage", "s3_upload"), meta.get("if_newer"),
+                    [job_from_meta(j, base64.b64decode(j["body"])) for j in meta.get("then", ())])
+
+
+class WriteBehindQueue:
+    """
+    Queue upload S3 chạy nền (write-behind).
+
+    `put()` không bao giờ block request: job được đưa vào queue trong RAM,
+    nếu queue đầy thì ghi xuống `spill_dir` và được nạp lại khi queue có chỗ.
+    Job còn lại khi shutdown cũng được ghi xuống đĩa, lần khởi động sau sẽ upload tiếp.
+    Job chain (`then`) đi cùng job gốc qua retry / spill, nên pointer không bao giờ được PUT
+    trước object mà nó trỏ tới.
+    """
+
+    def __init__(self, bucket, s3_client=None, workers=S3_UPLOAD_WORKERS,
+                 max_queue=S3_QUEUE_SIZE, spill_dir=S3_SPILL_DIR,
+                 max_retries=S3_MAX_RETRIES, backoff_base=0.2, backoff_max=10.0):
+        self.bucket = bucket
+        self.s3 = s3_client or make_s3_client(max_pool_connections=workers)
+        self.workers = workers
+        self.spill_dir = spill_dir
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.uploaded = 0
+        self.failed = 0
+        self.retried = 0
+        self.spilled = 0
+        self.stale_skipped = 0
+        self.upload_seconds = 0.0
+        self.upload_max_seconds = 0.0
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    # ---------- public API ----------
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"s3-writer-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._reload_spilled, name="s3-writer-reload", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def put(self, key, body, content_type="application/octet-stream", stage="s3_upload", if_newer=None, then=()):
+        # stage: label cho metric latency upload, vd s3_image_upload / s3_result_upload
+        # if_newer: tên field timestamp ISO trong body JSON; object hiện có mới hơn thì không ghi đè
+        # (pointer latest: job retry / spill nạp lại muộn không kéo pointer lùi lại)
+        # then: job (make_job) chỉ được enqueue sau khi PUT này thành công, vd pointer latest
+        self._enqueue(make_job(key, body, content_type, stage, if_newer, then))
+
+    def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._spill(job)
+
+    def stop(self, timeout=30.0):
+        """Drain queue rồi dừng worker; job chưa kịp upload được spill xuống đĩa."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()) + 1.0)
+        self._threads = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._spill(job)
+            self._queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            uploaded = self.uploaded
+            return {
+                "queue_depth": self._queue.qsize(),
+                "spill_depth": self._spill_count(),
+                "uploaded": uploaded,
+                "failed": self.failed,
+                "retried": self.retried,
+                "spilled": self.spilled,
+                "stale_skipped": self.stale_skipped,
+                "avg_upload_ms": round(self.upload_seconds / uploaded * 1000, 3) if uploaded else 0,
+                "max_upload_ms": round(self.upload_max_seconds * 1000, 3),
+            }
+
+    # ---------- workers ----------
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                self._upload_with_retry(job)
+            finally:
+                self._queue.task_done()
+
+    def _upload_with_retry(self, job):
+        while True:
+            started = time.perf_counter()
+            try:
+                if job.get("if_newer"):
+                    self._put_if_newer(job)
+                else:
+                    self.s3.put_object(
+                        Bucket=self.bucket,
+                        Key=job["key"],
+                        Body=job["body"],
+                        ContentType=job["content_type"],
+                    )
+            except Exception as e:
+                job["attempt"] += 1
+                if job["attempt"] > self.max_retries or self._stopping.is_set():
+                    # Không bỏ dữ liệu: ghi xuống đĩa để thử lại sau
+                    print(f"[s3_writer] upload {job['key']} failed after {job['attempt']} attempts: {e}")
+                    with self._lock:
+                        self.failed += 1
+                    ERRORS.inc(stage=job["stage"])
+                    self._spill(job)
+                    return
+                with self._lock:
+                    self.retried += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (job["attempt"] - 1)))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=job["stage"])
+            with self._lock:
+                self.uploaded += 1
+                self.upload_seconds += elapsed
+                self.upload_max_seconds = max(self.upload_max_seconds, elapsed)
+            for follow in job.get("then", ()):
+                self._enqueue(follow)
+            return
+
+    def _put_if_newer(self, job, attempts=5):
+        """GET + so sánh field if_newer + PUT có điều kiện (If-Match / If-None-Match); 412 thì đọc lại."""
+        field = job["if_newer"]
+        new_time = parse_time(json.loads(job["body"]).get(field))
+        for _ in range(attempts):
+            try:
+                obj = self.s3.get_object(Bucket=self.bucket, Key=job["key"])
+                current_time = parse_time(json.loads(obj["Body"].read()).get(field))
+                condition = {"IfMatch": obj["ETag"]}
+            except self.s3.exceptions.NoSuchKey:
+                current_time, condition = None, {"IfNoneMatch": "*"}
+            if current_time is not None and (new_time is None or new_time < current_time):
+                with self._lock:
+                    self.stale_skipped += 1
+                return
+            try:
+                self.s3.put_object(Bucket=self.bucket, Key=job["key"], Body=job["body"],
+                                   ContentType=job["content_type"], CacheControl="no-cache", **condition)
+                return
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+        raise RuntimeError(f"conditional put of {job['key']} kept conflicting")
+
+    # ---------- spill to disk ----------
+    def _spill(self, job):
+        name = f"{time.time_ns()}-{uuid.uuid4().hex}"
+        body_path = os.path.join(self.spill_dir, name + ".body")
+        meta_path = os.path.join(self.spill_dir, name + ".json")
+        with open(body_path, "wb") as f:
+            f.write(job["body"])
+        # meta ghi sau cùng + rename: file .json tồn tại nghĩa là job đầy đủ
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job_meta(job), f)
+        os.replace(tmp_path, meta_path)
+        with self._lock:
+            self.spilled += 1
+
+    def _spill_count(self):
+        try:
+            return sum(1 for f in os.listdir(self.spill_dir) if f.endswith(".json"))
+        except FileNotFoundError:
+            return 0
+
+    def _reload_spilled(self):
+        """Nạp lại job đã spill khi queue còn chỗ (chạy nền)."""
+        while not self._stopping.is_set():
+            try:
+                names = sorted(f for f in os.listdir(self.spill_dir) if f.endswith(".json"))
+            except FileNotFoundError:
+                names = []
+            for name in names:
+                # Chỉ nạp lại khi queue còn ít nhất một nửa chỗ trống
+                if self._stopping.is_set() or self._queue.qsize() >= self._queue.maxsize // 2:
+                    break
+                meta_path = os.path.join(self.spill_dir, name)
+                body_path = meta_path[:-len(".json")] + ".body"
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    with open(body_path, "rb") as f:
+                        body = f.read()
+                except (OSError, ValueError) as e:
+                    print(f"[s3_writer] skip broken spill file {name}: {e}")
+                    if os.path.exists(meta_path):
+                        os.replace(meta_path, meta_path + ".bad")
+                    continue
+                os.remove(meta_path)
+                os.remove(body_path)
+                self._queue.put(job_from_meta(meta, body))
+            self._stopping.wait(1.0)
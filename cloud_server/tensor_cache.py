@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from manifest import path_signature, read_bytes
+from preprocess import decode_resized
+
+# Kích thước ảnh lưu trong cache; augmentation (crop/flip/...) vẫn chạy on-the-fly trên ảnh này
+CACHE_IMAGE_SIZE = int(os.environ.get("CACHE_IMAGE_SIZE", "224"))
+
+
+def fingerprint(paths, size, entries=None, s3=None):
+    """
+    Hash của (path, signature) mọi ảnh + kích thước cache; đổi file là đổi fingerprint.
+
+    Path s3:// (dataset từ manifest) dùng size + ETag trong manifest entries nếu có,
+    không thì HEAD từng object (xem manifest.path_signature).
+    """
+    h = hashlib.sha1(str(size).encode())
+    for p in paths:
+        h.update(f"{p}\0{path_signature(p, entries, s3)}\n".encode())
+    return h.hexdigest()
+
+
+class ImageCache:
+    """
+    Cache ảnh đã decode + resize dạng uint8 (N, H, W, 3) trong một file memmap cho mỗi split.
+
+    File: <cache_dir>/<split>.u8 (dữ liệu) và <split>.json (shape, fingerprint).
+    Memmap được mở lazy trong từng DataLoader worker, đọc zero-copy từ page cache.
+    """
+
+    def __init__(self, data_path, shape):
+        self.data_path = data_path
+        self.shape = tuple(shape)
+        self._array = None
+
+    @classmethod
+    def build_or_load(cls, paths, cache_dir, split, size=CACHE_IMAGE_SIZE, entries=None):
+        """entries: manifest entries (manifest.load_manifest) để fingerprint path s3:// không cần HEAD."""
+        os.makedirs(cache_dir, exist_ok=True)
+        s3 = None
+        if any(p.startswith("s3://") for p in paths):
+            import boto3
+            s3 = boto3.client("s3")
+        data_path = os.path.join(cache_dir, f"{split}.u8")
+        meta_path = os.path.join(cache_dir, f"{split}.json")
+        shape = (len(paths), size, size, 3)
+        fp = fingerprint(paths, size, entries, s3)
+
+        if os.path.exists(meta_path) and os.path.exists(data_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") == fp and tuple(meta.get("shape", ())) == shape:
+                return cls(data_path, shape)
+            print(f"[cache] {split}: files changed, rebuilding")
+
+        print(f"[cache] building {split} cache ({len(paths)} images) -> {data_path}")
+        tmp_path = data_path + ".tmp"
+        array = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=shape)
+        for i, p in enumerate(paths):
+            array[i] = decode_resized(read_bytes(p, s3), size)
+        array.flush()
+        del array
+        os.replace(tmp_path, data_path)
+        # meta ghi sau cùng: có meta khớp fingerprint nghĩa là data đã đầy đủ
+        with open(meta_path, "w") as f:
+            json.dump({"fingerprint": fp, "shape": list(shape), "paths": len(paths)}, f)
+        return cls(data_path, shape)
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.memmap(self.data_path, dtype=np.uint8, mode="r", shape=self.shape)
+        return self._array
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        """Trả về PIL Image để các transform torchvision hiện có dùng được như cũ."""
+        return Image.fromarray(np.asarray(self.array[idx]))
+
+    def __getstate__(self):
+        # Không pickle memmap sang worker process, mỗi worker tự mở lại
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
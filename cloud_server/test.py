@@ -1,49 +1,35 @@
-from PIL import Image
 import os
 
-folder_path = "image"   
-images = []            # list chứa ảnh
-filenames = []         # list chứa tên file
-
-for filename in os.listdir(folder_path):
-    if filename.lower().endswith(".jpg"):
-        img_path = os.path.join(folder_path, filename)
-        img = Image.open(img_path)
-        images.append(img)
-        filenames.append(filename)   # lưu tên file
-        
-
-# load model 
-from model import Model2Class
 import torch
-from utils import transform
+from torch.utils.data import DataLoader
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = Model2Class()
-model.load_state_dict(torch.load("resnet18 (6).pth", map_location=device))
+from backends import load_model
+from bulk_inference import ID2LABEL, ImageSource, collate, list_images
 
-model.to(device)
-model.eval()
+folder_path = "image"
 
-for image, filename in zip(images, filenames):
-        # 2. Transform → Tensor
-        tensor_img = transform(image)
-        tensor_img = tensor_img.unsqueeze(0).to(device)
 
-        # 3. Inference
-        output = model(tensor_img)
+def main():
+    # load model
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model("eager", "resnet18 (6).pth", "resnet18", device)
 
-        # Vì model output 3 class → dùng softmax
-        probs = torch.softmax(output, dim=1)
-        print("Probabilities:", probs)
+    # Stream ảnh qua DataLoader, forward theo batch thay vì từng ảnh một
+    # (chấm điểm thư mục lớn / S3: dùng bulk_inference.py)
+    loader = DataLoader(ImageSource(list_images(folder_path)), batch_size=16, num_workers=2, collate_fn=collate)
 
-        # 4. Lấy class dự đoán
-        pred_class = torch.argmax(probs, dim=1).item()
+    with torch.inference_mode():
+        for paths, images in loader:
+            if images is None:
+                continue
+            probs = torch.softmax(model(images.to(device)), dim=1).cpu()
+            confidence, pred = probs.max(dim=1)
+            for path, p, c, row in zip(paths, pred.tolist(), confidence.tolist(), probs):
+                print("Probabilities:", row)
+                print(f"Image: {os.path.basename(path)}")
+                print(f"Result: {ID2LABEL[p]}, Confidence: {c:.4f}")
 
-        # 5. Ánh xạ class → label
-        id2label = {0: "bacterial", 1: "fungal", 2: "healthy"}
-        result = id2label[pred_class]
 
-        confidence = probs[0][pred_class].item()
-        print(f"Image: {filename}")
-        print(f"Result: {result}, Confidence: {confidence:.4f}")
+# DataLoader worker (spawn trên Windows/macOS) import lại module này; guard để không chạy lại
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import io
+import os
+import sys
+import tempfile
+
+# Các module server đọc env lúc import: cố định trước khi import bất cứ gì từ cloud_server
+os.environ.update(
+    AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION="us-east-1",
+    S3_SPILL_DIR=tempfile.mkdtemp(), LOG_SAMPLE_RATE="0", WARMUP_BATCH_SIZES="",
+    # Cache tắt để request nào cũng đi qua model (test 503 đếm đúng số ảnh chờ)
+    RESULT_CACHE_ENABLED="0",
+    # Chunk nhỏ + queue nhỏ: batch 3 ảnh bị chia chunk, batch 5 ảnh vượt giới hạn
+    BATCH_MAX_SIZE="2", MODEL_MAX_PENDING="4",
+    ADMIN_TOKEN="test-admin-token", MODEL_DIR=tempfile.mkdtemp(),
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from PIL import Image
+
+
+def image_bytes(fmt="JPEG", size=(300, 200), seed=0):
+    """Ảnh nhiễu ngẫu nhiên (bytes) để mỗi ảnh khác nhau."""
+    import numpy as np
+
+    array = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, fmt)
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="session")
+def checkpoint_factory():
+    import torch
+    from export import build_eager
+
+    def make(name):
+        path = os.path.join(os.environ["MODEL_DIR"], name)
+        torch.save(build_eager("resnet18").state_dict(), path)
+        return path
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def client(checkpoint_factory):
+    """Server thật (TestClient) với S3 giả lập bằng moto; chờ tới khi /health ready."""
+    import time
+
+    from fastapi.testclient import TestClient
+    from moto import mock_aws
+
+    os.environ["MODEL_PATH"] = checkpoint_factory("model.pth")
+    with mock_aws():
+        import boto3
+
+        boto3.client("s3").create_bucket(Bucket="iot-gardernice")
+        import inference
+
+        inference.MODEL_PATH = os.environ["MODEL_PATH"]
+        with TestClient(inference.app) as c:
+            deadline = time.monotonic() + 120
+            while c.get("/health").status_code != 200:
+                assert time.monotonic() < deadline, c.get("/health").json()
+                time.sleep(0.1)
+            yield c
@@ -0,0 +1,29 @@
+import io
+
+from PIL import Image
+
+from cache import ResultCache, perceptual_hash
+
+
+def gradient_jpeg(quality):
+    image = Image.linear_gradient("L").resize((320, 240)).convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def test_near_duplicate_jpegs_share_phash():
+    a, b = perceptual_hash(gradient_jpeg(95)), perceptual_hash(gradient_jpeg(70))
+    assert (a ^ b).bit_count() <= 4
+
+
+def test_phash_match_stays_inside_partition():
+    cache = ResultCache(max_entries=10, ttl=60, max_bytes=1 << 20, phash_distance=4)
+    phash = perceptual_hash(gradient_jpeg(95))
+    cache.put("default:1:aaa", {"result": "healthy"}, phash, partition="default:1")
+
+    assert cache.get("default:1:bbb", phash, partition="default:1") == {"result": "healthy"}
+    # Version mới (reload) hoặc model khác: không dùng kết quả cũ
+    assert cache.get("default:2:bbb", phash, partition="default:2") is None
+    assert cache.get("fast:1:bbb", phash, partition="fast:1") is None
+    assert cache.stats()["phash_hits"] == 1
@@ -0,0 +1,31 @@
+import random
+
+import pytest
+
+from utils import load_dataset
+
+
+@pytest.fixture
+def data_root(tmp_path):
+    for name in ("Bacterial", "fungal", "healthy"):
+        (tmp_path / name).mkdir()
+        for i in range(10):
+            (tmp_path / name / f"{i}.jpg").write_bytes(b"")
+    return str(tmp_path)
+
+
+def test_split_follows_seed(data_root):
+    first = load_dataset(data_root, eval_per_class=2, seed=1)
+    assert load_dataset(data_root, eval_per_class=2, seed=1) == first
+    assert load_dataset(data_root, eval_per_class=2, seed=2) != first
+    train_paths, _, eval_paths, eval_labels = first
+    assert len(eval_paths) == 6 and sorted(eval_labels) == [0, 0, 1, 1, 2, 2]
+    assert not set(train_paths) & set(eval_paths)
+
+
+def test_split_leaves_global_rng_alone(data_root):
+    random.seed(123)
+    expected = random.random()
+    random.seed(123)
+    load_dataset(data_root, eval_per_class=2, seed=7)
+    assert random.random() == expected
@@ -0,0 +1,159 @@
+from bulk_inference import ID2LABEL
+from conftest import image_bytes
+from test_cache import gradient_jpeg
+
+
+def multipart(images):
+    return [("files", (f"img{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+
+
+def length_prefixed(images):
+    return b"".join(len(data).to_bytes(4, "big") + data for data in images)
+
+
+def test_inference_single(client):
+    response = client.post("/inference", content=image_bytes(seed=1), headers={"content-type": "image/jpeg"})
+    assert response.status_code == 200, response.text
+    assert response.json()["result"] in ID2LABEL.values()
+
+
+def test_inference_corrupt_image_returns_400(client):
+    data = image_bytes(seed=2)
+    response = client.post("/inference", content=data[:len(data) // 2], headers={"content-type": "image/jpeg"})
+    assert response.status_code == 400, response.text
+
+
+def test_inference_unsupported_type_returns_415(client):
+    response = client.post("/inference", content=b"not an image", headers={"content-type": "image/jpeg"})
+    assert response.status_code == 415
+
+
+def test_batch_multipart_keeps_order_and_per_image_errors(client):
+    images = [image_bytes(seed=10), b"not an image", image_bytes(seed=11)]
+    response = client.post("/inference/batch", files=multipart(images))
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert "error" in results[1]
+    assert "result" in results[0] and "result" in results[2]
+
+
+def test_batch_length_prefixed(client):
+    images = [image_bytes(seed=20 + i) for i in range(3)]
+    response = client.post("/inference/batch", content=length_prefixed(images),
+                           headers={"content-type": "application/x-length-prefixed"})
+    assert response.status_code == 200, response.text
+    assert len(response.json()["results"]) == 3
+
+
+def test_batch_truncated_stream_returns_400(client):
+    body = length_prefixed([image_bytes(seed=30)])[:-10]
+    response = client.post("/inference/batch", content=body,
+                           headers={"content-type": "application/x-length-prefixed"})
+    assert response.status_code == 400
+
+
+def test_batch_over_model_queue_returns_503(client):
+    # MODEL_MAX_PENDING=4 (conftest): 5 ảnh không vào được queue model
+    response = client.post("/inference/batch", files=multipart([image_bytes(seed=40 + i) for i in range(5)]))
+    assert response.status_code == 503, response.text
+    assert response.headers["retry-after"] == "1"
+    response = client.post("/inference/batch", files=multipart([image_bytes(seed=40 + i) for i in range(4)]))
+    assert response.status_code == 200, response.text
+
+
+ADMIN = {"x-admin-token": "test-admin-token"}
+
+
+def test_reload_swaps_model(client, checkpoint_factory):
+    before = client.get("/models").json()["models"]["default"]
+    checkpoint_factory("model_v2.pth")
+    response = client.post("/models/default/reload", json={"path": "model_v2.pth"}, headers=ADMIN)
+    assert response.status_code == 200, response.text
+    after = client.get("/models").json()["models"]["default"]
+    assert after["path"].endswith("model_v2.pth")
+    assert after["version"] == before["version"] + 1
+    response = client.post("/inference", content=image_bytes(seed=50), headers={"content-type": "image/jpeg"})
+    assert response.status_code == 200, response.text
+
+
+def test_reload_requires_admin_token(client):
+    assert client.post("/models/default/reload").status_code == 403
+    assert client.post("/models/default/reload", headers={"x-admin-token": "wrong"}).status_code == 403
+
+
+def test_reload_rejects_bad_body(client):
+    response = client.post("/models/default/reload", content=b"{not json",
+                           headers={"content-type": "application/json", **ADMIN})
+    assert response.status_code == 400
+    response = client.post("/models/default/reload", json=["path"], headers=ADMIN)
+    assert response.status_code == 400
+    response = client.post("/models/default/reload", json={"backend": "pickle"}, headers=ADMIN)
+    assert response.status_code == 400
+
+
+def test_reload_rejects_path_outside_model_dir(client, tmp_path):
+    outside = tmp_path / "evil.pth"
+    outside.write_bytes(b"x")
+    for path in (str(outside), "../" + outside.name, "/etc/passwd"):
+        response = client.post("/models/default/reload", json={"path": path}, headers=ADMIN)
+        assert response.status_code == 400, (path, response.text)
+
+
+def test_reload_unknown_model_returns_404(client, checkpoint_factory):
+    checkpoint_factory("model_new.pth")
+    response = client.post("/models/nope/reload", json={"path": "model_new.pth"}, headers=ADMIN)
+    assert response.status_code == 404
+    assert "nope" not in client.get("/models").json()["models"]
+
+
+def test_reload_misses_phash_cache_for_near_duplicate(client, checkpoint_factory, monkeypatch):
+    import cache
+    import inference
+
+    monkeypatch.setattr(inference, "result_cache", cache.ResultCache())
+    monkeypatch.setattr(cache, "RESULT_CACHE_PHASH", True)
+    headers = {"content-type": "image/jpeg"}
+
+    assert client.post("/inference", content=gradient_jpeg(95), headers=headers).json().get("cached") is None
+    # Bytes khác nhưng phash gần: trúng cache cùng version
+    assert client.post("/inference", content=gradient_jpeg(70), headers=headers).json()["cached"] is True
+
+    checkpoint_factory("model_v3.pth")
+    response = client.post("/models/default/reload", json={"path": "model_v3.pth"}, headers=ADMIN)
+    assert response.status_code == 200, response.text
+    assert client.post("/inference", content=gradient_jpeg(80), headers=headers).json().get("cached") is None
+
+
+def test_thumbnail_dropped_when_io_pool_full(client, monkeypatch):
+    import inference
+    from runtime import Overloaded
+
+    def full():
+        raise Overloaded("io queue full")
+
+    def no_inline_thumbnail(*args):
+        raise AssertionError("thumbnail must not be encoded on the event loop")
+
+    monkeypatch.setattr(inference, "ARCHIVE_MODE", "thumbnail")
+    monkeypatch.setattr(inference.io_pool, "try_acquire", full)
+    monkeypatch.setattr(inference, "make_thumbnail", no_inline_thumbnail)
+    response = client.post("/inference", content=image_bytes(seed=60), headers={"content-type": "image/jpeg"})
+    assert response.status_code == 200, response.text
+    assert response.json()["saved_image"] is None
+
+
+def test_forward_runs_through_model_pool(client, monkeypatch):
+    import inference
+
+    calls = []
+    run = inference.model_pool.run
+
+    async def counting_run(fn, *args):
+        calls.append(fn)
+        return await run(fn, *args)
+
+    monkeypatch.setattr(inference.model_pool, "run", counting_run)
+    response = client.post("/inference", content=image_bytes(seed=61), headers={"content-type": "image/jpeg"})
+    assert response.status_code == 200, response.text
+    assert calls and inference.model_pool.pending == 0
@@ -0,0 +1,50 @@
+import os
+
+from conftest import image_bytes
+from manifest import CLASS_DIRS, manifest_samples, update_manifest
+
+
+def make_dataset(root, files):
+    for class_name in CLASS_DIRS.values():
+        os.makedirs(os.path.join(root, class_name), exist_ok=True)
+    for relpath, data in files.items():
+        with open(os.path.join(root, relpath), "wb") as f:
+            f.write(data)
+
+
+def test_truncated_jpeg_is_excluded(tmp_path):
+    jpeg = image_bytes("JPEG")
+    healthy = CLASS_DIRS[2]
+    make_dataset(str(tmp_path), {
+        f"{healthy}/ok.jpg": jpeg,
+        f"{healthy}/truncated.jpg": jpeg[:len(jpeg) // 2],
+        f"{healthy}/notes.txt": b"not an image",
+    })
+    entries = update_manifest(str(tmp_path))
+    paths, labels = manifest_samples(entries)
+    assert [os.path.basename(p) for p in paths] == ["ok.jpg"]
+    assert labels == [2]
+
+
+def test_rescan_reuses_unchanged_entries(tmp_path, capsys):
+    make_dataset(str(tmp_path), {f"{CLASS_DIRS[0]}/{i}.jpg": image_bytes(seed=i) for i in range(3)})
+    update_manifest(str(tmp_path))
+    capsys.readouterr()
+    update_manifest(str(tmp_path))
+    assert "3 reused, 0 inspected" in capsys.readouterr().out
+
+
+def test_s3_rescan_reuses_entries_by_etag(tmp_path, capsys):
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="dataset-bucket")
+        for i in range(3):
+            s3.put_object(Bucket="dataset-bucket", Key=f"leaves/{CLASS_DIRS[1]}/{i}.jpg", Body=image_bytes(seed=i))
+        manifest_path = str(tmp_path / "manifest.json")
+        update_manifest("s3://dataset-bucket/leaves", manifest_path)
+        capsys.readouterr()
+        update_manifest("s3://dataset-bucket/leaves", manifest_path)
+        assert "3 reused, 0 inspected" in capsys.readouterr().out
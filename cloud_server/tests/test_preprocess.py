@@ -0,0 +1,36 @@
+import io
+
+import pytest
+import torch
+from PIL import Image
+
+from conftest import image_bytes
+from preprocess import DecodeError, preprocess, preprocess_batch
+from utils import transform
+
+
+@pytest.mark.parametrize("size", [(300, 200), (224, 224), (64, 96)])
+def test_preprocess_matches_utils_transform(size):
+    image = Image.open(io.BytesIO(image_bytes("PNG", size)))
+    expected = transform(image.convert("RGB"))
+    assert torch.allclose(preprocess(image), expected, atol=1e-5)
+
+
+def test_preprocess_png_bytes_matches_utils_transform():
+    data = image_bytes("PNG")
+    expected = transform(Image.open(io.BytesIO(data)).convert("RGB"))
+    assert torch.allclose(preprocess(data), expected, atol=1e-5)
+
+
+def test_preprocess_batch_matches_single():
+    images = [image_bytes("PNG", seed=i) for i in range(3)]
+    batch = preprocess_batch(images)
+    assert batch.shape == (3, 3, 224, 224)
+    for i, data in enumerate(images):
+        assert torch.equal(batch[i], preprocess(data))
+
+
+def test_truncated_jpeg_raises_decode_error():
+    data = image_bytes("JPEG")
+    with pytest.raises(DecodeError):
+        preprocess(data[:len(data) // 2])
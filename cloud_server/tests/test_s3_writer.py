@@ -0,0 +1,136 @@
+import json
+import os
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from s3_writer import WriteBehindQueue, make_job
+
+BUCKET = "writer-bucket"
+POINTER = "latest/plant/image.json"
+
+
+class FlakyS3:
+    """Bọc client moto: `failures[key]` lần put_object đầu tiên của key đó lỗi; ghi lại thứ tự PUT thành công."""
+
+    def __init__(self, client, failures=None):
+        self.client = client
+        self.failures = dict(failures or {})
+        self.put_keys = []
+
+    def put_object(self, **kwargs):
+        if self.failures.get(kwargs["Key"], 0) > 0:
+            self.failures[kwargs["Key"]] -= 1
+            raise ConnectionError("simulated S3 outage")
+        response = self.client.put_object(**kwargs)
+        self.put_keys.append(kwargs["Key"])
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_queue(client, spill_dir, **kwargs):
+    kwargs.setdefault("max_retries", 3)
+    return WriteBehindQueue(BUCKET, s3_client=client, workers=2, spill_dir=str(spill_dir),
+                            backoff_base=0.01, backoff_max=0.02, **kwargs)
+
+
+def pointer(updated_at, key="images/1.jpg"):
+    body = json.dumps({"key": key, "updated_at": updated_at}).encode("utf-8")
+    return make_job(POINTER, body, content_type="application/json", stage="s3_pointer_upload", if_newer="updated_at")
+
+
+def read_json(s3, key):
+    return json.loads(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_retry_then_pointer_after_target(s3, tmp_path):
+    flaky = FlakyS3(s3, failures={"images/1.jpg": 2})
+    writer = make_queue(flaky, tmp_path)
+    writer.start()
+    writer.put("images/1.jpg", b"jpeg", then=[pointer("2026-01-01T00:00:00.000Z")])
+    writer.stop()
+
+    assert flaky.put_keys == ["images/1.jpg", POINTER]
+    assert read_json(s3, POINTER)["key"] == "images/1.jpg"
+    stats = writer.stats()
+    assert stats["retried"] == 2 and stats["uploaded"] == 2 and stats["spill_depth"] == 0
+
+
+def test_failed_target_spills_with_pointer_and_reloads(s3, tmp_path):
+    flaky = FlakyS3(s3, failures={"images/1.jpg": 10})
+    writer = make_queue(flaky, tmp_path, max_retries=1)
+    writer.start()
+    writer.put("images/1.jpg", b"jpeg", then=[pointer("2026-01-01T00:00:00.000Z")])
+    writer.stop()
+
+    # Object chưa lên S3 thì pointer cũng chưa được ghi; cả hai nằm chung một file spill
+    assert flaky.put_keys == []
+    assert writer.stats()["spill_depth"] == 1
+    (meta_name,) = [f for f in os.listdir(tmp_path) if f.endswith(".json")]
+    with open(tmp_path / meta_name) as f:
+        assert [j["key"] for j in json.load(f)["then"]] == [POINTER]
+
+    # Lần khởi động sau S3 đã ổn: nạp lại từ đĩa, object trước rồi mới tới pointer
+    flaky.failures.clear()
+    reloaded = make_queue(flaky, tmp_path)
+    reloaded.start()
+    wait_for(lambda: POINTER in flaky.put_keys)
+    reloaded.stop()
+    assert flaky.put_keys == ["images/1.jpg", POINTER]
+    assert s3.get_object(Bucket=BUCKET, Key="images/1.jpg")["Body"].read() == b"jpeg"
+    assert reloaded.stats()["spill_depth"] == 0
+
+
+def test_full_queue_spills_to_disk(s3, tmp_path):
+    writer = make_queue(s3, tmp_path, max_queue=1)
+    # Chưa start: job thứ hai không vào được queue nên ghi xuống đĩa; stop() spill nốt job còn trong queue
+    writer.put("results/1.txt", b"a")
+    writer.put("results/2.txt", b"b")
+    assert writer.stats()["spill_depth"] == 1
+    writer.stop(timeout=0)
+    assert writer.stats()["spill_depth"] == 2
+
+    reloaded = make_queue(s3, tmp_path)
+    reloaded.start()
+    wait_for(lambda: reloaded.stats()["uploaded"] == 2)
+    reloaded.stop()
+    assert s3.get_object(Bucket=BUCKET, Key="results/2.txt")["Body"].read() == b"b"
+
+
+def test_older_pointer_does_not_overwrite_newer(s3, tmp_path):
+    writer = make_queue(s3, tmp_path)
+    writer.start()
+    writer.put("images/2.jpg", b"new", then=[pointer("2026-01-01T00:00:02.000Z", key="images/2.jpg")])
+    writer.stop()
+    # Pointer cũ tới muộn (retry / spill nạp lại) không kéo pointer lùi lại
+    writer.start()
+    writer.put("images/1.jpg", b"old", then=[pointer("2026-01-01T00:00:01.000Z", key="images/1.jpg")])
+    writer.stop()
+
+    assert read_json(s3, POINTER)["key"] == "images/2.jpg"
+    assert writer.stats()["stale_skipped"] == 1
+
+    # Pointer mới hơn thì ghi đè (PUT có điều kiện If-Match trên ETag hiện tại)
+    writer.start()
+    writer.put("images/3.jpg", b"newer", then=[pointer("2026-01-01T00:00:03.000Z", key="images/3.jpg")])
+    writer.stop()
+    assert read_json(s3, POINTER)["key"] == "images/3.jpg"
@@ -0,0 +1,204 @@
+"""
+Train Model2Class trên dataset (Bacterial / fungal / healthy).
+
+Checkpoint best.pth / last.pth là state_dict thuần (fp32, contiguous), load được
+trực tiếp bởi inference.py (MODEL_PATH) và backends.load_model("eager", ...).
+resume.pth chứa thêm optimizer/scheduler/epoch để chạy tiếp (--resume).
+
+Ví dụ (chạy trong thư mục cloud_server):
+    python train.py --data-root dataset --model resnet18 --epochs 20 --amp --channels-last
+    python train.py --data-root dataset --device cpu --workers 2 --batch-size 16 --accum-steps 4
+    python train.py --data-root dataset --deterministic       # tái lập được, chậm hơn
+"""
+import argparse
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+from custom_dataset import CustomDataset
+from model import Model2Class, model_dict
+from utils import load_dataset, set_seed, transform
+
+train_transform = transforms.Compose([
+    transforms.RandomHorizontalFlip(),
+    transforms.RandomRotation(10),
+    transform,
+])
+
+
+def make_loader(paths, labels, tfm, args, shuffle, device, cache=None):
+    return DataLoader(
+        CustomDataset(paths, labels, tfm, cache=cache),
+        batch_size=args.batch_size,
+        shuffle=shuffle,
+        num_workers=args.workers,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=args.prefetch if args.workers > 0 else None,
+        persistent_workers=args.workers > 0,
+        drop_last=False,
+    )
+
+
+def autocast(device, enabled):
+    # CUDA: fp16 (+ GradScaler); CPU: bf16, không cần scaler
+    dtype = torch.float16 if device.type == "cuda" else torch.bfloat16
+    return torch.autocast(device_type=device.type, dtype=dtype, enabled=enabled)
+
+
+def export_state_dict(model):
+    """State dict fp32, contiguous: giống hệt checkpoint train cũ, không phụ thuộc channels-last."""
+    return {k: v.detach().float().contiguous().cpu() if v.is_floating_point() else v.detach().cpu()
+            for k, v in model.state_dict().items()}
+
+
+def train_one_epoch(model, loader, criterion, optimizer, scaler, device, args):
+    model.train()
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    total_loss, correct, seen = 0.0, 0, 0
+    optimizer.zero_grad(set_to_none=True)
+    steps = len(loader)
+    started = time.perf_counter()
+    for step, (images, labels) in enumerate(loader, 1):
+        images = images.to(device, non_blocking=True, memory_format=memory_format)
+        labels = labels.to(device, non_blocking=True)
+        with autocast(device, args.amp):
+            outputs = model(images)
+            loss = criterion(outputs, labels)
+        # Gradient accumulation: chia loss để gradient tương đương batch_size * accum_steps
+        scaler.scale(loss / args.accum_steps).backward()
+        if step % args.accum_steps == 0 or step == steps:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+
+        total_loss += loss.item() * labels.size(0)
+        correct += (outputs.argmax(dim=1) == labels).sum().item()
+        seen += labels.size(0)
+    elapsed = time.perf_counter() - started
+    return total_loss / max(seen, 1), correct / max(seen, 1), seen / max(elapsed, 1e-9)
+
+
+@torch.inference_mode()
+def evaluate(model, loader, criterion, device, args):
+    model.eval()
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    total_loss, correct, seen = 0.0, 0, 0
+    started = time.perf_counter()
+    for images, labels in loader:
+        images = images.to(device, non_blocking=True, memory_format=memory_format)
+        labels = labels.to(device, non_blocking=True)
+        with autocast(device, args.amp):
+            outputs = model(images)
+        total_loss += criterion(outputs.float(), labels).item() * labels.size(0)
+        correct += (outputs.argmax(dim=1) == labels).sum().item()
+        seen += labels.size(0)
+    elapsed = time.perf_counter() - started
+    return total_loss / max(seen, 1), correct / max(seen, 1), seen / max(elapsed, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-root", required=True, help="thư mục dataset hoặc s3://bucket/prefix")
+    parser.add_argument("--model", default="resnet18", choices=list(model_dict))
+    parser.add_argument("--no-pretrained", action="store_true", help="không tải ImageNet weights")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--accum-steps", type=int, default=1, help="số batch cộng dồn gradient trước mỗi step")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--eval-per-class", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--prefetch", type=int, default=2, help="prefetch_factor mỗi worker")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = mặc định)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--amp", action="store_true", help="mixed precision (fp16 trên CUDA, bf16 trên CPU)")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="cuDNN deterministic, tắt benchmark (mặc định: chế độ nhanh)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache-dir", default=None, help="dùng tensor_cache.ImageCache cho ảnh đã decode")
+    parser.add_argument("--manifest", default=None, help="đường dẫn manifest (manifest.py); bắt buộc với s3://")
+    parser.add_argument("--out-dir", default="checkpoints")
+    parser.add_argument("--resume", action="store_true", help="chạy tiếp từ <out-dir>/resume.pth")
+    args = parser.parse_args()
+
+    if args.accum_steps < 1:
+        parser.error("--accum-steps must be >= 1")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    set_seed(args.seed, deterministic=args.deterministic)
+    device = torch.device(args.device)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    train_paths, train_labels, eval_paths, eval_labels = load_dataset(
+        args.data_root, eval_per_class=args.eval_per_class, seed=args.seed, manifest_path=args.manifest)
+
+    train_cache = eval_cache = None
+    if args.cache_dir:
+        from tensor_cache import ImageCache
+
+        from manifest import load_manifest
+
+        # Entries của manifest cho fingerprint path s3:// (size + ETag, không HEAD từng object)
+        entries = load_manifest(args.manifest)
+        train_cache = ImageCache.build_or_load(train_paths, args.cache_dir, "train", entries=entries)
+        eval_cache = ImageCache.build_or_load(eval_paths, args.cache_dir, "eval", entries=entries)
+    train_loader = make_loader(train_paths, train_labels, train_transform, args, True, device, train_cache)
+    eval_loader = make_loader(eval_paths, eval_labels, transform, args, False, device, eval_cache)
+
+    model = Model2Class(args.model, pretrained=not args.no_pretrained).to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    # GradScaler chỉ cần cho fp16 trên CUDA; enabled=False thì scale/step là no-op
+    scaler = torch.amp.GradScaler(device.type, enabled=args.amp and device.type == "cuda")
+
+    start_epoch, best_acc = 1, 0.0
+    resume_path = os.path.join(args.out_dir, "resume.pth")
+    if args.resume and os.path.exists(resume_path):
+        state = torch.load(resume_path, map_location=device, weights_only=True)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        scaler.load_state_dict(state["scaler"])
+        start_epoch, best_acc = state["epoch"] + 1, state["best_acc"]
+        print(f"Resumed from {resume_path} at epoch {start_epoch}")
+
+    print(f"device={device} amp={args.amp} channels_last={args.channels_last} "
+          f"deterministic={args.deterministic} workers={args.workers} "
+          f"batch={args.batch_size}x{args.accum_steps}")
+    for epoch in range(start_epoch, args.epochs + 1):
+        train_loss, train_acc, train_ips = train_one_epoch(
+            model, train_loader, criterion, optimizer, scaler, device, args)
+        eval_loss, eval_acc, eval_ips = evaluate(model, eval_loader, criterion, device, args)
+        scheduler.step()
+
+        print(f"Epoch {epoch}/{args.epochs} | train loss {train_loss:.4f} acc {train_acc:.4f} "
+              f"({train_ips:.1f} img/s) | eval loss {eval_loss:.4f} acc {eval_acc:.4f} ({eval_ips:.1f} img/s)")
+
+        state_dict = export_state_dict(model)
+        torch.save(state_dict, os.path.join(args.out_dir, "last.pth"))
+        if eval_acc >= best_acc:
+            best_acc = eval_acc
+            torch.save(state_dict, os.path.join(args.out_dir, "best.pth"))
+            print(f"  saved best.pth (acc {best_acc:.4f})")
+        torch.save({
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "scaler": scaler.state_dict(),
+            "epoch": epoch,
+            "best_acc": best_acc,
+        }, resume_path)
+
+    print(f"Best eval acc {best_acc:.4f} -> {os.path.join(args.out_dir, 'best.pth')}")
+
+
+if __name__ == "__main__":
+    main()
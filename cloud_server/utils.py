@@ -5,16 +5,28 @@ import os
 from collections import Counter
 from torchvision import transforms
 
-def set_seed(seed=42):
+def set_seed(seed=42, deterministic=True):
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
     torch.cuda.manual_seed_all(seed)
-    torch.backends.cudnn.deterministic = True
-    torch.backends.cudnn.benchmark = False
+    # deterministic=False: cho cuDNN tự chọn kernel nhanh nhất (benchmark), kết quả có thể lệch nhẹ giữa các lần chạy
+    torch.backends.cudnn.deterministic = deterministic
+    torch.backends.cudnn.benchmark = not deterministic
 
-def load_dataset(root_dir, eval_per_class=100, seed=42):
-    random.seed(seed)
+def load_dataset(root_dir, eval_per_class=100, seed=42, manifest_path=None, use_manifest=False):
+    """
+    Trả về train_paths, train_labels, eval_paths, eval_labels.
+
+    use_manifest=True (hoặc có manifest_path, hoặc root_dir là s3://...): dùng manifest
+    incremental (manifest.py), bỏ file không phải ảnh / ảnh hỏng, path được sắp xếp
+    nên split chỉ phụ thuộc seed. Split dùng RNG riêng, không đụng RNG global đã set_seed.
+    """
+    if use_manifest or manifest_path or root_dir.startswith("s3://"):
+        from manifest import manifest_samples, update_manifest
+
+        all_paths, all_labels = manifest_samples(update_manifest(root_dir, manifest_path))
+        return _split_dataset(all_paths, all_labels, eval_per_class, seed)
 
     all_paths = []
     all_labels = []
@@ -31,6 +43,12 @@ def load_dataset(root_dir, eval_per_class=100, seed=42):
             all_paths.append(os.path.join(class_dir, f))
             all_labels.append(label)
 
+    return _split_dataset(all_paths, all_labels, eval_per_class, seed)
+
+
+def _split_dataset(all_paths, all_labels, eval_per_class, seed):
+    # Cùng chuỗi số với random.seed(seed) + random.shuffle trước đây: split cũ không đổi
+    rng = random.Random(seed)
     # Gom theo class
     class_to_indices = {0: [], 1: [], 2: []}
     for idx, lbl in enumerate(all_labels):
@@ -39,7 +57,7 @@ def load_dataset(root_dir, eval_per_class=100, seed=42):
     # Chọn eval set cố định
     eval_idx = []
     for cls, indices in class_to_indices.items():
-        random.shuffle(indices)
+        rng.shuffle(indices)
         if len(indices) < eval_per_class:
             raise ValueError(f"Class {cls} không đủ {eval_per_class} ảnh!")
         eval_idx.extend(indices[:eval_per_class])
@@ -50,8 +68,8 @@ def load_dataset(root_dir, eval_per_class=100, seed=42):
     train_idx = [i for i in range(len(all_paths)) if i not in eval_idx_set]
 
     # Shuffle train và eval
-    random.shuffle(train_idx)
-    random.shuffle(eval_idx)
+    rng.shuffle(train_idx)
+    rng.shuffle(eval_idx)
 
     # Lấy path/label
     train_paths = [all_paths[i] for i in train_idx]